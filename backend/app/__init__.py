@@ -9,6 +9,10 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # 註冊 JSON provider (orjson，可直接序列化 NumPy 陣列與日期)
+    from . import json_provider
+    json_provider.init_app(app)
+
     # 啟用 CORS (允許跨網域請求，這樣您的前端才能呼叫 API)
     CORS(app)
 
@@ -18,6 +22,33 @@ def create_app(config_class=Config):
     from . import db
     db.init_app(app)
 
+    # 註冊價格矩陣 (共享記憶體) 的位置
+    from . import price_store
+    price_store.init_app(app)
+
+    # 註冊回應快取與壓縮 (快取中保存壓縮後的 bytes，每筆快取只壓縮一次)
+    # 快取未命中時，相同的並行請求合併成一次計算 (coalesce)
+    from . import response_cache, compression, coalesce
+    response_cache.init_app(app)
+    coalesce.init_app(app)
+    compression.init_app(app)
+
+    # 註冊准入控制 (分析 API 的同時執行上限與等待佇列)
+    from . import admission
+    admission.init_app(app)
+
+    # 註冊 `flask warm-cache` 指令 (價格寫入後預先計算分析結果)
+    from . import warmup
+    warmup.init_app(app)
+
+    # 註冊 `flask refresh-portfolio-stats` 指令 (組合統計與每日價值快照)
+    from . import incremental
+    incremental.init_app(app)
+
+    # 註冊即時報價串流 (SSE) 的報價來源與連線上限
+    from . import quote_stream
+    quote_stream.init_app(app)
+
     # 註冊 API 路由 (Blueprint)
     from . import routes
     app.register_blueprint(routes.api_v1)
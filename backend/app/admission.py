@@ -0,0 +1,363 @@
+import functools
+import math
+import threading
+import time
+from collections import deque
+from flask import g, jsonify, request
+
+# ---------------------------------------------------------
+# 准入控制 (Admission control / load shedding)
+# ---------------------------------------------------------
+# 模擬、建議、回測等分析 API 是 CPU-bound，同時跑太多個會拖慢整個 worker，
+# 連帶讓 CRUD API (登入、自選股、持股更新) 的延遲一起變差。
+# 每一組分析 API (gate) 有自己的同時執行上限與有界的等待佇列 (FIFO)：
+#   - 還有空位           -> 直接執行
+#   - 沒有空位、佇列未滿 -> 排隊，最多等 queue_timeout 秒
+#   - 佇列已滿 / 等待逾時 -> 503 + Retry-After
+# 另外限制同一個來源 IP 同時進行中的分析請求數，超過時回傳 429 (不採用用戶端自己帶的 header，
+# 例如 X-User-Id，否則換一個值就能繞過；在反向代理後面時以 ADMISSION_PROXY_HOPS 取得真正的來源)。
+# 上限都是「每個 worker 行程」各自計算；CRUD API 不經過 gate。
+# 排隊中的請求也佔用一個 gunicorn 執行緒，各 gate 的 (執行 + 排隊) 加起來可能超過執行緒數，
+# 因此所有 gate 另外共用一個「執行中 + 排隊中」的總上限 (WorkerBudget)，由執行緒數推得:
+#   總上限 = GUNICORN_THREADS - 串流連線上限 - 保留執行緒數
+# 達到總上限時不排隊，直接回傳 503，保證至少有「保留執行緒數」個執行緒留給 CRUD API。
+# 回應快取 (cached_response) 在外層合併相同請求，等待別人計算結果的請求同樣佔用執行緒，
+# 因此快取未命中時就先取得名額 (claim_worker_slot)，同一個請求只佔用一個名額。
+
+DEFAULT_LIMITS = {
+    'max_concurrent': 2,
+    'max_queue': 4,
+    'queue_timeout': 10.0,
+}
+DEFAULT_PER_USER = 2
+# 留給不經過 gate 的 API (登入、自選股、持股更新...) 的執行緒數
+DEFAULT_RESERVED_THREADS = 2
+
+# 平均執行時間的平滑係數 (用來估計 Retry-After)
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """請求被拒絕 (reason: queue_full / timeout / user / threads)"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """一組 API 共用的同時執行上限 + 有界 FIFO 等待佇列 (thread-safe)"""
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self.active = 0
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = {'queue_full': 0, 'timeout': 0, 'user': 0, 'threads': 0}
+        self.queued = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_queue = 0
+        self.service_seconds = None
+
+    def retry_after(self):
+        """依照平均執行時間與排隊人數估計多久後再試 (秒，至少 1)"""
+        service = self.service_seconds or 1.0
+        rounds = (len(self._queue) + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(service * rounds))
+
+    def acquire(self):
+        """取得執行名額，回傳排隊等待的秒數；無法取得時拋出 Rejected"""
+        with self._cond:
+            if self.active < self.max_concurrent and not self._queue:
+                self.active += 1
+                self.admitted += 1
+                return 0.0
+
+            if len(self._queue) >= self.max_queue:
+                self.rejected['queue_full'] += 1
+                raise Rejected('queue_full', self.retry_after())
+
+            ticket = object()
+            self._queue.append(ticket)
+            self.peak_queue = max(self.peak_queue, len(self._queue))
+            start = time.monotonic()
+            ready = self._cond.wait_for(
+                lambda: self._queue[0] is ticket and self.active < self.max_concurrent,
+                timeout=self.queue_timeout
+            )
+            self._queue.remove(ticket)
+            waited = time.monotonic() - start
+            if not ready:
+                self.rejected['timeout'] += 1
+                # 排在後面的請求可能因此變成隊首
+                self._cond.notify_all()
+                raise Rejected('timeout', self.retry_after())
+
+            self.active += 1
+            self.admitted += 1
+            self.queued += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self._cond.notify_all()
+            return waited
+
+    def reject_user(self):
+        """使用者超過同時請求上限 (計入此 gate 的統計)"""
+        with self._cond:
+            self.rejected['user'] += 1
+            return Rejected('user', self.retry_after())
+
+    def reject_threads(self):
+        """worker 的執行緒總上限已滿 (計入此 gate 的統計)"""
+        with self._cond:
+            self.rejected['threads'] += 1
+            return Rejected('threads', self.retry_after())
+
+    def release(self, elapsed):
+        with self._cond:
+            self.active -= 1
+            self.completed += 1
+            if self.service_seconds is None:
+                self.service_seconds = elapsed
+            else:
+                self.service_seconds += SERVICE_TIME_ALPHA * (elapsed - self.service_seconds)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "maxConcurrent": self.max_concurrent,
+                "maxQueue": self.max_queue,
+                "active": self.active,
+                "waiting": len(self._queue),
+                "peakWaiting": self.peak_queue,
+                "admitted": self.admitted,
+                "completed": self.completed,
+                "rejected": dict(self.rejected),
+                "queued": self.queued,
+                "avgWaitSeconds": round(self.wait_seconds / self.queued, 4) if self.queued else 0.0,
+                "maxWaitSeconds": round(self.max_wait_seconds, 4),
+                "avgServiceSeconds": round(self.service_seconds, 4) if self.service_seconds else None
+            }
+
+
+class UserLimiter:
+    """同一個使用者同時進行中的分析請求數上限 (跨所有 gate)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def acquire(self, user):
+        with self._lock:
+            count = self._inflight.get(user, 0)
+            if self.limit > 0 and count >= self.limit:
+                return False
+            self._inflight[user] = count + 1
+            return True
+
+    def release(self, user):
+        with self._lock:
+            count = self._inflight.get(user, 0) - 1
+            if count > 0:
+                self._inflight[user] = count
+            else:
+                self._inflight.pop(user, None)
+
+
+class WorkerBudget:
+    """所有 gate 共用的「執行中 + 排隊中」請求總上限 (limit 為 None 時不限制)"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.peak = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.limit is not None and self.inflight >= self.limit:
+                return False
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "inflight": self.inflight, "peak": self.peak}
+
+
+_settings = {
+    'enabled': True,
+    'proxy_hops': 0,
+    'defaults': dict(DEFAULT_LIMITS),
+    'overrides': {},
+}
+_gates = {}
+_gates_lock = threading.Lock()
+_users = UserLimiter(DEFAULT_PER_USER)
+_budget = WorkerBudget()
+
+
+def get_gate(name):
+    """取得 (第一次使用時建立) 某一組 API 的 gate"""
+    gate = _gates.get(name)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.get(name)
+            if gate is None:
+                limits = {**_settings['defaults'], **_settings['overrides'].get(name, {})}
+                gate = AdmissionGate(name, **limits)
+                _gates[name] = gate
+    return gate
+
+
+def _user_key():
+    """
+    以來源 IP 區分使用者。X-Forwarded-For 可以由用戶端任意填寫，只採用最後 proxy_hops 個
+    (受信任的反向代理) 加上的那一筆；沒有設定代理時直接使用連線的來源位址。
+    """
+    hops = _settings['proxy_hops']
+    route = request.access_route
+    if hops > 0 and request.headers.get('X-Forwarded-For') and len(route) >= hops:
+        return 'ip:' + route[-hops]
+    return 'ip:' + (request.remote_addr or '')
+
+
+def _reject(rejected):
+    if rejected.reason == 'user':
+        message = "Too many analysis requests in progress for this user, please retry later"
+        status = 429
+    else:
+        message = "Server is busy, please retry later"
+        status = 503
+    response = jsonify({"data": {}, "code": 0, "message": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
+def claim_worker_slot(name):
+    """
+    取得 worker「執行中 + 排隊中」總上限的一個名額 (以 gate name 記錄拒絕次數)。
+    同一個請求只佔用一個名額: 外層 (cached_response) 已經取得時，內層不再重複計算。
+    回傳 (release 函式, None)；總上限已滿時回傳 (None, 503 回應)。
+    """
+    if not _settings['enabled'] or g.get('admission_slot'):
+        return (lambda: None), None
+    if not _budget.acquire():
+        return None, _reject(get_gate(name).reject_threads())
+    g.admission_slot = True
+
+    def release():
+        g.admission_slot = False
+        _budget.release()
+    return release, None
+
+
+def admission_limited(name):
+    """
+    路由 decorator: 以名稱為 name 的 gate 限制同時執行數。
+    放在 cached_response 之後 (內層)，快取命中的請求不佔用名額；
+    cached_response 由 view.admission_gate 得知 gate 名稱，合併等待時也佔用總上限的名額。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return view(*args, **kwargs)
+
+            gate = get_gate(name)
+            user = _user_key()
+            if not _users.acquire(user):
+                return _reject(gate.reject_user())
+
+            try:
+                # 排隊也佔用執行緒，因此在進入 gate (執行或排隊) 之前先取得總上限的名額
+                release_slot, rejected = claim_worker_slot(name)
+                if rejected is not None:
+                    return rejected
+                try:
+                    try:
+                        gate.acquire()
+                    except Rejected as rejected:
+                        return _reject(rejected)
+
+                    start = time.monotonic()
+                    try:
+                        return view(*args, **kwargs)
+                    finally:
+                        gate.release(time.monotonic() - start)
+                finally:
+                    release_slot()
+            finally:
+                _users.release(user)
+        wrapper.admission_gate = name
+        return wrapper
+    return decorator
+
+
+def stats():
+    """所有 gate 的統計 (此 worker 行程)"""
+    with _gates_lock:
+        gates = dict(_gates)
+    return {name: gate.stats() for name, gate in sorted(gates.items())}
+
+
+def worker_stats():
+    """所有 gate 共用的「執行中 + 排隊中」總上限與目前數量 (此 worker 行程)"""
+    return _budget.stats()
+
+
+def worker_budget(threads, stream_clients, reserved):
+    """
+    由 gunicorn 的執行緒數推得「執行中 + 排隊中」的總上限 (至少 1)。
+    threads <= 0 代表執行緒數不固定 (例如開發用伺服器)，回傳 None (不限制)。
+    """
+    if threads <= 0:
+        return None
+    return max(1, threads - stream_clients - reserved)
+
+
+def init_app(app):
+    """
+    讀取准入控制設定 (上限都是每個 worker 行程各自計算):
+        ADMISSION_ENABLED         -> False 時完全不限制
+        ADMISSION_MAX_CONCURRENT  -> 每組 API 同時執行的上限
+        ADMISSION_MAX_QUEUE       -> 每組 API 等待佇列的長度
+        ADMISSION_QUEUE_TIMEOUT   -> 排隊最多等待的秒數
+        ADMISSION_PER_USER        -> 同一來源 IP 同時進行中的分析請求上限 (0 代表不限制)
+        ADMISSION_PROXY_HOPS      -> 前面受信任的反向代理層數 (由 X-Forwarded-For 取得來源 IP，0 代表沒有)
+        ADMISSION_LIMITS          -> 個別 gate 的覆寫值，例如 {"simulation": {"max_concurrent": 1}}
+        ADMISSION_WORKER_THREADS  -> 每個 worker 的執行緒數 (與 GUNICORN_THREADS 相同，0 代表不限制總數)
+        ADMISSION_RESERVED_THREADS -> 保留給其他 API 的執行緒數 (另外扣除 QUOTE_STREAM_MAX_CLIENTS)
+    """
+    _settings['enabled'] = app.config.get('ADMISSION_ENABLED', True)
+    _settings['defaults'] = {
+        'max_concurrent': app.config.get('ADMISSION_MAX_CONCURRENT', DEFAULT_LIMITS['max_concurrent']),
+        'max_queue': app.config.get('ADMISSION_MAX_QUEUE', DEFAULT_LIMITS['max_queue']),
+        'queue_timeout': app.config.get('ADMISSION_QUEUE_TIMEOUT', DEFAULT_LIMITS['queue_timeout']),
+    }
+    _settings['overrides'] = dict(app.config.get('ADMISSION_LIMITS', {}))
+    _users.limit = app.config.get('ADMISSION_PER_USER', DEFAULT_PER_USER)
+    _settings['proxy_hops'] = app.config.get('ADMISSION_PROXY_HOPS', 0)
+    _budget.limit = worker_budget(
+        app.config.get('ADMISSION_WORKER_THREADS', 0),
+        app.config.get('QUOTE_STREAM_MAX_CLIENTS', 0),
+        app.config.get('ADMISSION_RESERVED_THREADS', DEFAULT_RESERVED_THREADS)
+    )
+    with _gates_lock:
+        _gates.clear()
@@ -0,0 +1,157 @@
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from app.db import fetch_columns, EPOCH_TO_DAYS
+
+# ---------------------------------------------------------
+# 多解析度價格彙總 (PriceAggregates)
+# ---------------------------------------------------------
+# 由 HistoricalPrices 產生每週 ('W') / 每月 ('M') 的 OHLCV，在資料寫入時增量更新。
+# 長區間的走勢圖 (例如 10 年) 只需要讀 ~500 筆週資料，而不是 ~2,500 筆日資料。
+# (HistoricalPrices 只有收盤價，因此 open / high / low 取該期間收盤價的第一筆 / 最高 / 最低)
+
+# 每種解析度一年大約有幾個資料點 (由粗到細)
+POINTS_PER_YEAR = {'M': 12, 'W': 52, 'D': 252}
+
+# 每筆日資料所屬期間的第一天 (週: 星期一, 月: 1 號)
+PERIOD_START_SQL = {
+    'W': "DATE_SUB(date, INTERVAL WEEKDAY(date) DAY)",
+    'M': "DATE_SUB(date, INTERVAL DAYOFMONTH(date) - 1 DAY)",
+}
+
+
+def period_start(day, resolution):
+    """回傳 day 所屬期間 (週 / 月) 的第一天 (day 可為 date 或 'YYYY-MM-DD')"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    if resolution == 'W':
+        return day - timedelta(days=day.weekday())
+    if resolution == 'M':
+        return day.replace(day=1)
+    return day
+
+
+def choose_resolution(first_date, points, last_date=None):
+    """
+    依照需要的資料點數，選出「仍能提供至少 points 個點」的最粗解析度。
+    沒有指定 points 時一律回傳日資料 ('D')。
+    """
+    if not points or first_date is None:
+        return 'D'
+
+    last_date = last_date or date.today()
+    years = max((last_date - first_date).days, 0) / 365.25
+    for resolution in ('M', 'W'):
+        if years * POINTS_PER_YEAR[resolution] >= points:
+            return resolution
+    return 'D'
+
+
+def refresh_aggregates(connection, tickers=None, since=None):
+    """
+    重新計算 (指定股票 / 自 since 所屬期間起的) 週、月彙總，並寫回 PriceAggregates。
+    資料寫入流程 (seed.py) 在寫入新價格後，於同一個 transaction 中呼叫。
+    """
+    cursor = connection.cursor()
+    for resolution, start_expr in PERIOD_START_SQL.items():
+        where = ["1 = 1"]
+        params = []
+        if tickers:
+            where.append(f"ticker_symbol IN ({','.join(['%s'] * len(tickers))})")
+            params.extend(tickers)
+        if since is not None:
+            where.append("date >= %s")
+            params.append(period_start(since, resolution))
+
+        # GROUP_CONCAT(... ORDER BY date) 取期間內的第一筆 / 最後一筆收盤價
+        sql = f"""
+            INSERT INTO PriceAggregates
+                (ticker_symbol, resolution, period_start, period_end,
+                 `open`, high, low, `close`, adjusted_close, volume)
+            SELECT
+                ticker_symbol,
+                '{resolution}',
+                period_start,
+                MAX(date),
+                SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date ASC), ',', 1),
+                MAX(`close`),
+                MIN(`close`),
+                SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date DESC), ',', 1),
+                SUBSTRING_INDEX(GROUP_CONCAT(adjusted_close ORDER BY date DESC), ',', 1),
+                SUM(volume)
+            FROM (
+                SELECT ticker_symbol, date, `close`, adjusted_close, volume,
+                       {start_expr} AS period_start
+                FROM AllHistoricalPrices
+                WHERE {' AND '.join(where)}
+            ) t
+            GROUP BY ticker_symbol, period_start
+            ON DUPLICATE KEY UPDATE
+                period_end = VALUES(period_end),
+                `open` = VALUES(`open`),
+                high = VALUES(high),
+                low = VALUES(low),
+                `close` = VALUES(`close`),
+                adjusted_close = VALUES(adjusted_close),
+                volume = VALUES(volume)
+        """
+        cursor.execute(sql, tuple(params))
+    cursor.close()
+
+
+def resample_frame(df, resolution):
+    """
+    把日資料表格 (Index=Date, Columns=Ticker) 轉成週 / 月資料：
+    每個期間取各股票最後一筆價格，並以該期間最後一個交易日作為日期。
+    (與 PriceAggregates 的 adjusted_close / period_end 定義相同)
+    """
+    if df is None or resolution == 'D':
+        return df
+
+    freq = 'W-SUN' if resolution == 'W' else 'M'
+    key = df.index.to_period(freq)
+    grouped = df.groupby(key)
+    result = grouped.last()
+    result.index = pd.DatetimeIndex(
+        pd.Series(df.index, index=df.index).groupby(key).max().values, name='date'
+    )
+    result.columns.name = df.columns.name
+    return result
+
+
+def fetch_aggregate_frame(connection, tickers, resolution, start_date=None):
+    """
+    從 PriceAggregates 讀取週 / 月調整收盤價 (Index=期間最後交易日, Columns=Ticker)。
+    找不到任何資料時回傳 None。
+    """
+    sql = f"""
+        SELECT TO_DAYS(period_start) - {EPOCH_TO_DAYS},
+               TO_DAYS(period_end) - {EPOCH_TO_DAYS},
+               ticker_symbol,
+               CAST(adjusted_close AS DOUBLE)
+        FROM PriceAggregates
+        WHERE resolution = %s AND ticker_symbol IN ({','.join(['%s'] * len(tickers))})
+    """
+    params = [resolution, *tickers]
+    if start_date is not None:
+        sql += " AND period_end >= %s"
+        params.append(start_date)
+
+    starts, ends, symbols, prices = fetch_columns(
+        connection, sql, tuple(params), dtypes=(np.int64, np.int64, object, np.float64)
+    )
+    if len(starts) == 0:
+        return None
+
+    # 以期間第一天對齊各股票，日期標籤取該期間中最晚的交易日
+    unique_starts, row_idx = np.unique(starts, return_inverse=True)
+    unique_tickers, col_idx = np.unique(np.asarray(symbols, dtype=str), return_inverse=True)
+    values = np.full((len(unique_starts), len(unique_tickers)), np.nan)
+    values[row_idx, col_idx] = prices
+    labels = np.full(len(unique_starts), np.iinfo(np.int64).min)
+    np.maximum.at(labels, row_idx, ends)
+
+    index = pd.DatetimeIndex(labels.astype('datetime64[D]'), name='date')
+    df = pd.DataFrame(values, index=index, columns=unique_tickers)
+    df.columns.name = 'ticker_symbol'
+    return df
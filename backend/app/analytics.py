@@ -0,0 +1,264 @@
+import numpy as np
+
+# ---------------------------------------------------------
+# 投資組合分析的純數值運算 (不碰資料庫)
+# ---------------------------------------------------------
+# services 負責取出對齊後的價格矩陣，這裡只處理 NumPy 陣列，
+# 所有計算都維持矩陣形式 (一次處理所有資產 / 所有候選組合)。
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.02
+
+
+def annualized_moments(returns):
+    """
+    由日報酬矩陣 (T x N) 計算年化平均報酬 (N,) 與年化共變異數矩陣 (N x N)
+    """
+    mu = returns.mean(axis=0) * TRADING_DAYS
+    cov = np.cov(returns, rowvar=False, ddof=1) * TRADING_DAYS
+    return mu, np.atleast_2d(cov)
+
+
+def portfolio_stats(weights, mu, cov, risk_free_rate=RISK_FREE_RATE):
+    """
+    批次計算多組權重 (K x N) 的年化報酬、波動率與夏普值，回傳三個 (K,) 陣列。
+    變異數以 rowsum((W @ Σ) * W) 計算，不需要逐組做二次型。
+    """
+    weights = np.atleast_2d(weights)
+    returns = weights @ mu
+    variances = np.einsum('ij,ij->i', weights @ cov, weights)
+    volatility = np.sqrt(np.maximum(variances, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0, (returns - risk_free_rate) / volatility, 0.0)
+    return returns, volatility, sharpe
+
+
+def analytic_frontier(mu, cov, n_points=20, risk_free_rate=RISK_FREE_RATE):
+    """
+    Markowitz 封閉解 (權重總和為 1，允許放空)。
+    一次解出 Σ⁻¹[1, μ, μ - rf]，最小變異、最大夏普與 n_points 個目標報酬的權重
+    都由這三個向量線性組合而成，整條效率前緣是一個 (n_points x N) 的矩陣運算。
+    回傳 (min_var_weights, max_sharpe_weights, frontier_weights)
+    """
+    n = len(mu)
+    ones = np.ones(n)
+    # 加上極小的 ridge，避免資產高度共線時矩陣奇異
+    ridge = 1e-10 * np.trace(cov) / n * np.eye(n)
+    inv_ones, inv_mu, inv_excess = np.linalg.solve(
+        cov + ridge, np.column_stack([ones, mu, mu - risk_free_rate])
+    ).T
+
+    a = ones @ inv_ones
+    b = ones @ inv_mu
+    c = mu @ inv_mu
+    d = a * c - b * b
+
+    min_var = inv_ones / a
+    # 超額報酬總和 <= 0 時不存在有意義的切點組合，退回最小變異組合
+    excess_sum = ones @ inv_excess
+    max_sharpe = inv_excess / excess_sum if excess_sum > 0 else min_var
+
+    # 目標報酬: 從最小變異組合的報酬到單一資產最高報酬
+    min_ret = min_var @ mu
+    targets = np.linspace(min_ret, max(mu.max(), min_ret), n_points)
+    if abs(d) < 1e-18:
+        frontier = np.tile(min_var, (n_points, 1))
+    else:
+        frontier = (
+            np.outer(c - targets * b, inv_ones) + np.outer(targets * a - b, inv_mu)
+        ) / d
+    return min_var, max_sharpe, frontier
+
+
+def sampled_frontier(mu, cov, n_points=20, n_samples=100000, risk_free_rate=RISK_FREE_RATE,
+                     chunk_size=20000, rng=None):
+    """
+    只做多 (long-only) 的隨機權重掃描：產生 n_samples 組權重 (Dirichlet 分佈)，
+    每個 chunk 以一次矩陣乘法算出所有組合的報酬 / 波動率。
+    效率前緣 = 將報酬分成 n_points 個區間，每個區間取波動率最低的組合。
+    回傳 (min_var_weights, max_sharpe_weights, frontier_weights)
+    """
+    rng = rng or np.random.default_rng()
+    n = len(mu)
+
+    # 不同的集中度參數輪流使用：alpha 小 -> 權重集中在少數資產 (前緣的兩端)
+    alphas = np.array([0.05, 0.2, 1.0])
+
+    best = {}
+    all_returns, all_vols, kept_weights = [], [], []
+    for start in range(0, n_samples, chunk_size):
+        size = min(chunk_size, n_samples - start)
+        gamma = rng.gamma(np.resize(alphas, size)[:, None], 1.0, size=(size, n))
+        weights = gamma / np.maximum(gamma.sum(axis=1, keepdims=True), 1e-300)
+
+        returns, vols, sharpe = portfolio_stats(weights, mu, cov, risk_free_rate)
+
+        i_min = np.argmin(vols)
+        if 'min_var' not in best or vols[i_min] < best['min_var'][0]:
+            best['min_var'] = (vols[i_min], weights[i_min])
+        i_sharpe = np.argmax(sharpe)
+        if 'max_sharpe' not in best or sharpe[i_sharpe] > best['max_sharpe'][0]:
+            best['max_sharpe'] = (sharpe[i_sharpe], weights[i_sharpe])
+
+        # 每個 chunk 先在細分的報酬區間中各留下波動率最低的組合，限制記憶體用量
+        edges = np.linspace(returns.min(), returns.max(), n_points * 8 + 1)
+        bins = np.clip(np.searchsorted(edges, returns, side='right') - 1, 0, len(edges) - 2)
+        order = np.lexsort((vols, bins))
+        _, first = np.unique(bins[order], return_index=True)
+        keep = order[first]
+        all_returns.append(returns[keep])
+        all_vols.append(vols[keep])
+        kept_weights.append(weights[keep])
+
+    returns = np.concatenate(all_returns)
+    vols = np.concatenate(all_vols)
+    weights = np.vstack(kept_weights)
+
+    edges = np.linspace(returns.min(), returns.max(), n_points + 1)
+    bins = np.clip(np.searchsorted(edges, returns, side='right') - 1, 0, n_points - 1)
+    order = np.lexsort((vols, bins))
+    _, first = np.unique(bins[order], return_index=True)
+    frontier_idx = order[first]
+
+    # 報酬低於最小變異組合的部分是無效率的下半段，不屬於效率前緣
+    min_var = best['min_var'][1]
+    frontier_idx = frontier_idx[returns[frontier_idx] >= min_var @ mu - 1e-12]
+    frontier = np.vstack([min_var, weights[frontier_idx]])
+
+    return min_var, best['max_sharpe'][1], frontier
+
+
+# ---------------------------------------------------------
+# 風險值 (VaR) / 預期損失 (CVaR, Expected Shortfall)
+# ---------------------------------------------------------
+
+def tail_risk(samples, levels, counts=None):
+    """
+    批次計算多個組合在多個信賴水準下的 VaR 與 CVaR (以正數表示損失比例)。
+    samples: (S, P) 報酬樣本，每欄一個組合；無效樣本請填 +inf (會排在最後)
+    levels:  信賴水準，例如 (0.95, 0.99)
+    counts:  (P,) 每個組合的有效樣本數 (預設皆為 S)
+    只用一次 np.partition 取出最差的 k 筆 (k 約為 S 的 1% ~ 5%)，再排序這一小段，
+    不需要完整排序 S 筆樣本。回傳 (var, cvar)，shape 皆為 (len(levels), P)；
+    沒有有效樣本的組合 (包含 S = 0，例如資料天數不足一個 horizon) 為 NaN。
+    """
+    n_samples, n_cols = samples.shape
+    if n_samples == 0:
+        empty = np.full((len(levels), n_cols), np.nan)
+        return empty, empty.copy()
+    counts = np.full(n_cols, n_samples) if counts is None else np.asarray(counts)
+    alphas = 1 - np.asarray(levels, dtype=float)
+
+    # 經驗分位數: 第 k 小的報酬 (k 從 0 開始) 滿足 (k + 1) / n >= 1 - level
+    ks = np.ceil(np.round(alphas[:, None] * counts[None, :], 9)).astype(int) - 1
+    ks = np.clip(ks, 0, np.maximum(counts - 1, 0))
+    k_max = int(ks.max()) if ks.size else 0
+
+    head = np.partition(samples, k_max, axis=0)[:k_max + 1]
+    head.sort(axis=0)
+
+    var = -np.take_along_axis(head, ks, axis=0)
+    cvar = -np.take_along_axis(np.cumsum(head, axis=0), ks, axis=0) / (ks + 1)
+
+    empty = counts <= 0
+    var[:, empty] = np.nan
+    cvar[:, empty] = np.nan
+    return var, cvar
+
+
+def horizon_returns(daily_returns, first_valid, horizon):
+    """
+    由日報酬 (T x P) 產生重疊的 horizon 日複利報酬 (T - horizon + 1, P)。
+    first_valid: (P,) 每個組合第一筆有效日報酬的位置 (之前的資料不完整)
+    無效的視窗填 +inf，並回傳每欄的有效樣本數。
+    """
+    n_days, n_cols = daily_returns.shape
+    rows = np.arange(n_days)[:, None]
+    valid = rows >= first_valid[None, :]
+
+    log_returns = np.log1p(np.where(valid, daily_returns, 0.0))
+    cumulative = np.vstack([np.zeros((1, n_cols)), np.cumsum(log_returns, axis=0)])
+    windows = np.expm1(cumulative[horizon:] - cumulative[:-horizon])
+
+    windows[np.arange(len(windows))[:, None] < first_valid[None, :]] = np.inf
+    counts = np.maximum(len(windows) - first_valid, 0)
+    return windows, counts
+
+
+# ---------------------------------------------------------
+# 定期再平衡回測 (Backtest)
+# ---------------------------------------------------------
+
+def rebalance_points(dates, frequency):
+    """
+    回傳每個再平衡期間的起點位置 (第一個位置一定是 0)。
+    frequency: 'none' (買入持有)、'D'、'W'、'M'、'Q'、'Y'
+    dates: DatetimeIndex (交易日)
+    """
+    if frequency == 'none' or len(dates) == 0:
+        return np.array([0])
+    if frequency == 'D':
+        return np.arange(len(dates))
+    periods = dates.to_period({'W': 'W-SUN', 'M': 'M', 'Q': 'Q', 'Y': 'Y'}[frequency]).asi8
+    return np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+
+
+def backtest_rebalanced(prices, weights, starts, cost=0.0, initial_value=1.0, cost_iterations=3):
+    """
+    批次回測 K 組目標權重 (K x N) 在價格矩陣 (T x N) 上的定期再平衡結果。
+    starts: 再平衡的位置 (rebalance_points)，在每個起點把組合調回目標權重。
+    cost: 交易成本 (成交金額的比例)，再平衡後的價值 V' 滿足 V' = V - cost x Σ|V' w - 持有市值|，
+          以少量定點迭代求解。
+    迴圈只跑「期間數」次；每個期間內所有日期 x 所有權重組一次矩陣乘法:
+        期間內價值 (T_p x K) = 價格 (T_p x N) @ 持股數 (N x K)
+    回傳 (values (T x K), turnover (K,), costs (K,))；turnover 為累積換手金額 / 期初價值。
+    """
+    weights = np.atleast_2d(weights)
+    n_days = len(prices)
+    n_sets = len(weights)
+    bounds = np.r_[starts, n_days]
+
+    values = np.empty((n_days, n_sets))
+    turnover = np.zeros(n_sets)
+    costs = np.zeros(n_sets)
+    shares = None  # 目前的持股數 (K x N)
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if shares is None:
+            # 第一次建倉不計交易成本
+            after = np.full(n_sets, float(initial_value))
+        else:
+            # 再平衡日的持有市值 (上一期的持股以當天價格計算)
+            drifted = shares * prices[start]
+            before = drifted.sum(axis=1)
+            after = before
+            for _ in range(cost_iterations if cost > 0 else 1):
+                traded = np.abs(after[:, None] * weights - drifted).sum(axis=1)
+                after = before - cost * traded
+            turnover += traded / initial_value
+            costs += before - after
+
+        shares = after[:, None] * weights / prices[start]
+        values[start:end] = prices[start:end] @ shares.T
+
+    return values, turnover, costs
+
+
+def path_metrics(values, risk_free_rate=RISK_FREE_RATE):
+    """
+    以價值序列 (T x K) 批次計算每組的總報酬、年化報酬 / 波動率、夏普值與最大回撤 (皆為 (K,) 陣列)
+    """
+    daily_returns = values[1:] / values[:-1] - 1
+    annual_return = daily_returns.mean(axis=0) * TRADING_DAYS
+    annual_volatility = daily_returns.std(axis=0) * np.sqrt(TRADING_DAYS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(annual_volatility > 0, (annual_return - risk_free_rate) / annual_volatility, 0.0)
+    peaks = np.maximum.accumulate(values, axis=0)
+    max_drawdown = ((peaks - values) / peaks).max(axis=0)
+    return {
+        "total_return": values[-1] / values[0] - 1,
+        "annual_return": annual_return,
+        "annual_volatility": annual_volatility,
+        "sharpe_ratio": sharpe,
+        "max_drawdown": max_drawdown,
+    }
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只提供同一行程內的合併
+    fcntl = None
+
+# ---------------------------------------------------------
+# 相同請求合併 (single-flight)
+# ---------------------------------------------------------
+# 多人共用同一個投資組合、或前端重複送出相同請求時，同時到達的相同分析請求
+# (相同 API、組合、參數、資料版本) 只讓第一個請求計算，其餘請求等待並共用它的結果；
+# 資料更新 (key 改變) 之後湧入的大量請求也只會各算一次。
+#   - 同一個 worker 的多個執行緒: SingleFlight (記憶體中的等待表)
+#   - 跨 worker (選用，COALESCE_DIR): 以 flock 鎖住 <dir>/<key hash>.lock，
+#     拿到鎖的 worker 計算並把結果寫成 <key hash>.result；後到的 worker 等鎖釋放後直接讀取結果。
+#     結果檔只在 COALESCE_RESULT_TTL 秒內有效 (只用於合併，不是長期快取)。
+
+DEFAULT_RESULT_TTL = 30.0
+DEFAULT_LOCK_TIMEOUT = 60.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+class _Call:
+    """一次進行中的計算 (結果或例外由所有等待者共用)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同一行程內相同 key 的呼叫只執行一次 (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """
+        執行 fn() 並回傳 (結果, 是否為共用結果)。
+        相同 key 已經有人在計算時，等待並回傳同一個結果；
+        計算的呼叫拋出例外時，等待者不共用錯誤，各自再執行一次 fn()。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                return fn(), False
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {"inFlight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+class FileFlight:
+    """
+    跨 worker 的合併: 同一個 key 由一個 worker 計算，結果以檔案交給其他 worker。
+    結果以 bytes 保存，序列化 / 反序列化由呼叫端負責。
+    """
+
+    def __init__(self, directory, result_ttl=DEFAULT_RESULT_TTL, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.lock_timeout = lock_timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + '.lock', base + '.result'
+
+    def _read_result(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _acquire(self, fd):
+        """取得檔案鎖，逾時回傳 False (逾時後呼叫端自行計算，不無限等待)"""
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def do(self, key, fn):
+        """
+        回傳 (bytes, 是否為其他 worker 的結果)。
+        fn() 回傳要交給其他 worker 的 bytes，回傳 None 代表結果不可共用。
+        """
+        lock_path, result_path = self._paths(key)
+        with open(lock_path, 'a+b') as lock_file:
+            locked = self._acquire(lock_file.fileno())
+            try:
+                data = self._read_result(result_path)
+                if data is not None:
+                    return data, True
+
+                data = fn()
+                if data is not None and locked:
+                    tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, result_path)
+                    self._cleanup()
+                return data, False
+            finally:
+                if locked:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _cleanup(self):
+        """移除過期的結果檔 (與超過一段時間沒有使用的鎖檔)"""
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                age = now - os.path.getmtime(path)
+                if (name.endswith('.result') and age > self.result_ttl) or (name.endswith('.lock') and age > self.lock_timeout * 10):
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+_settings = {'enabled': True}
+_flight = SingleFlight()
+_file_flight = None
+
+
+def coalesced(key, fn, dumps=None, loads=None):
+    """
+    合併相同 key 的計算，回傳 (結果, 是否為共用結果)。
+    有設定 COALESCE_DIR 時也會跨 worker 合併，此時需要 dumps (結果 -> bytes 或 None) 與 loads (bytes -> 結果)。
+    """
+    if not _settings['enabled']:
+        return fn(), False
+
+    if _file_flight is None or dumps is None or loads is None:
+        return _flight.do(key, fn)
+
+    def across_workers():
+        holder = {}
+
+        def compute():
+            holder['result'] = fn()
+            return dumps(holder['result'])
+
+        data, shared = _file_flight.do(key, compute)
+        if shared:
+            return loads(data), True
+        return holder['result'], False
+
+    (result, shared_worker), shared_thread = _flight.do(key, across_workers)
+    return result, shared_thread or shared_worker
+
+
+def stats():
+    return {**_flight.stats(), "acrossWorkers": _file_flight is not None}
+
+
+def init_app(app):
+    """
+    讀取合併設定:
+        COALESCE_ENABLED      -> False 時不合併
+        COALESCE_DIR          -> 跨 worker 合併用的鎖檔目錄 (例如 /dev/shm/investment_coalesce)，空字串代表只在行程內合併
+        COALESCE_RESULT_TTL   -> 結果檔保留的秒數
+        COALESCE_LOCK_TIMEOUT -> 等待其他 worker 計算的最長秒數，逾時則自行計算
+    """
+    global _file_flight
+    _settings['enabled'] = app.config.get('COALESCE_ENABLED', True)
+    directory = app.config.get('COALESCE_DIR')
+    if directory and fcntl is not None:
+        _file_flight = FileFlight(
+            directory,
+            result_ttl=app.config.get('COALESCE_RESULT_TTL', DEFAULT_RESULT_TTL),
+            lock_timeout=app.config.get('COALESCE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+        )
+    else:
+        _file_flight = None
@@ -0,0 +1,100 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # 沒有安裝 brotli 時只提供 gzip
+    brotli = None
+
+# ---------------------------------------------------------
+# 回應壓縮 (Content-Encoding: br / gzip)
+# ---------------------------------------------------------
+# 多年份的歷史走勢、模擬百分位陣列都是以日期為 key 的大型 JSON，壓縮率非常高。
+# after_request 依照 Accept-Encoding 協商編碼，超過 COMPRESS_MIN_SIZE 的文字類回應才壓縮；
+# 已經設定 Content-Encoding 的回應 (例如 response_cache 預先壓縮好的快取) 不會重複壓縮。
+
+DEFAULT_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+_settings = {
+    'min_size': 1024,
+    'gzip_level': 6,
+    'brotli_level': 5,
+    'mimetypes': DEFAULT_MIMETYPES,
+}
+
+
+def supported_encodings():
+    """伺服器支援的編碼 (依偏好排序: 壓縮率較高的 br 優先)"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate():
+    """
+    依照目前請求的 Accept-Encoding (含 q 值) 選出編碼；
+    客戶端不接受任何支援的編碼時回傳 None (不壓縮)。
+    """
+    if not request.headers.get('Accept-Encoding'):
+        return None
+    accepted = request.accept_encodings
+    candidates = [(accepted[e], -i, e) for i, e in enumerate(supported_encodings()) if accepted[e] > 0]
+    if not candidates:
+        return None
+    return max(candidates)[2]
+
+
+def compress(data, encoding):
+    """以設定的壓縮等級壓縮 bytes"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=_settings['brotli_level'])
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=_settings['gzip_level'], mtime=0)
+    return data
+
+
+def should_compress(data_size, mimetype):
+    """大小與 mimetype 是否值得壓縮"""
+    return data_size >= _settings['min_size'] and mimetype in _settings['mimetypes']
+
+
+def add_vary(response):
+    """回應內容會隨 Accept-Encoding 改變，提醒中間的快取 / proxy"""
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _compress_response(response):
+    if (
+        request.method == 'HEAD'
+        or response.status_code < 200 or response.status_code in (204, 304)
+        or response.direct_passthrough or response.is_streamed
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+
+    data = response.get_data()
+    if not should_compress(len(data), response.mimetype):
+        return response
+
+    add_vary(response)
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    讀取壓縮設定並註冊 after_request:
+        COMPRESS_MIN_SIZE      -> 小於此大小 (bytes) 不壓縮
+        COMPRESS_GZIP_LEVEL    -> gzip 壓縮等級 (1-9)
+        COMPRESS_BROTLI_LEVEL  -> brotli 壓縮等級 (0-11)
+        COMPRESS_MIMETYPES     -> 要壓縮的 mimetype
+    """
+    _settings['min_size'] = app.config.get('COMPRESS_MIN_SIZE', _settings['min_size'])
+    _settings['gzip_level'] = app.config.get('COMPRESS_GZIP_LEVEL', _settings['gzip_level'])
+    _settings['brotli_level'] = app.config.get('COMPRESS_BROTLI_LEVEL', _settings['brotli_level'])
+    _settings['mimetypes'] = tuple(app.config.get('COMPRESS_MIMETYPES', _settings['mimetypes']))
+    app.after_request(_compress_response)
@@ -0,0 +1,149 @@
+import json
+import numpy as np
+import pandas as pd
+from app.db import fetch_columns, EPOCH_TO_DAYS
+
+# ---------------------------------------------------------
+# 投資組合每日價值快照 (PortfolioDailyValues)
+# ---------------------------------------------------------
+# 每個投資組合每個交易日一列: 總價值 + 各持股價值 (JSON: {ticker: 數量 x 價格})。
+# 歷史績效 / 一年期日價值 / 模擬只需要一次以 (portfolio_id, date) 主鍵的範圍掃描，
+# 不必每次把價格 pivot 之後再乘上持股數量。
+#
+# 寫入時機:
+#   - 持股改變 (services.update_portfolio_assets): 重建該組合的整段序列。
+#     績效走勢的定義是「目前的持股 x 歷史價格」，持股一變，每一天的價值都會變，
+#     因此無法只從變更日開始重算；但只會重建被修改的那一個組合。
+#   - 新價格寫入 (seed.py -> incremental.refresh_running_stats): 只新增新的交易日，
+#     價值由增量引擎在更新統計時一起算出。
+# 與 services 相同的對齊規則: 缺價的日期以前一筆價格補上 (forward fill)，
+# 仍有持股沒有價格的日期 (尚未上市) 不列入。
+#
+# 只有 PortfolioRunningStats.snapshot_start 不是 NULL (整段序列重建過) 的組合，快照才是完整的序列；
+# 在 004 回填之前就有狀態的組合只有增量新增的日期，讀取時視為沒有快照，由呼叫端即時計算。
+
+# 組合的快照是完整序列 (附加在 PortfolioDailyValues 的查詢條件後面，參數為 portfolio_id)
+_COMPLETE = """
+    AND EXISTS (
+        SELECT 1 FROM PortfolioRunningStats s
+        WHERE s.portfolio_id = %s AND s.snapshot_start IS NOT NULL
+    )
+"""
+
+
+def compute_series(holdings, matrix):
+    """
+    由價格矩陣計算持股 {ticker: quantity} 的每日價值。
+    回傳 (日期陣列 datetime64[D], 股票代號列表, 各持股價值矩陣 (日期 x 股票))；沒有資料時回傳 None。
+    """
+    if not holdings or matrix is None:
+        return None
+    tickers = list(holdings)
+    df = matrix.frame(tickers)
+    if df is None or any(t not in df.columns for t in tickers):
+        return None
+
+    prices = df[tickers].ffill().to_numpy()
+    valid = ~np.isnan(prices).any(axis=1)
+    if not valid.any():
+        return None
+    quantities = np.array([holdings[t] for t in tickers])
+    days = df.index[valid].to_numpy().astype('datetime64[D]')
+    return days, tickers, prices[valid] * quantities
+
+
+def _rows(portfolio_id, days, tickers, holding_values):
+    """組成寫入用的 tuples (portfolio_id, date, total_value, holding_values JSON)"""
+    totals = holding_values.sum(axis=1)
+    return [
+        (
+            portfolio_id, day,
+            round(float(total), 4),
+            json.dumps({t: round(float(v), 4) for t, v in zip(tickers, values)})
+        )
+        for day, total, values in zip(days.astype(object), totals, holding_values)
+    ]
+
+
+def rebuild_portfolio(connection, portfolio_id, series):
+    """以 compute_series 的結果重寫單一組合的整段序列 (series 為 None 時只清除)"""
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM PortfolioDailyValues WHERE portfolio_id = %s", (portfolio_id,))
+    cursor.close()
+    if series is not None:
+        append_rows(connection, _rows(portfolio_id, *series))
+
+
+def append_rows(connection, rows):
+    """
+    新增 (或覆寫) 每日價值。
+    rows: [(portfolio_id, date, total_value, holding_values JSON 字串), ...]
+    """
+    if not rows:
+        return
+    cursor = connection.cursor()
+    cursor.executemany("""
+        INSERT INTO PortfolioDailyValues (portfolio_id, date, total_value, holding_values)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_value = VALUES(total_value),
+            holding_values = VALUES(holding_values)
+    """, rows)
+    cursor.close()
+
+
+def day_row(portfolio_id, day, holdings, last_prices):
+    """增量引擎新增一天時使用: 由各持股的最新價格組成一列"""
+    values = {t: round(q * last_prices[t], 4) for t, q in holdings.items()}
+    return (portfolio_id, day, round(sum(q * last_prices[t] for t, q in holdings.items()), 4), json.dumps(values))
+
+
+def fetch_total_values(connection, portfolio_id, start_date=None, days=None):
+    """
+    讀取組合的每日總價值 (一次主鍵範圍掃描)。
+    start_date: 起始日期；days: 只取最近 N 個交易日
+    回傳 pd.Series (Index=日期)；沒有完整的快照時回傳 None。
+    """
+    sql = f"""
+        SELECT TO_DAYS(date) - {EPOCH_TO_DAYS}, CAST(total_value AS DOUBLE)
+        FROM PortfolioDailyValues
+        WHERE portfolio_id = %s {_COMPLETE}
+    """
+    params = [portfolio_id, portfolio_id]
+    if start_date is not None:
+        sql += " AND date >= %s"
+        params.append(start_date)
+    if days is not None:
+        # 由新到舊取最近 N 筆 (主鍵反向掃描)，之後再反轉
+        sql += " ORDER BY date DESC LIMIT %s"
+        params.append(days)
+    else:
+        sql += " ORDER BY date"
+
+    day_numbers, totals = fetch_columns(connection, sql, tuple(params), dtypes=(np.int64, np.float64))
+    if not len(day_numbers):
+        return None
+    if days is not None:
+        day_numbers, totals = day_numbers[::-1], totals[::-1]
+    return pd.Series(totals, index=pd.DatetimeIndex(day_numbers.astype('datetime64[D]'), name='date'))
+
+
+def fetch_holding_values(connection, portfolio_id, days, start_date=None):
+    """
+    讀取組合最近 N 個交易日 (start_date 之後) 的各持股價值。
+    回傳 (股票代號列表, 各持股價值矩陣 (日期 x 股票))；沒有完整的快照時回傳 None。
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT holding_values
+        FROM PortfolioDailyValues
+        WHERE portfolio_id = %s AND date >= %s {_COMPLETE}
+        ORDER BY date DESC
+        LIMIT %s
+    """, (portfolio_id, start_date or '1900-01-01', portfolio_id, days))
+    rows = [json.loads(row['holding_values']) for row in reversed(cursor.fetchall())]
+    cursor.close()
+    if not rows:
+        return None
+    tickers = list(rows[-1])
+    return tickers, np.array([[row.get(t, np.nan) for t in tickers] for row in rows])
@@ -1,19 +1,31 @@
+import numpy as np
 import pymysql
 from flask import current_app, g
 
+# MySQL 的 TO_DAYS('1970-01-01')，用來把 DATE 轉成「距 1970-01-01 的天數」
+# 例: SELECT TO_DAYS(date) - 719528 ... 直接得到可當作 datetime64[D] 的 int64
+EPOCH_TO_DAYS = 719528
+
+def connect(config):
+    """
+    依照設定 (app.config 或任何同名 key 的 dict) 建立一條新的資料庫連線。
+    給不在請求範圍內的程式使用 (例如 gunicorn master 預載價格資料)。
+    """
+    return pymysql.connect(
+        host=config['MYSQL_HOST'],
+        user=config['MYSQL_USER'],
+        password=config['MYSQL_PASSWORD'],
+        database=config['MYSQL_DB'],
+        cursorclass=pymysql.cursors.DictCursor # 讓我們得到 dict 格式的結果
+    )
+
 def get_db():
     """
     取得當前請求的資料庫連線。
     如果 g (global) 中沒有連線，就建立一個新的。
     """
     if 'db' not in g:
-        g.db = pymysql.connect(
-            host=current_app.config['MYSQL_HOST'],
-            user=current_app.config['MYSQL_USER'],
-            password=current_app.config['MYSQL_PASSWORD'],
-            database=current_app.config['MYSQL_DB'],
-            cursorclass=pymysql.cursors.DictCursor # 讓我們得到 dict 格式的結果
-        )
+        g.db = connect(current_app.config)
     return g.db
 
 def close_db(e=None):
@@ -24,6 +36,37 @@ def close_db(e=None):
     if db is not None:
         db.close()
 
+def fetch_columns(connection, sql, params=None, dtypes=(), chunk_size=10000):
+    """
+    [Helper] 大量讀取數值資料，直接組成 NumPy 陣列 (每個欄位一個陣列)。
+    使用 unbuffered 的 tuple cursor (SSCursor)，不建立每列的 dict，
+    也不需要逐筆把 Decimal / date 轉型 —— 請在 SQL 中先轉好:
+        日期: TO_DAYS(date) - 719528         -> int64 (天數)
+        價格: CAST(adjusted_close AS DOUBLE)  -> float64
+    dtypes: 每個欄位的 dtype (未指定的欄位保留為 object，例如股票代號)
+    """
+    cursor = connection.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(sql, params)
+        n_cols = len(cursor.description)
+        dtypes = list(dtypes) + [object] * (n_cols - len(dtypes))
+        chunks = [[] for _ in range(n_cols)]
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for i, column in enumerate(zip(*rows)):
+                chunks[i].append(np.array(column, dtype=dtypes[i]))
+    finally:
+        # unbuffered cursor 必須讀完 / 關閉後，同一條連線才能再執行其他查詢
+        cursor.close()
+
+    return [
+        np.concatenate(parts) if parts else np.array([], dtype=dtypes[i])
+        for i, parts in enumerate(chunks)
+    ]
+
 def init_app(app):
     """
     將 'close_db' 註冊到 Flask app，使其在
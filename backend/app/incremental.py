@@ -0,0 +1,435 @@
+import json
+import zlib
+import click
+from collections import defaultdict, deque
+from datetime import date
+import numpy as np
+from app.db import fetch_columns, EPOCH_TO_DAYS
+from app import price_store, daily_values
+
+# ---------------------------------------------------------
+# 投資組合每日統計的增量更新 (PortfolioRunningStats)
+# ---------------------------------------------------------
+# 每天每檔股票只會新增一筆價格，不需要每次都從頭重算整段歷史。
+# 每個投資組合保存一份狀態:
+#   - 最新總價值、各持股的最新價格 (forward fill 用)
+#   - 歷史最高價值 (running max) 與最大回撤
+#   - 最近 ROLLING_WINDOW 個交易日的價值 (環形緩衝) 與日報酬的 sum / sum of squares
+# 新的一天價格進來時，以「股票 -> 持有它的組合」反向索引找出受影響的組合，
+# 每個組合只需 O(持股數) 更新價值、O(1) 更新統計量，
+# 夜間更新從 O(組合數 x 歷史長度) 降為 O(組合數 x 持股數)。
+#
+# 以下情況改為從完整歷史重建該組合的狀態 (O(歷史長度)，只影響少數組合):
+#   - 尚未有狀態 (新組合)
+#   - 持股內容改變 (持股指紋不同)
+#   - 已計算過的最後一天價格被修正 (例如除權息調整了 adjusted_close)
+#   - 沒有完整的每日價值快照 (snapshot_start 為 NULL，例如狀態在 004 回填之前就已建立)
+# 每日價值快照 (PortfolioDailyValues，見 app/daily_values.py) 也在這裡一起更新:
+# 增量時新增新交易日的列，重建時重寫該組合的整段序列並記錄快照的起始日 (snapshot_start)。
+
+# 日報酬的滾動視窗 (交易日)，與 services 計算一年期指標的長度相同
+ROLLING_WINDOW = 252
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.02
+# 價格修正的判斷門檻 (相對誤差)
+REVISION_TOLERANCE = 1e-6
+
+
+def holdings_fingerprint(holdings):
+    """持股 {ticker: quantity} 的指紋 (持股或數量改變時不同)"""
+    text = ';'.join(f"{ticker}={float(quantity):.6f}" for ticker, quantity in sorted(holdings.items()))
+    return f"{len(holdings)}:{zlib.crc32(text.encode()):08x}"
+
+
+class ReverseIndex:
+    """
+    股票 -> 持有它的投資組合 (以及每個組合的持股)
+    portfolios: {portfolio_id: {ticker: quantity}}
+    by_ticker:  {ticker: [portfolio_id, ...]}
+    """
+
+    def __init__(self, portfolios):
+        self.portfolios = portfolios
+        self.by_ticker = defaultdict(list)
+        for portfolio_id, holdings in portfolios.items():
+            for ticker in holdings:
+                self.by_ticker[ticker].append(portfolio_id)
+
+    @classmethod
+    def load(cls, connection, tickers=None, portfolio_ids=None):
+        """
+        讀取 (持有指定股票的 / 指定的) 投資組合持股。
+        只指定 tickers 時，仍會讀取這些組合的「全部」持股 (計算總價值需要)。
+        """
+        if (portfolio_ids is not None and not portfolio_ids) or (tickers is not None and not tickers):
+            return cls({})
+
+        sql = "SELECT portfolio_id, ticker_symbol, quantity FROM PortfolioItems"
+        params = ()
+        if portfolio_ids is not None:
+            sql += f" WHERE portfolio_id IN ({','.join(['%s'] * len(portfolio_ids))})"
+            params = tuple(portfolio_ids)
+        elif tickers is not None:
+            sql += f"""
+                WHERE portfolio_id IN (
+                    SELECT portfolio_id FROM PortfolioItems
+                    WHERE ticker_symbol IN ({','.join(['%s'] * len(tickers))})
+                )
+            """
+            params = tuple(tickers)
+
+        portfolios = defaultdict(dict)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            portfolios[row['portfolio_id']][row['ticker_symbol']] = float(row['quantity'])
+        cursor.close()
+        return cls(dict(portfolios))
+
+    def tickers(self):
+        return list(self.by_ticker)
+
+
+class RunningStats:
+    """
+    單一投資組合的增量統計狀態。
+    push(day, value) 為 O(1) (不含環形緩衝的定期重新加總，攤提後仍為 O(1))。
+    """
+
+    def __init__(self, fingerprint, window=ROLLING_WINDOW):
+        self.fingerprint = fingerprint
+        self.as_of = None
+        self.last_prices = {}
+        self.running_max = None
+        self.max_drawdown = 0.0
+        # 保留 window + 1 個價值，才能得到 window 個日報酬
+        self.values = deque(maxlen=window + 1)
+        self.return_sum = 0.0
+        self.return_sum_sq = 0.0
+        self._since_resum = 0
+        # 每日價值快照的第一個交易日 (整段序列重建時設定；None 代表快照不完整)
+        self.snapshot_start = None
+
+    @property
+    def latest_value(self):
+        return self.values[-1] if self.values else None
+
+    def push(self, day, value):
+        """加入新的一天的總價值"""
+        values = self.values
+        if len(values) == values.maxlen:
+            # 最舊的一筆日報酬離開視窗
+            old = values[1] / values[0] - 1
+            self.return_sum -= old
+            self.return_sum_sq -= old * old
+        if values:
+            r = value / values[-1] - 1
+            self.return_sum += r
+            self.return_sum_sq += r * r
+        values.append(value)
+
+        self.running_max = value if self.running_max is None else max(self.running_max, value)
+        if self.running_max > 0:
+            self.max_drawdown = max(self.max_drawdown, (self.running_max - value) / self.running_max)
+        self.as_of = day
+
+        # 每走完一整個視窗就重新加總一次，避免浮點誤差累積
+        self._since_resum += 1
+        if self._since_resum >= values.maxlen:
+            self._resum()
+
+    def _resum(self):
+        v = np.fromiter(self.values, dtype=float)
+        returns = v[1:] / v[:-1] - 1 if len(v) > 1 else np.zeros(0)
+        self.return_sum = float(returns.sum())
+        self.return_sum_sq = float((returns * returns).sum())
+        self._since_resum = 0
+
+    def update_prices(self, day, bars, holdings):
+        """
+        套用某一天的價格 bars {ticker: price} (只含當天有報價的股票)，O(持股數)。
+        所有持股都有過價格 (forward fill 後沒有缺值) 才會產生當天的總價值，與 services 的 dropna 一致。
+        """
+        for ticker, price in bars.items():
+            if ticker in holdings:
+                self.last_prices[ticker] = price
+        if len(self.last_prices) < len(holdings):
+            return False
+        self.push(day, sum(quantity * self.last_prices[ticker] for ticker, quantity in holdings.items()))
+        return True
+
+    def metrics(self):
+        """以目前狀態計算指標 (與 services._metrics_from_values 的定義相同，最大回撤為整段歷史)"""
+        n = len(self.values) - 1
+        if n < 1:
+            return None
+        mean = self.return_sum / n
+        variance = max(self.return_sum_sq / n - mean * mean, 0.0)
+        annual_return = mean * TRADING_DAYS
+        annual_volatility = np.sqrt(variance) * np.sqrt(TRADING_DAYS)
+        sharpe_ratio = (annual_return - RISK_FREE_RATE) / annual_volatility if annual_volatility else 0
+        latest = self.values[-1]
+        return {
+            "as_of": self.as_of,
+            "end_value": round(latest, 2),
+            "total_return": round((latest - self.values[0]) / self.values[0], 4),
+            "annual_return": round(annual_return, 4),
+            "annual_volatility": round(float(annual_volatility), 4),
+            "sharpe_ratio": round(float(sharpe_ratio), 4),
+            "running_max": round(self.running_max, 2),
+            "current_drawdown": round((self.running_max - latest) / self.running_max, 4) if self.running_max else 0.0,
+            "max_drawdown": round(self.max_drawdown, 4),
+            "window_days": n
+        }
+
+    # --- 讀寫 PortfolioRunningStats ---
+
+    def to_row(self, portfolio_id):
+        return (
+            portfolio_id, self.fingerprint, self.as_of, self.latest_value,
+            self.running_max, self.max_drawdown,
+            np.fromiter(self.values, dtype='<f8').tobytes(),
+            self.return_sum, self.return_sum_sq, self._since_resum,
+            json.dumps(self.last_prices), self.snapshot_start
+        )
+
+    @classmethod
+    def from_row(cls, row, window=ROLLING_WINDOW):
+        stats = cls(row['fingerprint'], window)
+        stats.as_of = row['as_of']
+        stats.last_prices = json.loads(row['last_prices'])
+        stats.running_max = row['running_max']
+        stats.max_drawdown = row['max_drawdown']
+        stats.values.extend(np.frombuffer(row['window_values'], dtype='<f8').tolist())
+        stats.return_sum = row['return_sum']
+        stats.return_sum_sq = row['return_sum_sq']
+        stats._since_resum = row['pushes_since_resum']
+        stats.snapshot_start = row['snapshot_start']
+        return stats
+
+    @classmethod
+    def from_history(cls, holdings, matrix, window=ROLLING_WINDOW):
+        """從完整的價格歷史 (PriceMatrix) 建立狀態 (新組合 / 持股改變 / 價格修正時使用)"""
+        return cls.from_series(holdings, daily_values.compute_series(holdings, matrix), window)
+
+    @classmethod
+    def from_series(cls, holdings, series, window=ROLLING_WINDOW):
+        """由 daily_values.compute_series 的結果 (日期, 股票, 各持股價值) 建立狀態"""
+        stats = cls(holdings_fingerprint(holdings), window)
+        if series is None:
+            return stats
+        days, tickers, holding_values = series
+        values = holding_values.sum(axis=1)
+
+        running_max = np.maximum.accumulate(values)
+        stats.running_max = float(running_max[-1])
+        stats.max_drawdown = float(np.max((running_max - values) / running_max)) if running_max[-1] > 0 else 0.0
+        stats.values.extend(values[-(window + 1):].tolist())
+        stats._resum()
+        stats.as_of = days[-1].astype(object)
+        stats.snapshot_start = days[0].astype(object)
+        stats.last_prices = {
+            ticker: float(value / holdings[ticker]) if holdings[ticker] else 0.0
+            for ticker, value in zip(tickers, holding_values[-1])
+        }
+        return stats
+
+
+# ---------------------------------------------------------
+# 讀寫狀態 / 套用新價格
+# ---------------------------------------------------------
+
+def load_states(connection, portfolio_ids):
+    """讀取組合的狀態 {portfolio_id: RunningStats}"""
+    if not portfolio_ids:
+        return {}
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT portfolio_id, fingerprint, as_of, running_max, max_drawdown,
+               window_values, return_sum, return_sum_sq, pushes_since_resum, last_prices, snapshot_start
+        FROM PortfolioRunningStats
+        WHERE portfolio_id IN ({','.join(['%s'] * len(portfolio_ids))})
+    """, tuple(portfolio_ids))
+    states = {row['portfolio_id']: RunningStats.from_row(row) for row in cursor.fetchall()}
+    cursor.close()
+    return states
+
+
+def save_states(connection, states):
+    """寫回狀態 (upsert)"""
+    if not states:
+        return
+    cursor = connection.cursor()
+    cursor.executemany("""
+        INSERT INTO PortfolioRunningStats
+            (portfolio_id, fingerprint, as_of, latest_value, running_max, max_drawdown,
+             window_values, return_sum, return_sum_sq, pushes_since_resum, last_prices, snapshot_start)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            fingerprint = VALUES(fingerprint),
+            as_of = VALUES(as_of),
+            latest_value = VALUES(latest_value),
+            running_max = VALUES(running_max),
+            max_drawdown = VALUES(max_drawdown),
+            window_values = VALUES(window_values),
+            return_sum = VALUES(return_sum),
+            return_sum_sq = VALUES(return_sum_sq),
+            pushes_since_resum = VALUES(pushes_since_resum),
+            last_prices = VALUES(last_prices),
+            snapshot_start = VALUES(snapshot_start)
+    """, [stats.to_row(pid) for pid, stats in states.items() if stats.as_of is not None])
+    cursor.close()
+
+
+def fetch_bars(connection, tickers, after):
+    """讀取指定股票 after (含) 之後的每日價格，回傳依日期排序的 [(date, {ticker: price}), ...]"""
+    if not tickers:
+        return []
+    days, symbols, prices = fetch_columns(connection, f"""
+        SELECT TO_DAYS(date) - {EPOCH_TO_DAYS}, ticker_symbol, CAST(adjusted_close AS DOUBLE)
+        FROM HistoricalPrices
+        WHERE date >= %s AND ticker_symbol IN ({','.join(['%s'] * len(tickers))})
+        ORDER BY date
+    """, (after, *tickers), dtypes=(np.int64, object, np.float64))
+
+    bars = defaultdict(dict)
+    for day, ticker, price in zip(days.tolist(), symbols, prices.tolist()):
+        bars[day][ticker] = price
+    return [(np.datetime64(day, 'D').astype(date), bars[day]) for day in sorted(bars)]
+
+
+def apply_bars(index, states, day, bars, rows=None):
+    """
+    套用某一天的價格 bars {ticker: price}: 透過反向索引只更新持有這些股票、
+    且尚未計算過這一天的組合。回傳更新的組合 id。
+    rows: (選填) list，新增的每日價值列 (PortfolioDailyValues) 會附加在這裡
+    """
+    touched = set()
+    for ticker in bars:
+        touched.update(index.by_ticker.get(ticker, ()))
+
+    updated = []
+    for portfolio_id in touched:
+        stats = states.get(portfolio_id)
+        if stats is None or (stats.as_of is not None and stats.as_of >= day):
+            continue
+        holdings = index.portfolios[portfolio_id]
+        if stats.update_prices(day, bars, holdings):
+            updated.append(portfolio_id)
+            if rows is not None:
+                rows.append(daily_values.day_row(portfolio_id, day, holdings, stats.last_prices))
+    return updated
+
+
+def _is_revised(stats, bars_on_as_of):
+    """已計算過的最後一天，價格是否被修正 (例如除權息調整)"""
+    for ticker, price in bars_on_as_of.items():
+        last = stats.last_prices.get(ticker)
+        if last is not None and abs(price - last) > REVISION_TOLERANCE * max(abs(last), 1.0):
+            return True
+    return False
+
+
+def refresh_running_stats(connection, tickers=None, full=False):
+    """
+    價格寫入後更新受影響組合的狀態 (seed.py 在同一個 transaction 中呼叫)。
+    tickers: 本次寫入價格的股票 (None 代表全部組合)
+    full:    True 時所有組合都從完整歷史重建 (例如定期校正)
+    回傳 {"incremental": 增量更新的組合數, "rebuilt": 重建的組合數, "days": 套用的天數}
+    """
+    index = ReverseIndex.load(connection, tickers=tickers)
+    states = {} if full else load_states(connection, list(index.portfolios))
+
+    # 1. 找出需要重建的組合: 沒有狀態 / 持股改變 / 沒有完整的每日價值快照
+    rebuild = {
+        pid for pid, holdings in index.portfolios.items()
+        if pid not in states
+        or states[pid].fingerprint != holdings_fingerprint(holdings)
+        or states[pid].snapshot_start is None
+    }
+
+    # 2. 讀取所有增量組合最後計算日 (含) 之後的價格
+    incremental = {pid: states[pid] for pid in index.portfolios if pid not in rebuild}
+    bars = []
+    if incremental:
+        since = min(stats.as_of for stats in incremental.values())
+        bars = fetch_bars(connection, index.tickers(), since)
+
+    # 3. 最後計算日的價格被修正的組合也要重建
+    bars_by_day = dict(bars)
+    for pid, stats in incremental.items():
+        if _is_revised(stats, bars_by_day.get(stats.as_of, {})):
+            rebuild.add(pid)
+    for pid in rebuild:
+        incremental.pop(pid, None)
+
+    # 4. 增量: 依日期逐日套用 (同時產生新交易日的每日價值)
+    days = 0
+    rows = []
+    for day, day_bars in bars:
+        if apply_bars(index, incremental, day, day_bars, rows):
+            days += 1
+    daily_values.append_rows(connection, rows)
+
+    # 5. 重建: 一次讀取這些組合所有持股的完整歷史 (直接讀 MySQL，包含本次 transaction 寫入的價格)
+    rebuilt = {}
+    if rebuild:
+        portfolios = {pid: index.portfolios[pid] for pid in rebuild}
+        matrix = price_store.fetch_matrix(connection, sorted({t for h in portfolios.values() for t in h}))
+        rebuilt = rebuild_portfolios(connection, portfolios, matrix, save=False)
+
+    save_states(connection, {**incremental, **rebuilt})
+    return {"incremental": len(incremental), "rebuilt": len(rebuilt), "days": days}
+
+
+def rebuild_portfolios(connection, portfolios, matrix=None, save=True):
+    """
+    從完整歷史重建組合的統計狀態與每日價值快照 (持股改變時由 services 在同一個 transaction 中呼叫)。
+    portfolios: {portfolio_id: {ticker: quantity}} (空持股代表清除快照與狀態)
+    matrix:     價格矩陣 (預設使用預載的 price_store，沒有預載時從 MySQL 讀取)
+    回傳 {portfolio_id: RunningStats}
+    """
+    if not portfolios:
+        return {}
+    tickers = sorted({t for holdings in portfolios.values() for t in holdings})
+    if matrix is None and tickers:
+        matrix = price_store.get_matrix() or price_store.fetch_matrix(connection, tickers)
+
+    rebuilt = {}
+    for portfolio_id, holdings in portfolios.items():
+        series = daily_values.compute_series(holdings, matrix)
+        daily_values.rebuild_portfolio(connection, portfolio_id, series)
+        rebuilt[portfolio_id] = RunningStats.from_series(holdings, series)
+
+    if save:
+        empty = [pid for pid, stats in rebuilt.items() if stats.as_of is None]
+        if empty:
+            cursor = connection.cursor()
+            cursor.execute(
+                f"DELETE FROM PortfolioRunningStats WHERE portfolio_id IN ({','.join(['%s'] * len(empty))})",
+                tuple(empty)
+            )
+            cursor.close()
+        save_states(connection, rebuilt)
+    return rebuilt
+
+
+def init_app(app):
+    """註冊 `flask refresh-portfolio-stats` 指令 (建立 / 校正統計狀態與每日價值快照)"""
+
+    @app.cli.command('refresh-portfolio-stats')
+    @click.option('--full', is_flag=True, help='所有組合都從完整歷史重建 (第一次建立快照時使用)')
+    def refresh_portfolio_stats_command(full):
+        """更新所有投資組合的增量統計與每日價值快照"""
+        from app.db import connect
+
+        connection = connect(app.config)
+        try:
+            result = refresh_running_stats(connection, full=full)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        click.echo(json.dumps(result))
@@ -0,0 +1,85 @@
+import dataclasses
+import decimal
+from datetime import date, datetime
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 沒有安裝 orjson 時退回標準庫 json (功能相同，只是比較慢)
+    orjson = None
+
+# ---------------------------------------------------------
+# JSON 序列化 (Flask JSON provider)
+# ---------------------------------------------------------
+# jsonify 預設使用標準庫 json，且不認得 NumPy 陣列，services 只好先 .tolist() 再逐筆 round。
+# 這裡的 provider 優先使用 orjson (C 實作)，直接序列化:
+#   - numpy.ndarray / NumPy 純量 (float64, int64, bool_ ...)
+#   - date / datetime (ISO 8601，例如 "2024-01-31")，也可以當作 dict 的 key
+#   - Decimal (pymysql 回傳的 DECIMAL 欄位)
+# services 只需要對整個陣列做一次 np.round，就可以直接放進回傳的 dict。
+# NaN / Infinity 以 null 輸出 (orjson 的行為)。
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def _default(obj):
+    """orjson / json 都不認得的型別，轉成可序列化的 Python 物件"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    以 orjson 為主的 JSON provider (未安裝時退回標準庫 json，並以 _default 處理 NumPy / 日期)。
+    不排序 key: 保留 services 建立 dict 的順序 (例如歷史走勢依日期排列)，也省下排序的時間。
+    """
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+    def _indent(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumps(self, obj, **kwargs):
+        # 呼叫端指定了 json.dumps 專屬的參數 (例如 cls) 時，交給標準庫處理
+        if orjson is None or set(kwargs) - {'indent', 'separators', 'sort_keys', 'ensure_ascii', 'default'}:
+            return super().dumps(obj, **kwargs)
+        option = ORJSON_OPTIONS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=kwargs.get('default', _default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        # 直接輸出 bytes，省下 str 編碼 / 解碼
+        obj = self._prepare_response_obj(args, kwargs)
+        option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if self._indent() else 0)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=option) + b"\n", mimetype=self.mimetype
+        )
+
+
+def init_app(app):
+    """在 create_app 中註冊 JSON provider (jsonify / request.get_json 都會使用)"""
+    app.json = FastJSONProvider(app)
@@ -0,0 +1,362 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from app.db import connect, fetch_columns, EPOCH_TO_DAYS
+
+# ---------------------------------------------------------
+# Price Store (預載的歷史價格矩陣)
+# ---------------------------------------------------------
+# 資料寫入流程 (seed.py) 在提交新價格後，把整張 HistoricalPrices 對齊成
+# 「日期 x 股票」矩陣，寫成二進位快取 (PRICE_STORE_DIR，預設為 backend/price_cache)：
+#
+#   <PRICE_STORE_DIR>/
+#       CURRENT              <- 目前版本名稱 (以 os.replace 原子性切換)
+#       v<timestamp>/
+#           index.json       <- 版本標頭: 格式版本、價格寫入版本、筆數、最新日期、矩陣大小
+#           dates.npy        <- datetime64[D]
+#           tickers.npy      <- 股票代號 (欄位順序)
+#           prices.npy       <- float64 (len(dates), len(tickers))，缺值為 NaN
+#
+# 每個 worker 以 np.load(mmap_mode='r') 掛載 (zero-copy、不需解析)，所有行程共用
+# 同一份 page cache，記憶體用量不會隨 worker 數量增加。新版本發布後，worker 在
+# 下一次存取時自動切換。gunicorn master 啟動時只要比對標頭與資料庫的價格寫入版本
+# (PriceIngestVersion 的單一一列，seed.py 寫入價格時遞增)，快取仍有效就直接掛載，過期才重新讀取 MySQL。
+# 沒有任何快取時 (例如 `flask run` 且尚未執行 seed.py)，services 會自動退回查詢資料庫。
+
+# 快取檔案格式版本 (格式改變時遞增，舊版本的快取會被視為無效)
+CACHE_FORMAT = 1
+
+_lock = threading.Lock()
+_matrix = None
+_store_dir = None
+_version = None
+_last_check = 0.0
+
+# worker 檢查 CURRENT 是否改變的最短間隔 (秒)
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class PriceMatrix:
+    """
+    對齊後的調整收盤價矩陣
+    dates:   np.ndarray (datetime64[D])，由舊到新排序
+    tickers: 股票代號列表 (欄位順序)
+    prices:  np.ndarray (float64)，shape = (len(dates), len(tickers))，缺值為 NaN
+    version: 發布版本名稱 (只存在單一行程記憶體時為 None)
+    header:  版本標頭 (index.json 的內容)
+    """
+
+    def __init__(self, dates, tickers, prices, version=None, header=None):
+        self.dates = dates
+        self.tickers = [str(t) for t in tickers]
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.prices = prices
+        self.version = version
+        self.header = header or {}
+
+    def frame(self, tickers, start_date=None):
+        """
+        取出指定股票 (與起始日期之後) 的子矩陣，格式與 services 中
+        `df.pivot(index='date', columns='ticker_symbol', values='adjusted_close')` 相同。
+        找不到任何資料時回傳 None。
+        """
+        columns = [t for t in tickers if t in self.ticker_index]
+        if not columns:
+            return None
+
+        start = 0
+        if start_date is not None:
+            start = np.searchsorted(self.dates, np.datetime64(start_date, 'D'))
+
+        col_idx = [self.ticker_index[t] for t in columns]
+        values = self.prices[start:, col_idx]
+
+        # 只保留「至少一檔有報價」的日期 (與 SQL 查詢的結果一致)
+        has_price = ~np.isnan(values).all(axis=1)
+        if not has_price.any():
+            return None
+
+        index = pd.DatetimeIndex(self.dates[start:][has_price], name='date')
+        df = pd.DataFrame(values[has_price], index=index, columns=columns)
+        df.columns.name = 'ticker_symbol'
+        return df
+
+    def first_date(self, tickers):
+        """回傳指定股票中最早有報價的日期 (datetime.date)；都沒有資料時回傳 None"""
+        col_idx = [self.ticker_index[t] for t in tickers if t in self.ticker_index]
+        if not col_idx:
+            return None
+        has_price = ~np.isnan(self.prices[:, col_idx]).all(axis=1)
+        if not has_price.any():
+            return None
+        return self.dates[np.argmax(has_price)].astype(object)
+
+    def series(self, ticker):
+        """取出單一股票的 (日期, 價格) 陣列，已去除缺值"""
+        i = self.ticker_index.get(ticker)
+        if i is None:
+            return None
+        values = self.prices[:, i]
+        mask = ~np.isnan(values)
+        return self.dates[mask], values[mask]
+
+
+def matrix_from_columns(days, tickers, prices, header=None):
+    """
+    把「長表格」(每列一筆 日期 / 股票 / 價格) 直接散佈成對齊的矩陣，不經過 pandas pivot。
+    days: int64 (距 1970-01-01 的天數)、tickers: 股票代號、prices: float64
+    """
+    unique_days, row_idx = np.unique(days, return_inverse=True)
+    unique_tickers, col_idx = np.unique(np.asarray(tickers, dtype=str), return_inverse=True)
+
+    prices_matrix = np.full((len(unique_days), len(unique_tickers)), np.nan)
+    prices_matrix[row_idx, col_idx] = prices
+    return PriceMatrix(unique_days.astype('datetime64[D]'), unique_tickers, prices_matrix, header=header)
+
+
+def fetch_matrix(connection, tickers=None, start_date=None):
+    """
+    從 MySQL 讀取 (指定股票 / 起始日期之後的) 調整收盤價並轉成 PriceMatrix。
+    使用 db.fetch_columns 的 tuple cursor 快速路徑；讀取 AllHistoricalPrices 視圖 (含歸檔資料)。
+    """
+    sql = f"""
+        SELECT TO_DAYS(date) - {EPOCH_TO_DAYS}, ticker_symbol, CAST(adjusted_close AS DOUBLE)
+        FROM AllHistoricalPrices
+        WHERE 1 = 1
+    """
+    params = []
+    if tickers is not None:
+        sql += f" AND ticker_symbol IN ({','.join(['%s'] * len(tickers))})"
+        params.extend(tickers)
+    if start_date is not None:
+        sql += " AND date >= %s"
+        params.append(start_date)
+
+    days, symbols, prices = fetch_columns(connection, sql, tuple(params), dtypes=(np.int64, object, np.float64))
+
+    header = {
+        'row_count': len(days),
+        'max_date': str(np.datetime64(int(days.max()), 'D')) if len(days) else None
+    }
+    return matrix_from_columns(days, symbols, prices, header=header)
+
+
+def build_matrix(connection):
+    """
+    從 MySQL 讀取全部歷史價格 (HistoricalPrices + 歸檔) 並轉成 PriceMatrix。
+    標頭記錄讀取前的寫入版本 (讀取期間有新的寫入時，下一次檢查會再重建)。
+    """
+    ingest_version = get_ingest_version(connection)
+    matrix = fetch_matrix(connection)
+    matrix.header['ingest_version'] = ingest_version
+    return matrix
+
+
+def get_ingest_version(connection):
+    """
+    價格寫入版本 (PriceIngestVersion，seed.py 寫入價格時在同一個 transaction 中遞增)，
+    用來判斷快取是否過期: 只讀一列，不必掃描整段歷史。
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT version FROM PriceIngestVersion WHERE id = 1")
+    row = cursor.fetchone()
+    cursor.close()
+    return int(row['version']) if row else 0
+
+
+def bump_ingest_version(cursor):
+    """寫入價格後呼叫 (與價格在同一個 transaction)，讓後端的快取視為過期"""
+    cursor.execute(
+        "INSERT INTO PriceIngestVersion (id, version) VALUES (1, 1) "
+        "ON DUPLICATE KEY UPDATE version = version + 1"
+    )
+
+
+def is_fresh(matrix, ingest_version):
+    """快取標頭的寫入版本與資料庫目前的版本一致才算有效"""
+    return matrix is not None and matrix.header.get('ingest_version') == ingest_version
+
+
+# ---------------------------------------------------------
+# 共享記憶體: 發布 (loader) / 掛載 (worker)
+# ---------------------------------------------------------
+
+def _read_current(store_dir):
+    try:
+        with open(os.path.join(store_dir, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(matrix, store_dir):
+    """
+    將價格矩陣寫入新的版本目錄，再以 os.replace 原子性地切換 CURRENT。
+    只保留新版本與前一個版本 (仍在讀取舊版本的 worker 不受影響)。
+    回傳新版本名稱。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    previous = _read_current(store_dir)
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(store_dir, version)
+    os.makedirs(version_dir)
+
+    np.save(os.path.join(version_dir, 'dates.npy'), matrix.dates)
+    np.save(os.path.join(version_dir, 'tickers.npy'), np.array(matrix.tickers, dtype=str))
+    np.save(os.path.join(version_dir, 'prices.npy'), np.ascontiguousarray(matrix.prices, dtype=np.float64))
+
+    # 標頭最後寫入：沒有 index.json 的目錄一律視為寫到一半的版本
+    header = {
+        **matrix.header,
+        'format': CACHE_FORMAT,
+        'version': version,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'shape': [len(matrix.dates), len(matrix.tickers)],
+    }
+    with open(os.path.join(version_dir, 'index.json'), 'w') as f:
+        json.dump(header, f)
+
+    tmp_path = os.path.join(store_dir, f'CURRENT.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(store_dir, 'CURRENT'))
+
+    # 清除更舊的版本 (已 mmap 的檔案在 Linux 上刪除後仍可繼續讀取)
+    for name in os.listdir(store_dir):
+        if name.startswith('v') and name not in (version, previous):
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+    return version
+
+
+def attach(store_dir, version=None):
+    """
+    以 mmap 掛載共享記憶體中的價格矩陣 (唯讀、zero-copy)。
+    找不到已發布的版本時回傳 None。
+    """
+    version = version or _read_current(store_dir)
+    if version is None:
+        return None
+
+    version_dir = os.path.join(store_dir, version)
+    try:
+        with open(os.path.join(version_dir, 'index.json')) as f:
+            header = json.load(f)
+        if header.get('format') != CACHE_FORMAT:
+            return None
+        dates = np.load(os.path.join(version_dir, 'dates.npy'), mmap_mode='r')
+        tickers = np.load(os.path.join(version_dir, 'tickers.npy'))
+        prices = np.load(os.path.join(version_dir, 'prices.npy'), mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+        return None
+    return PriceMatrix(dates, tickers, prices, version=version, header=header)
+
+
+def rebuild(connection, store_dir):
+    """
+    從 MySQL 重新建立價格快取並發布新版本 (資料寫入流程完成後呼叫)。
+    回傳掛載好的 PriceMatrix。
+    """
+    matrix = build_matrix(connection)
+    version = publish(matrix, store_dir)
+    return attach(store_dir, version)
+
+
+# ---------------------------------------------------------
+# 對外介面
+# ---------------------------------------------------------
+
+def init_app(app):
+    """記錄共享記憶體目錄，讓 worker 在存取時能自行掛載最新版本"""
+    global _store_dir
+    _store_dir = app.config.get('PRICE_STORE_DIR') or None
+
+
+def load(config):
+    """
+    載入價格矩陣 (gunicorn master 在 fork worker 之前、以及收到 SIGHUP 時呼叫)。
+    有設定 PRICE_STORE_DIR 時：快取標頭與資料庫一致就直接 mmap 掛載，
+    過期或不存在才從 MySQL 重建並發布新版本。
+    沒有設定時只載入到目前行程的記憶體。
+    """
+    global _matrix, _store_dir, _version
+    store_dir = config.get('PRICE_STORE_DIR') or None
+
+    connection = connect(config)
+    try:
+        if store_dir:
+            matrix = attach(store_dir)
+            if not is_fresh(matrix, get_ingest_version(connection)):
+                matrix = rebuild(connection, store_dir)
+        else:
+            matrix = build_matrix(connection)
+    finally:
+        # 連線不能帶進 fork 出來的 worker
+        connection.close()
+
+    with _lock:
+        _store_dir = store_dir
+        _matrix = matrix
+        _version = matrix.version
+    return matrix
+
+
+def _refresh():
+    """檢查共享記憶體是否有新版本，有的話切換過去"""
+    global _matrix, _version, _last_check
+    now = time.monotonic()
+    if now - _last_check < VERSION_CHECK_INTERVAL:
+        return
+    _last_check = now
+
+    current = _read_current(_store_dir)
+    if current is None or current == _version:
+        return
+
+    matrix = attach(_store_dir, current)
+    if matrix is None:
+        return
+    with _lock:
+        _matrix = matrix
+        _version = current
+
+
+def get_matrix():
+    """回傳目前的價格矩陣；尚未預載 (也沒有已發布的共享版本) 時回傳 None"""
+    if _store_dir is not None:
+        _refresh()
+    return _matrix
+
+
+def data_version():
+    """
+    目前價格資料的版本 (給回應快取當作 key 的一部分)。
+    共享快取以發布版本名稱表示；只在行程記憶體中的矩陣在行程存活期間不會改變，
+    以 'memory' 表示；沒有預載矩陣 (直接查 MySQL) 時版本未知，回傳 None。
+    """
+    matrix = get_matrix()
+    if matrix is None:
+        return None
+    return matrix.version or 'memory'
+
+
+def published_version():
+    """
+    已發布到 PRICE_STORE_DIR 的價格版本 (所有行程看到的都一樣，發布新價格時改變)；
+    只在行程記憶體中 ('memory') 或版本未知時回傳 None。
+    """
+    matrix = get_matrix()
+    return matrix.version if matrix is not None else None
+
+
+def clear():
+    """清除預載的價格矩陣 (之後的查詢會回到 MySQL)"""
+    global _matrix, _version
+    with _lock:
+        _matrix = None
+        _version = None
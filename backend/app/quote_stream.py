@@ -0,0 +1,354 @@
+import importlib
+import json
+import math
+import threading
+import time
+import numpy as np
+
+# ---------------------------------------------------------
+# 即時報價串流 (Server-Sent Events)
+# ---------------------------------------------------------
+# 前端關注清單原本以 setInterval 假造價格變動，真實資料只能輪詢 GET /watchlists/<user_id>。
+# 改為每個 worker 一個 QuoteHub:
+#   - 每檔股票只向報價來源 (QuoteSource) 訂閱一次，不論有多少個連線關注它 (以參考計數管理)
+#   - 報價來源的更新只記錄「最新報價」並標記為變動，不直接推送
+#   - 每 tick (QUOTE_STREAM_TICK 秒) 由一個執行緒把變動的股票分送給關注它的連線:
+#     每檔股票每 tick 只序列化一次，同一個連線同一 tick 的所有變動合併成一個事件
+#   - 只送出與該連線上次收到的值不同的報價 (delta)；連線來不及讀取時待送的報價會被新值覆蓋，
+#     記憶體不會隨更新次數成長
+# 報價來源可替換 (QUOTE_SOURCE)：預設為本機的模擬報價 (以資料庫最新收盤價為起點的隨機漫步)，
+# 正式行情來源只要實作 QuoteSource 的 subscribe / unsubscribe，並在有新報價時呼叫 hub.publish。
+
+DEFAULT_TICK = 1.0
+DEFAULT_HEARTBEAT = 15.0
+DEFAULT_MAX_CLIENTS = 32
+DEFAULT_MAX_SECONDS = 300.0
+MAX_STREAM_TICKERS = 200
+
+
+class QuoteSource:
+    """
+    報價來源介面。hub 在某檔股票第一次有人關注時呼叫 subscribe，沒有人關注時呼叫 unsubscribe；
+    來源在收到新報價時呼叫 hub.publish(ticker, price, change)。
+    """
+
+    def __init__(self, hub, config):
+        self.hub = hub
+
+    def subscribe(self, quotes):
+        """quotes: {ticker: {'price', 'change'}} (資料庫中的最新報價，可作為起始值)"""
+        raise NotImplementedError
+
+    def unsubscribe(self, tickers):
+        raise NotImplementedError
+
+
+class SimulatedQuoteSource(QuoteSource):
+    """
+    本機模擬報價 (開發 / 測試用): 每 QUOTE_SIM_INTERVAL 秒對每檔訂閱中的股票做一步隨機漫步，
+    漲跌幅以前一日收盤價計算 (與 get_stock_market_data 相同的定義)。
+    """
+
+    def __init__(self, hub, config):
+        super().__init__(hub, config)
+        self.interval = config.get('QUOTE_SIM_INTERVAL', 0.5)
+        self.volatility = config.get('QUOTE_SIM_VOLATILITY', 0.001)
+        self._lock = threading.Lock()
+        self._prices = {}       # ticker -> 目前價格
+        self._prev_close = {}   # ticker -> 前一日收盤價
+        self._thread = None
+        self._rng = np.random.default_rng()
+
+    def subscribe(self, quotes):
+        with self._lock:
+            for ticker, quote in quotes.items():
+                price = quote.get('price') or 0.0
+                change = quote.get('change') or 0.0
+                if price <= 0:
+                    # 沒有任何價格資料的股票不模擬
+                    continue
+                self._prices[ticker] = price
+                self._prev_close[ticker] = price / (1 + change / 100)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='simulated-quotes', daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, tickers):
+        with self._lock:
+            for ticker in tickers:
+                self._prices.pop(ticker, None)
+                self._prev_close.pop(ticker, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                tickers = list(self._prices)
+                if not tickers:
+                    continue
+                steps = np.exp(self._rng.normal(0.0, self.volatility, len(tickers)))
+                updates = []
+                for ticker, step in zip(tickers, steps):
+                    price = self._prices[ticker] * step
+                    self._prices[ticker] = price
+                    updates.append((ticker, price, (price / self._prev_close[ticker] - 1) * 100))
+            for ticker, price, change in updates:
+                self.hub.publish(ticker, price, change)
+
+
+QUOTE_SOURCES = {
+    'simulated': SimulatedQuoteSource,
+}
+
+
+class Subscriber:
+    """一個串流連線: 關注的股票、待送出的報價 (每檔只保留最新一筆) 與已送出的值"""
+
+    def __init__(self, tickers):
+        self.tickers = tickers
+        self._cond = threading.Condition()
+        self._pending = {}   # ticker -> (quote, 序列化後的 JSON 片段)
+        self._sent = {}      # ticker -> 上次送出的 quote
+        self.closed = False
+
+    def mark_sent(self, quotes):
+        """記錄連線建立時快照中已送出的報價 (之後只送出與它不同的值)"""
+        with self._cond:
+            self._sent.update(quotes)
+
+    def offer(self, ticker, quote, fragment):
+        with self._cond:
+            if self._sent.get(ticker) == quote:
+                self._pending.pop(ticker, None)
+                return
+            self._pending[ticker] = (quote, fragment)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def next_event(self, timeout):
+        """
+        等待下一批變動 (最多 timeout 秒)，回傳合併後的 JSON 物件字串 {"AAPL": {...}, ...}；
+        逾時回傳 None。
+        """
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            if not self._pending:
+                return None
+            pending, self._pending = self._pending, {}
+            for ticker, (quote, _) in pending.items():
+                self._sent[ticker] = quote
+        return '{' + ','.join(fragment for _, fragment in pending.values()) + '}'
+
+
+def _quote_fragment(ticker, quote):
+    price, change = quote
+    return f'{json.dumps(ticker)}:{{"ticker":{json.dumps(ticker)},"price":{price},"change":{change}}}'
+
+
+class QuoteHub:
+    """每個 worker 一個: 股票訂閱的參考計數、最新報價與按 tick 合併的分送 (thread-safe)"""
+
+    def __init__(self, source_factory=SimulatedQuoteSource, config=None, tick=DEFAULT_TICK):
+        self.tick = tick
+        self._config = config or {}
+        self._source_factory = source_factory
+        self._source = None
+        self._lock = threading.Lock()
+        self._subscribers = {}   # ticker -> set(Subscriber)
+        self._latest = {}        # ticker -> (price, change) (四捨五入到 2 位)
+        self._dirty = set()
+        self._flusher = None
+        self.published = 0
+        self.flushed = 0
+
+    def _ensure_started(self):
+        """第一次有連線時才建立報價來源與分送執行緒 (不在 gunicorn master fork 之前啟動執行緒)"""
+        if self._source is None:
+            self._source = self._source_factory(self, self._config)
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, name='quote-hub', daemon=True)
+            self._flusher.start()
+
+    def subscribe(self, tickers, quotes):
+        """
+        建立一個連線的訂閱。quotes: 資料庫中的最新報價 {ticker: {'price', 'change'}}，
+        給第一次被關注的股票當作起始值。回傳 (Subscriber, 目前的完整報價快照 JSON)。
+        """
+        subscriber = Subscriber(tickers)
+        with self._lock:
+            self._ensure_started()
+            new = {t: quotes.get(t, {}) for t in tickers if not self._subscribers.get(t)}
+            for ticker, quote in new.items():
+                self._latest[ticker] = self._round(quote.get('price', 0), quote.get('change', 0))
+            snapshot = {t: self._latest[t] for t in tickers}
+            # 先記錄快照再加入分送名單，分送執行緒不會重送快照中的值
+            subscriber.mark_sent(snapshot)
+            for ticker in tickers:
+                self._subscribers.setdefault(ticker, set()).add(subscriber)
+        if new:
+            self._source.subscribe(new)
+
+        return subscriber, '{' + ','.join(_quote_fragment(t, q) for t, q in snapshot.items()) + '}'
+
+    def untracked(self, tickers):
+        """還沒有任何連線關注的股票 (需要從資料庫讀取起始報價)"""
+        with self._lock:
+            return [t for t in tickers if not self._subscribers.get(t)]
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        released = []
+        with self._lock:
+            for ticker in subscriber.tickers:
+                subs = self._subscribers.get(ticker)
+                if subs is None:
+                    continue
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[ticker]
+                    self._latest.pop(ticker, None)
+                    self._dirty.discard(ticker)
+                    released.append(ticker)
+        if released:
+            self._source.unsubscribe(released)
+
+    @staticmethod
+    def _round(price, change):
+        return round(float(price), 2), round(float(change), 2)
+
+    def publish(self, ticker, price, change):
+        """報價來源呼叫: 只更新最新報價並標記變動 (實際分送在下一個 tick)"""
+        if not (math.isfinite(price) and math.isfinite(change)):
+            return
+        quote = self._round(price, change)
+        with self._lock:
+            if ticker not in self._subscribers or self._latest.get(ticker) == quote:
+                return
+            self._latest[ticker] = quote
+            self._dirty.add(ticker)
+            self.published += 1
+
+    def flush(self):
+        """把上一個 tick 以來變動的報價分送給關注的連線 (每檔股票序列化一次)"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            batch = [
+                (ticker, self._latest[ticker], list(self._subscribers.get(ticker, ())))
+                for ticker in dirty if ticker in self._latest
+            ]
+        for ticker, quote, subscribers in batch:
+            fragment = _quote_fragment(ticker, quote)
+            for subscriber in subscribers:
+                subscriber.offer(ticker, quote, fragment)
+        self.flushed += len(batch)
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            clients = set()
+            for subs in self._subscribers.values():
+                clients.update(subs)
+            return {
+                "clients": len(clients),
+                "tickers": len(self._subscribers),
+                "published": self.published,
+                "flushedQuotes": self.flushed,
+            }
+
+
+def _load_source(name):
+    """QUOTE_SOURCE: 'simulated' 或 'package.module:ClassName' (QuoteSource 的子類別)"""
+    if name in QUOTE_SOURCES:
+        return QUOTE_SOURCES[name]
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+_settings = {
+    'heartbeat': DEFAULT_HEARTBEAT,
+    'max_clients': DEFAULT_MAX_CLIENTS,
+    'max_seconds': DEFAULT_MAX_SECONDS,
+}
+_hub = QuoteHub()
+_clients = threading.BoundedSemaphore(DEFAULT_MAX_CLIENTS)
+
+
+def get_hub():
+    return _hub
+
+
+def try_acquire_client():
+    """每個 worker 的串流連線上限 (每個連線佔用一個 gunicorn 執行緒)；已滿時回傳 False"""
+    return _clients.acquire(blocking=False)
+
+
+def release_client():
+    _clients.release()
+
+
+def stream_events(subscriber, snapshot):
+    """
+    產生 SSE 資料: 先送出完整快照 (event: snapshot)，之後只送出變動 (event: quotes)；
+    沒有變動時每 heartbeat 秒送出註解行保持連線，超過 max_seconds 後結束
+    (EventSource 會自動重新連線，讓連線能在 worker 重啟 / 擴充時重新分配)。
+    """
+    tick = _hub.tick
+    heartbeat, max_seconds = _settings['heartbeat'], _settings['max_seconds']
+    deadline = time.monotonic() + max_seconds
+    last_sent = time.monotonic()
+    yield f"retry: 3000\nevent: snapshot\ndata: {snapshot}\n\n"
+    while time.monotonic() < deadline and not subscriber.closed:
+        data = subscriber.next_event(tick)
+        now = time.monotonic()
+        if data is not None:
+            last_sent = now
+            yield f"event: quotes\ndata: {data}\n\n"
+        elif now - last_sent >= heartbeat:
+            last_sent = now
+            yield ": ping\n\n"
+
+
+def close_stream(subscriber):
+    """
+    連線結束 (正常結束、用戶端斷線、或串流還沒開始就被關閉) 時呼叫:
+    取消訂閱並釋放連線名額 (可重複呼叫)。
+    """
+    if subscriber.closed:
+        return
+    _hub.unsubscribe(subscriber)
+    release_client()
+
+
+def stats():
+    return {**_hub.stats(), "maxClients": _settings['max_clients']}
+
+
+def init_app(app):
+    """
+    讀取串流設定:
+        QUOTE_SOURCE              -> 報價來源 ('simulated' 或 'package.module:ClassName')
+        QUOTE_STREAM_TICK         -> 合併分送的間隔 (秒)
+        QUOTE_STREAM_HEARTBEAT    -> 沒有變動時送出 heartbeat 的間隔 (秒)
+        QUOTE_STREAM_MAX_CLIENTS  -> 每個 worker 同時的串流連線上限，超過時回傳 503
+        QUOTE_STREAM_MAX_SECONDS  -> 單一連線的最長時間，之後由用戶端自動重新連線
+        QUOTE_SIM_INTERVAL / QUOTE_SIM_VOLATILITY -> 模擬報價的更新間隔與每步波動
+    """
+    global _hub, _clients
+    _settings['heartbeat'] = app.config.get('QUOTE_STREAM_HEARTBEAT', DEFAULT_HEARTBEAT)
+    _settings['max_clients'] = app.config.get('QUOTE_STREAM_MAX_CLIENTS', DEFAULT_MAX_CLIENTS)
+    _settings['max_seconds'] = app.config.get('QUOTE_STREAM_MAX_SECONDS', DEFAULT_MAX_SECONDS)
+    _hub = QuoteHub(
+        source_factory=_load_source(app.config.get('QUOTE_SOURCE', 'simulated')),
+        config=app.config,
+        tick=app.config.get('QUOTE_STREAM_TICK', DEFAULT_TICK)
+    )
+    _clients = threading.BoundedSemaphore(max(1, _settings['max_clients']))
@@ -0,0 +1,305 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app import admission, coalesce, compression, price_store
+
+# ---------------------------------------------------------
+# 回應快取 (每個 worker 行程各一份，LRU)
+# ---------------------------------------------------------
+# 快取的是「序列化後的 JSON bytes」，每個編碼 (br / gzip) 的壓縮結果也存在同一筆快取裡，
+# 因此每筆快取最多只壓縮一次 / 每種編碼，之後的請求直接回傳壓縮好的 bytes。
+# key 由各路由的 key 函式產生，必須包含資料版本 (價格矩陣版本、持股指紋...)，
+# 資料更新後 key 自然改變，舊的快取會被 LRU 淘汰，不需要主動失效。
+# 快取未命中時以同一個 key 做 single-flight (app/coalesce.py)：同時到達的相同請求只計算一次，
+# 其他請求共用結果 (X-Cache: COALESCED)。等待結果的請求同樣佔用執行緒，
+# 因此路由有准入控制 (admission_limited) 時，未命中就先取得 worker 總上限的名額，滿了直接回傳 503。
+# 另外可以設定跨 worker 共用的結果目錄 (RESPONSE_STORE_DIR): 計算結果也會寫到磁碟，
+# 其他 worker (以及重新載入價格後 fork 的新 worker) 未命中記憶體快取時先讀取磁碟 (X-Cache: STORE)。
+# 價格寫入後的預先計算 (app/warmup.py) 就是把結果寫到這個目錄。
+# 結果目錄只在價格資料是已發布版本 (PRICE_STORE_DIR) 時使用: 'memory' 版本的 key 在價格更新、
+# 重新啟動後都不會改變，寫到磁碟的結果會一直被當成有效的結果讀回來。
+# 過期的檔案在啟動時與寫入時 (最多每 PRUNE_INTERVAL 秒一次) 清除，不依賴預先計算。
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_STORE_MAX_AGE = 3 * 24 * 3600
+# 寫入結果時順便清除過期檔案的最短間隔 (秒，每個行程各自計算)
+PRUNE_INTERVAL = 3600
+
+
+class CachedPayload:
+    """一筆快取: 原始 body 與各編碼的壓縮結果"""
+
+    def __init__(self, key, body, mimetype, status_code=200):
+        self.key = key
+        self.body = body
+        self.mimetype = mimetype
+        self.status_code = status_code
+        self.variants = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+    def variant(self, encoding):
+        """取得某個編碼的 body (第一次使用時才壓縮並保存)"""
+        if encoding is None:
+            return self.body
+        data = self.variants.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self.variants.get(encoding)
+                if data is None:
+                    data = compression.compress(self.body, encoding)
+                    self.variants[encoding] = data
+                    _cache.grow(self, len(data))
+        return data
+
+    def to_response(self, cache_status='HIT'):
+        """依照目前請求的 Accept-Encoding 組出回應"""
+        compressible = compression.should_compress(len(self.body), self.mimetype)
+        encoding = compression.negotiate() if compressible else None
+        response = current_app.response_class(
+            self.variant(encoding), status=self.status_code, mimetype=self.mimetype
+        )
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if compressible:
+            compression.add_vary(response)
+        response.headers['X-Cache'] = cache_status
+        return response
+
+    def dumps(self):
+        """序列化 (交給其他 worker): 第一行為 "<status> <mimetype>"，之後為 body"""
+        return f"{self.status_code} {self.mimetype}\n".encode() + self.body
+
+    @classmethod
+    def loads(cls, key, data):
+        header, body = data.split(b"\n", 1)
+        status_code, mimetype = header.decode().split(' ', 1)
+        return cls(key, body, mimetype, int(status_code))
+
+
+class ResponseCache:
+    """以 bytes 總量為上限的 LRU 快取 (thread-safe)"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def grow(self, entry, delta):
+        """某筆快取新增了壓縮版本，更新總量 (已被淘汰的快取不計)"""
+        with self._lock:
+            if self._entries.get(entry.key) is entry:
+                self._bytes += delta
+                self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class ResultStore:
+    """
+    跨 worker 共用的結果目錄: 每筆結果一個檔案 (<key hash>.bin，內容為 CachedPayload.dumps())。
+    key 含有資料版本，過期的檔案不會再被讀到，由 prune() 依修改時間清除。
+    """
+
+    def __init__(self, directory, max_age=DEFAULT_STORE_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self._last_prune = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.bin')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return CachedPayload.loads(key, f.read())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(entry.dumps())
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+        if time.monotonic() - self._last_prune > PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self, max_age=None):
+        """刪除超過 max_age (預設 self.max_age) 秒沒有更新的結果，回傳刪除的檔案數"""
+        self._last_prune = time.monotonic()
+        max_age = self.max_age if max_age is None else max_age
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.bin') and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+_cache = ResponseCache()
+_store = None
+
+
+def _shared_store():
+    """價格資料是已發布版本時回傳結果目錄，否則回傳 None (不讀也不寫)"""
+    if _store is None or price_store.published_version() is None:
+        return None
+    return _store
+
+
+def cached_response(key_func):
+    """
+    路由 decorator: 以 key_func(*args, **kwargs) 的結果快取 200 回應。
+    key_func 回傳 None 時 (例如資料版本未知) 不使用快取，也不合併請求。
+    未命中時相同 key 的並行請求只執行一次 view，其他請求共用同一個結果；
+    只有 2xx 的回應會被共用 / 寫入結果目錄。錯誤回應 (例如准入控制的 503 / 429 + Retry-After)
+    與串流回應原樣 (含 headers) 只回給計算的請求，等待的請求各自執行 view。
+    內層是 admission_limited 時，合併等待期間也佔用 worker 總上限的名額。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = key_func(*args, **kwargs)
+            if key is None:
+                return view(*args, **kwargs)
+
+            if _cache.max_bytes > 0:
+                entry = _cache.get(key)
+                if entry is not None:
+                    return entry.to_response('HIT')
+
+            gate = getattr(view, 'admission_gate', None)
+            if gate is None:
+                return _compute_response(key, view, args, kwargs)
+            release_slot, rejected = admission.claim_worker_slot(gate)
+            if rejected is not None:
+                return rejected
+            try:
+                return _compute_response(key, view, args, kwargs)
+            finally:
+                release_slot()
+        return wrapper
+    return decorator
+
+
+def _compute_response(key, view, args, kwargs):
+    """快取未命中: 合併相同 key 的請求計算 (或由結果目錄讀取) 回應"""
+    own = {}
+    source = {}
+    store = _shared_store()
+
+    def compute():
+        if store is not None:
+            entry = store.get(key)
+            if entry is not None:
+                source['store'] = True
+                return entry
+
+        response = current_app.make_response(view(*args, **kwargs))
+        own['response'] = response
+        if response.is_streamed or not 200 <= response.status_code < 300:
+            return None
+        entry = CachedPayload(key, response.get_data(), response.mimetype, response.status_code)
+        if store is not None and entry.status_code == 200:
+            store.put(key, entry)
+        return entry
+
+    entry, shared = coalesce.coalesced(
+        key, compute,
+        dumps=lambda payload: payload.dumps() if payload is not None else None,
+        loads=lambda data: CachedPayload.loads(key, data)
+    )
+    if entry is not None and entry.status_code == 200 and _cache.max_bytes > 0:
+        _cache.put(key, entry)
+
+    response = own.get('response')
+    if response is not None:
+        # 計算的請求: 回傳 view 原本的回應 (保留 headers)
+        if not response.is_streamed:
+            response.headers['X-Cache'] = 'MISS'
+        return response
+    if entry is None:
+        # 計算的請求沒有可共用的結果 (錯誤 / 串流回應): 自行執行
+        return view(*args, **kwargs)
+    return entry.to_response('COALESCED' if shared else 'STORE')
+
+
+def get_cache():
+    return _cache
+
+
+def get_store():
+    """跨 worker 的結果目錄 (沒有設定 RESPONSE_STORE_DIR 時為 None)"""
+    return _store
+
+
+def init_app(app):
+    """
+    RESPONSE_CACHE_MAX_BYTES: 每個 worker 的快取上限 (bytes)，設為 0 關閉快取
+    RESPONSE_STORE_DIR:       跨 worker 共用的結果目錄，空字串代表不使用
+    RESPONSE_STORE_MAX_AGE:   結果目錄中超過此秒數沒有更新的檔案會被清除
+    """
+    global _store
+    _cache.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    directory = app.config.get('RESPONSE_STORE_DIR')
+    _store = None
+    if directory:
+        _store = ResultStore(directory, app.config.get('RESPONSE_STORE_MAX_AGE', DEFAULT_STORE_MAX_AGE))
+        _store.prune()
@@ -1,11 +1,157 @@
-from flask import Blueprint, jsonify, request
+import math
+from flask import Blueprint, Response, jsonify, request
+from datetime import date
 from app.db import get_db
 import pymysql
 import app.services as services
+from app import simulation, price_store
+from app.response_cache import cached_response, get_cache
+from app import admission, coalesce, warmup, security_index, quote_stream
+from app.admission import admission_limited
 
 # 建立符合 /api/v1 規格的 Blueprint
 api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
+def _finite_number(value, name):
+    """
+    JSON body 中的數值: 只接受 int / float (不含 bool)，且必須是有限值
+    (Flask 的 JSON 解析器接受 NaN / Infinity)。格式錯誤時拋出 ValueError。
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return float(value)
+
+def _parse_history_args():
+    """
+    解析歷史走勢 API 共用的 query string: start (YYYY-MM-DD)、points (正整數)
+    格式錯誤時拋出 ValueError。
+    """
+    start_date = request.args.get('start')
+    if start_date:
+        start_date = date.fromisoformat(start_date).isoformat()
+    else:
+        start_date = None
+
+    points = request.args.get('points', type=str)
+    if points:
+        points = int(points)
+        if points <= 0:
+            raise ValueError("points must be a positive integer")
+    else:
+        points = None
+    return start_date, points
+
+def _parse_page_args():
+    """
+    解析分頁 API 共用的 query string: limit (1 ~ MAX_PAGE_SIZE)、cursor (上一頁回傳的 nextCursor)
+    格式錯誤時拋出 ValueError。
+    """
+    try:
+        limit = int(request.args.get('limit', security_index.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= security_index.MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {security_index.MAX_PAGE_SIZE}")
+    return limit, request.args.get('cursor') or None
+
+def _parse_simulation_args():
+    """
+    解析蒙地卡羅模擬 API 共用的 query string，回傳 simulate_*_growth 的參數 (dict)
+    格式錯誤時拋出 ValueError。
+    """
+    mode = request.args.get('mode', 'gbm')
+    if mode not in simulation.SIMULATION_MODES:
+        raise ValueError(f"mode must be one of {', '.join(simulation.SIMULATION_MODES)}")
+    try:
+        n_paths = int(request.args.get('paths', 1000))
+        block_days = int(request.args.get('block', simulation.DEFAULT_BLOCK_DAYS))
+    except ValueError:
+        raise ValueError("paths and block must be integers")
+    if not 100 <= n_paths <= 100000 or not 1 <= block_days <= 252:
+        raise ValueError("paths must be between 100 and 100000, block between 1 and 252")
+    sampler = request.args.get('sampler', 'pseudo')
+    if sampler not in simulation.SAMPLERS or (sampler == 'antithetic' and mode != 'gbm'):
+        raise ValueError("sampler must be pseudo or sobol (antithetic is gbm only)")
+    step = request.args.get('step', 'year')
+    if step not in services.SIMULATION_STEPS:
+        raise ValueError("step must be year or day")
+
+    # 計算量上限: 路徑數 x 步數 (Sobol 加權)，bootstrap 另外限制抽出的區塊數
+    total_days = services.SIMULATION_YEARS * simulation.TRADING_DAYS
+    n_steps = total_days // services.SIMULATION_STEPS[step]
+    if n_paths * n_steps * services.SAMPLER_COST.get(sampler, 1) > services.MAX_PATH_STEPS:
+        max_paths = services.MAX_PATH_STEPS // (n_steps * services.SAMPLER_COST.get(sampler, 1))
+        raise ValueError(f"at most {max_paths} paths with step={step} and sampler={sampler}")
+    if mode == 'bootstrap' and n_paths * -(-total_days // block_days) > services.MAX_BOOTSTRAP_BLOCKS:
+        raise ValueError(
+            f"paths x ceil({total_days} / block) must not exceed {services.MAX_BOOTSTRAP_BLOCKS} "
+            "(use fewer paths or a longer block)"
+        )
+    stream = request.args.get('stream')
+    if stream is not None:
+        stream = stream.lower() in ('1', 'true', 'yes')
+    try:
+        target = request.args.get('target', type=str)
+        target = float(target) if target else None
+    except ValueError:
+        raise ValueError("target must be a number")
+    if target is not None and target <= 0:
+        raise ValueError("target must be positive")
+
+    return {
+        "mode": mode, "n_paths": n_paths, "block_days": block_days, "sampler": sampler,
+        "step": step, "stream": stream, "target": target
+    }
+
+def _format_simulation(result, options):
+    """
+    把模擬結果轉換為前端需要的格式 (portfolioVal 為 array of objects)
+    格式: [ {"percentile": "10th", "values": [...], ...指標}, ... ]
+    """
+    percentiles = result['percentiles']
+    formatted_val = []
+    # 依照常見順序排列 (指標由模擬引擎以所有路徑的分佈計算)
+    for key in ["10th", "25th", "50th", "75th", "90th"]:
+        if key in percentiles:
+            metrics = dict(result['metrics'][key])
+            metrics['percentile'] = key
+            metrics['values'] = percentiles[key]
+            metrics['standard_error'] = result['standard_errors'][key]
+            formatted_val.append(metrics)
+
+    return {
+        "mode": options['mode'],
+        "sampler": options['sampler'],
+        "paths": result['paths'],
+        "step": options['step'],
+        "streamed": result['streamed'],
+        "summary": result['summary'],
+        "portfolioVal": formatted_val
+    }
+
+def _price_cache_key(*args, **kwargs):
+    """
+    回應快取 key: 路徑 + query string + 價格資料版本 (只依賴價格的 API)
+    價格版本未知 (沒有預載價格矩陣) 時不快取。
+    """
+    version = price_store.data_version()
+    if version is None:
+        return None
+    return (request.path, request.query_string, version)
+
+def _portfolio_cache_key(portfolio_id, **kwargs):
+    """
+    回應快取 key: 路徑 + query string + 價格資料版本 + 持股指紋
+    持股或價格任一改變，key 就不同。組合不存在時不快取。
+    """
+    version = price_store.data_version()
+    if version is None:
+        return None
+    fingerprint = services.get_portfolio_fingerprint(portfolio_id)
+    if fingerprint is None:
+        return None
+    return (request.path, request.query_string, version, fingerprint)
+
 # ------------------------------------------------------------------
 # API: User (符合 user.md 規格)
 # ------------------------------------------------------------------
@@ -188,10 +334,21 @@ def user_login():
 @api_v1.route('/assets', methods=['GET'])
 def getAssets():
     """
-    取得所有資產列表
+    取得資產列表 (依代號排序，游標分頁)
     ---
     tags:
       - Asset Information
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: (選填) 每頁筆數 (1 ~ 500)；未指定 limit 與 cursor 時回傳完整列表 (相容舊版)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: (選填) 上一頁回傳的 nextCursor
     responses:
       200:
         description: 成功取得資產列表
@@ -206,14 +363,94 @@ def getAssets():
               items:
                 type: string
                 example: "AAPL"
+            nextCursor:
+              type: string
+              description: 下一頁的游標，沒有下一頁時為 null
+      400:
+        description: 參數格式錯誤
     """
     try:
-        assets_data = services.get_all_stock_tickers()
+        if 'limit' not in request.args and 'cursor' not in request.args:
+            assets_data, next_cursor = services.get_all_stock_tickers(), None
+        else:
+            limit, cursor = _parse_page_args()
+            assets_data, next_cursor = services.list_assets(limit, cursor)
         return jsonify({
             "data": assets_data,
+            "nextCursor": next_cursor,
+            "code": 1,
+            "message": "assets retrieved successfully"
+        }), 200
+    except ValueError as e:
+        return jsonify({"data": [], "code": 0, "message": f"Invalid parameter: {e}"}), 400
+    except Exception as e:
+        return jsonify({
+            "data": [],
+            "code": 0,
+            "message": f"An unexpected error occurred: {e}"
+        }), 500
+
+@api_v1.route('/assets/search', methods=['GET'])
+def searchAssets():
+    """
+    以代號或名稱搜尋資產 (不分大小寫；代號完全相同 > 代號前綴 > 名稱單字前綴 > 子字串)
+    ---
+    tags:
+      - Asset Information
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: 搜尋字串
+        example: "app"
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: (選填) 每頁筆數 (1 ~ 500，預設 50)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: (選填) 上一頁回傳的 nextCursor
+    responses:
+      200:
+        description: 成功取得搜尋結果
+        schema:
+          type: object
+          properties:
+            data:
+              type: array
+              items:
+                type: object
+                properties:
+                  ticker:
+                    type: string
+                    example: "AAPL"
+                  name:
+                    type: string
+                    example: "Apple Inc."
+                  exchange:
+                    type: string
+                    example: "NMS"
+            nextCursor:
+              type: string
+              description: 下一頁的游標，沒有下一頁時為 null
+      400:
+        description: 參數格式錯誤
+    """
+    try:
+        limit, cursor = _parse_page_args()
+        results, next_cursor = services.search_assets(request.args.get('q', ''), limit, cursor)
+        return jsonify({
+            "data": results,
+            "nextCursor": next_cursor,
             "code": 1,
             "message": "assets retrieved successfully"
         }), 200
+    except ValueError as e:
+        return jsonify({"data": [], "code": 0, "message": f"Invalid parameter: {e}"}), 400
     except Exception as e:
         return jsonify({
             "data": [],
@@ -222,6 +459,7 @@ def getAssets():
         }), 500
 
 @api_v1.route('/assets/price/<string:ticker_symbol>', methods=['GET'])
+@cached_response(_price_cache_key)
 def getAssetHistoricalPrices(ticker_symbol):
     """
     取得特定資產歷史股價
@@ -235,6 +473,16 @@ def getAssetHistoricalPrices(ticker_symbol):
         required: true
         description: 股票代號 (例如 AAPL)
         example: "AAPL"
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: (選填) 起始日期 YYYY-MM-DD
+      - name: points
+        in: query
+        type: integer
+        required: false
+        description: (選填) 需要的資料點數，會自動改用能滿足點數的最粗解析度 (日 / 週 / 月)
     responses:
       200:
         description: 成功取得歷史股價
@@ -246,15 +494,26 @@ def getAssetHistoricalPrices(ticker_symbol):
               properties:
                 assetName:
                   type: string
+                resolution:
+                  type: string
+                  description: "D (日) / W (週) / M (月)"
                 historicalPrice:
                   type: object
                   description: 日期與價格的對應
                   example: {"2023-01-01": 150.0, "2023-01-02": 152.5}
+      400:
+        description: 參數格式錯誤
       404:
         description: 找不到該資產
     """
     try:
-        history = services.get_security_history(ticker_symbol)
+        start_date, points = _parse_history_args()
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        resolution = services.get_history_resolution([ticker_symbol], start_date, points)
+        history = services.get_security_history(ticker_symbol, start_date, resolution)
         if not history:
             return jsonify({
                 "data": {},
@@ -265,6 +524,7 @@ def getAssetHistoricalPrices(ticker_symbol):
         return jsonify({
             "data": {
                 "assetName": ticker_symbol,
+                "resolution": resolution,
                 "historicalPrice": history
             },
             "code": 1,
@@ -542,6 +802,8 @@ def deletePortfolio(portfolio_id):
         return jsonify({"code": 0, "message": f"Error: {e}"}), 500
 
 @api_v1.route('/portfolio/performance/<int:portfolio_id>', methods=['GET'])
+@cached_response(_portfolio_cache_key)
+@admission_limited('analytics')
 def getPortfolioPerformance(portfolio_id):
     """
     取得歷史績效回測
@@ -553,13 +815,30 @@ def getPortfolioPerformance(portfolio_id):
         in: path
         type: integer
         required: true
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: (選填) 起始日期 YYYY-MM-DD
+      - name: points
+        in: query
+        type: integer
+        required: false
+        description: (選填) 需要的資料點數，會自動改用能滿足點數的最粗解析度 (日 / 週 / 月)
     responses:
       200:
         description: 成功取得績效數據
+      400:
+        description: 參數格式錯誤
     """
+    try:
+        start_date, points = _parse_history_args()
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
     try:
         # 呼叫 Service
-        result = services.get_portfolio_performance_history(portfolio_id)
+        result = services.get_portfolio_performance_history(portfolio_id, start_date, points)
         
         if result is None:
             return jsonify({
@@ -579,6 +858,8 @@ def getPortfolioPerformance(portfolio_id):
         return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
 
 @api_v1.route('/portfolio/simulation/<int:portfolio_id>', methods=['GET'])
+@cached_response(_portfolio_cache_key)
+@admission_limited('simulation')
 def simulatePortfolio(portfolio_id):
     """
     執行蒙地卡羅模擬 (未來預測)
@@ -590,37 +871,76 @@ def simulatePortfolio(portfolio_id):
         in: path
         type: integer
         required: true
+      - name: mode
+        in: query
+        type: string
+        required: false
+        default: gbm
+        enum: [gbm, bootstrap]
+        description: gbm (常態分佈) 或 bootstrap (以區塊重抽樣歷史日報酬，保留厚尾)
+      - name: paths
+        in: query
+        type: integer
+        required: false
+        default: 1000
+        description: 模擬路徑數 (最多 100,000)
+      - name: block
+        in: query
+        type: integer
+        required: false
+        default: 21
+        description: bootstrap 模式的區塊長度 (交易日)
+      - name: sampler
+        in: query
+        type: string
+        required: false
+        default: pseudo
+        enum: [pseudo, antithetic, sobol]
+        description: 亂數來源 (變異數縮減)。antithetic 只適用 gbm；sobol 的每組路徑數會進位到 2 的次方
+      - name: step
+        in: query
+        type: string
+        required: false
+        default: year
+        enum: [year, day]
+        description: 每年一點或每個交易日一點
+      - name: stream
+        in: query
+        type: boolean
+        required: false
+        description: (選填) 強制開啟 / 關閉串流模式 (分批產生路徑 + 分位數草圖，記憶體固定)；預設依路徑數 x 步數自動決定
+      - name: target
+        in: query
+        type: number
+        required: false
+        description: (選填) 目標價值，回傳模擬期間觸及目標的機率 (預設為目前價值的 2 倍)
     responses:
       200:
         description: 成功回傳模擬數據 (百分位數)
+      400:
+        description: 參數錯誤或沒有歷史資料
     """
+    try:
+        options = _parse_simulation_args()
+    except ValueError as e:
+        return jsonify({"data": [], "code": 0, "message": str(e)}), 400
+
     try:
         # 呼叫 Service 執行模擬
-        percentiles = services.simulate_portfolio_growth(portfolio_id)
+        result = services.simulate_portfolio_growth(portfolio_id, **options)
         
-        if percentiles is None:
+        if result is None:
             return jsonify({
                 "data": [],
                 "code": 0,
                 "message": "Fail to stimulate (No history or portfolio empty)"
             }), 400
 
-        # 轉換為前端需要的格式 array of objects
-        # 格式: [ {"10th": [...]}, {"25th": [...]}, ... ]
-        formatted_val = []
-        # 依照常見順序排列
-        for key in ["10th", "25th", "50th", "75th", "90th"]:
-            if key in percentiles:
-                metrics = services.get_portfolio_metrics(portfolio_id, stimulated_data=percentiles[key]) #dict of metrics
-                metrics['percentile'] = key
-                metrics['values'] = percentiles[key]
-                formatted_val.append(metrics)
-
         return jsonify({
             "data": {
                 "portfolioId": portfolio_id,
                 "name": f"Portfolio {portfolio_id}", # (可選: 再去 DB 查真實名稱)
-                "portfolioVal": formatted_val
+                **_format_simulation(result, options)
             },
             "code": 1,
             "message": "successfully stimulate"
@@ -629,7 +949,41 @@ def simulatePortfolio(portfolio_id):
     except Exception as e:
         return jsonify({"data": [], "code": 0, "message": str(e)}), 500
 
+@api_v1.route('/portfolio/stats/<int:portfolio_id>', methods=['GET'])
+def getPortfolioRunningStats(portfolio_id):
+    """
+    取得投資組合的最新統計 (增量維護: 最新價值、歷史最高價值與回撤、一年期報酬 / 波動 / Sharpe)
+    ---
+    tags:
+      - Analysis & Simulation
+    parameters:
+      - name: portfolio_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: 成功回傳統計
+      404:
+        description: 組合不存在、沒有持股或沒有價格資料
+    """
+    try:
+        stats = services.get_portfolio_running_stats(portfolio_id)
+        if stats is None:
+            return jsonify({"data": {}, "code": 0, "message": "Portfolio not found or no price history"}), 404
+
+        return jsonify({
+            "data": {"portfolioId": portfolio_id, **stats},
+            "code": 1,
+            "message": "portfolio stats successfully retrieved"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
 @api_v1.route('/portfolio/recommendation/<int:portfolio_id>', methods=['GET'])
+@cached_response(_portfolio_cache_key)
+@admission_limited('recommendation')
 def recommendPortfolio(portfolio_id):
     """
     取得智能投資建議
@@ -665,6 +1019,536 @@ def recommendPortfolio(portfolio_id):
     except Exception as e:
         return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
 
+@api_v1.route('/portfolio/frontier/<int:portfolio_id>', methods=['GET'])
+@admission_limited('recommendation')
+def getPortfolioFrontier(portfolio_id):
+    """
+    計算效率前緣 (均值-變異數最佳化)
+    ---
+    tags:
+      - Analysis & Simulation
+    parameters:
+      - name: portfolio_id
+        in: path
+        type: integer
+        required: true
+      - name: points
+        in: query
+        type: integer
+        required: false
+        default: 20
+        description: 效率前緣上的組合數量 (最多 200)
+      - name: method
+        in: query
+        type: string
+        required: false
+        enum: [analytic, montecarlo]
+        default: analytic
+        description: "analytic: 封閉解 (允許放空) / montecarlo: 只做多的隨機權重掃描"
+      - name: samples
+        in: query
+        type: integer
+        required: false
+        default: 100000
+        description: montecarlo 模式的候選組合數量 (最多 1,000,000)
+    responses:
+      200:
+        description: 成功回傳效率前緣 (含最小變異與最大夏普組合)
+      400:
+        description: 參數錯誤或資料不足
+    """
+    method = request.args.get('method', 'analytic')
+    try:
+        n_points = int(request.args.get('points', 20))
+        n_samples = int(request.args.get('samples', 100000))
+    except ValueError:
+        return jsonify({"data": {}, "code": 0, "message": "points and samples must be integers"}), 400
+
+    if method not in ('analytic', 'montecarlo') or not 2 <= n_points <= 200 or not 1000 <= n_samples <= 1000000:
+        return jsonify({"data": {}, "code": 0, "message": "Invalid frontier parameters"}), 400
+
+    try:
+        result = services.get_portfolio_efficient_frontier(portfolio_id, n_points, method, n_samples)
+
+        if result is None:
+            return jsonify({
+                "data": {},
+                "code": 0,
+                "message": "Insufficient data to build frontier (Need at least 2 assets and 30 days of history)"
+            }), 400
+
+        return jsonify({
+            "data": result,
+            "code": 1,
+            "message": "efficient frontier successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/backtest', methods=['POST'])
+@admission_limited('analytics')
+def backtestPortfolio():
+    """
+    定期再平衡回測 (可一次評估多組目標權重)
+    ---
+    tags:
+      - Analysis & Simulation
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - tickers
+            - weights
+          properties:
+            tickers:
+              type: array
+              items:
+                type: string
+              example: ["AAPL", "MSFT", "NVDA"]
+            weights:
+              type: array
+              description: 一組權重 [0.5, 0.3, 0.2]，或多組權重 [[...], [...]] (最多 5,000 組)，每組會正規化成總和 1
+              example: [[0.5, 0.3, 0.2], [0.34, 0.33, 0.33]]
+            rebalance:
+              type: string
+              enum: [none, D, W, M, Q, Y]
+              default: M
+            cost:
+              type: number
+              description: 交易成本 (成交金額比例)
+              example: 0.001
+            start:
+              type: string
+              description: (選填) 起始日期 YYYY-MM-DD
+              example: "2021-01-01"
+            initialValue:
+              type: number
+              default: 10000
+            includeHistory:
+              type: boolean
+              description: 是否回傳每日價值序列 (最多 20 組權重)
+    responses:
+      200:
+        description: 成功回傳每組權重的回測績效
+      400:
+        description: 參數錯誤或資料不足
+    """
+    data = request.get_json(silent=True) or {}
+    tickers = data.get('tickers')
+    weights = data.get('weights')
+    rebalance = data.get('rebalance', 'M')
+    include_history = bool(data.get('includeHistory', False))
+
+    try:
+        if not isinstance(tickers, list) or not tickers or not all(isinstance(t, str) for t in tickers):
+            raise ValueError("tickers must be a non-empty list of ticker symbols")
+        if len(set(tickers)) != len(tickers):
+            raise ValueError("tickers must not contain duplicates")
+        if not isinstance(weights, list) or not weights:
+            raise ValueError("weights must be a list")
+        nested = isinstance(weights[0], list)
+        if any(isinstance(w, list) != nested for w in weights):
+            raise ValueError("weights must be a list of numbers or a list of weight lists")
+        weight_sets = weights if nested else [weights]
+        if len(weight_sets) > 5000:
+            raise ValueError("at most 5000 weight sets per request")
+        if any(len(w) != len(tickers) for w in weight_sets):
+            raise ValueError("each weight set must have one weight per ticker")
+        weight_sets = [[_finite_number(x, "weights") for x in w] for w in weight_sets]
+        if any(x < 0 for w in weight_sets for x in w) or any(sum(w) <= 0 for w in weight_sets):
+            raise ValueError("weights must be non-negative with a positive sum")
+        if rebalance not in services.BACKTEST_FREQUENCIES:
+            raise ValueError(f"rebalance must be one of {', '.join(services.BACKTEST_FREQUENCIES)}")
+        cost = _finite_number(data.get('cost', 0.0), "cost")
+        if not 0 <= cost < 0.1:
+            raise ValueError("cost must be between 0 and 0.1")
+        initial_value = _finite_number(data.get('initialValue', 10000), "initialValue")
+        if initial_value <= 0:
+            raise ValueError("initialValue must be positive")
+        start_date = data.get('start')
+        start_date = date.fromisoformat(start_date).isoformat() if start_date else None
+        if include_history and len(weight_sets) > 20:
+            raise ValueError("includeHistory supports at most 20 weight sets")
+    except (TypeError, ValueError) as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        result = services.backtest_target_weights(
+            tickers, weight_sets, start_date, rebalance, cost, initial_value, include_history
+        )
+
+        if result is None:
+            return jsonify({
+                "data": {},
+                "code": 0,
+                "message": "Insufficient price history for the requested tickers"
+            }), 400
+
+        return jsonify({
+            "data": result,
+            "code": 1,
+            "message": "backtest successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/risk/<int:portfolio_id>', methods=['GET'])
+@admission_limited('simulation')
+def getPortfolioRisk(portfolio_id):
+    """
+    計算單一投資組合的風險值 (VaR / CVaR)
+    ---
+    tags:
+      - Analysis & Simulation
+    parameters:
+      - name: portfolio_id
+        in: path
+        type: integer
+        required: true
+      - name: paths
+        in: query
+        type: integer
+        required: false
+        default: 10000
+        description: 蒙地卡羅路徑數 (最多 100,000)
+    responses:
+      200:
+        description: 成功回傳 1 日 / 10 日在多個信賴水準下的 VaR 與 CVaR (歷史模擬與蒙地卡羅)
+      400:
+        description: 資料不足
+    """
+    try:
+        n_paths = int(request.args.get('paths', 10000))
+    except ValueError:
+        return jsonify({"data": {}, "code": 0, "message": "paths must be an integer"}), 400
+    if not 1000 <= n_paths <= 100000:
+        return jsonify({"data": {}, "code": 0, "message": "paths must be between 1000 and 100000"}), 400
+
+    try:
+        risk = services.get_portfolios_risk([portfolio_id], n_paths=n_paths).get(portfolio_id)
+
+        if risk is None:
+            return jsonify({
+                "data": {},
+                "code": 0,
+                "message": "Insufficient data to compute risk (Need at least 30 days of history)"
+            }), 400
+
+        return jsonify({
+            "data": risk,
+            "code": 1,
+            "message": "portfolio risk successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/risk', methods=['POST'])
+@admission_limited('simulation')
+def getPortfoliosRiskBatch():
+    """
+    批次計算多個投資組合的風險值 (每晚的風險檢查)
+    ---
+    tags:
+      - Analysis & Simulation
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            portfolioIds:
+              type: array
+              items:
+                type: integer
+              description: (選填) 要計算的組合 ID，省略時計算所有組合
+              example: [1, 2, 3]
+            paths:
+              type: integer
+              example: 10000
+    responses:
+      200:
+        description: "成功回傳 { portfolioId: risk }，資料不足的組合為 null"
+    """
+    data = request.get_json(silent=True) or {}
+    portfolio_ids = data.get('portfolioIds')
+    if portfolio_ids is not None and (
+        not isinstance(portfolio_ids, list) or not all(
+            isinstance(pid, int) and not isinstance(pid, bool) for pid in portfolio_ids
+        )
+    ):
+        return jsonify({"data": {}, "code": 0, "message": "portfolioIds must be a list of integers"}), 400
+
+    n_paths = data.get('paths', 10000)
+    if not isinstance(n_paths, int) or not 1000 <= n_paths <= 100000:
+        return jsonify({"data": {}, "code": 0, "message": "paths must be between 1000 and 100000"}), 400
+
+    try:
+        risks = services.get_portfolios_risk(portfolio_ids, n_paths=n_paths)
+        return jsonify({
+            "data": {str(pid): risk for pid, risk in risks.items()},
+            "code": 1,
+            "message": "portfolio risk successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+# -------------------------------------------------------------------
+# API: What-if (以請求中的持股試算，不讀寫 PortfolioItems)
+# -------------------------------------------------------------------
+
+MAX_WHATIF_ASSETS = 200
+
+def _parse_holdings():
+    """
+    解析 What-if API 的 request body，回傳 {ticker: quantity (float)}
+    接受 { "assets": { "AAPL": 10 } } 或 { "assets": [ {"ticker": "AAPL", "quantity": 10} ] }
+    格式錯誤時拋出 ValueError。
+    """
+    data = request.get_json(silent=True) or {}
+    raw_assets = data.get('assets')
+    if isinstance(raw_assets, dict):
+        pairs = list(raw_assets.items())
+    elif isinstance(raw_assets, list):
+        try:
+            pairs = [(item['ticker'], item['quantity']) for item in raw_assets]
+        except (TypeError, KeyError):
+            raise ValueError("each asset must have 'ticker' and 'quantity'")
+    else:
+        raise ValueError("Invalid format. Expected { 'assets': { 'TICKER': quantity } }")
+
+    if not pairs:
+        raise ValueError("assets must not be empty")
+    if len(pairs) > MAX_WHATIF_ASSETS:
+        raise ValueError(f"at most {MAX_WHATIF_ASSETS} assets")
+
+    holdings = {}
+    for ticker, quantity in pairs:
+        if not isinstance(ticker, str) or not ticker:
+            raise ValueError("ticker must be a non-empty string")
+        quantity = _finite_number(quantity, f"quantity of {ticker}")
+        if quantity < 0:
+            raise ValueError(f"quantity of {ticker} must not be negative")
+        holdings[ticker] = holdings.get(ticker, 0.0) + quantity
+    return holdings
+
+@api_v1.route('/portfolio/whatif/performance', methods=['POST'])
+@admission_limited('analytics')
+def whatIfPerformance():
+    """
+    What-if: 以請求中的持股計算歷史績效走勢 (不修改組合)
+    ---
+    tags:
+      - What-if
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - assets
+          properties:
+            assets:
+              type: object
+              description: "持股 { 'TICKER': quantity } (也接受 [ {ticker, quantity} ] 格式)"
+              example: {"AAPL": 10, "NVDA": 5}
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: (選填) 起始日期 YYYY-MM-DD
+      - name: points
+        in: query
+        type: integer
+        required: false
+        description: (選填) 需要的資料點數，會自動改用能滿足點數的最粗解析度 (日 / 週 / 月)
+    responses:
+      200:
+        description: 成功取得績效數據
+      400:
+        description: 參數格式錯誤
+    """
+    try:
+        holdings = _parse_holdings()
+        start_date, points = _parse_history_args()
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        result = services.get_holdings_performance_history(holdings, start_date, points)
+        return jsonify({
+            "data": result,
+            "code": 1,
+            "message": "what-if history successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/whatif/metrics', methods=['POST'])
+@admission_limited('analytics')
+def whatIfMetrics():
+    """
+    What-if: 以請求中的持股計算過去一年的關鍵指標 (報酬、波動、夏普、最大回撤)
+    ---
+    tags:
+      - What-if
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - assets
+          properties:
+            assets:
+              type: object
+              description: "持股 { 'TICKER': quantity } (也接受 [ {ticker, quantity} ] 格式)"
+              example: {"AAPL": 10, "NVDA": 5}
+    responses:
+      200:
+        description: 成功回傳指標
+      400:
+        description: 參數錯誤或資料不足
+    """
+    try:
+        holdings = _parse_holdings()
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        metrics = services.get_holdings_metrics(holdings)
+        if metrics is None:
+            return jsonify({
+                "data": {},
+                "code": 0,
+                "message": "Insufficient price history for the requested assets"
+            }), 400
+
+        return jsonify({
+            "data": metrics,
+            "code": 1,
+            "message": "what-if metrics successfully computed"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/whatif/simulation', methods=['POST'])
+@admission_limited('simulation')
+def whatIfSimulation():
+    """
+    What-if: 以請求中的持股執行蒙地卡羅模擬
+    ---
+    tags:
+      - What-if
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - assets
+          properties:
+            assets:
+              type: object
+              description: "持股 { 'TICKER': quantity } (也接受 [ {ticker, quantity} ] 格式)"
+              example: {"AAPL": 10, "NVDA": 5}
+      - name: mode
+        in: query
+        type: string
+        required: false
+        description: 其餘 query 參數 (mode / paths / block / sampler / step / stream / target) 與 /portfolio/simulation/{portfolio_id} 相同
+    responses:
+      200:
+        description: 成功回傳模擬數據 (百分位數)
+      400:
+        description: 參數錯誤或沒有歷史資料
+    """
+    try:
+        holdings = _parse_holdings()
+        options = _parse_simulation_args()
+    except ValueError as e:
+        return jsonify({"data": [], "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        result = services.simulate_holdings_growth(holdings, **options)
+        if result is None:
+            return jsonify({
+                "data": [],
+                "code": 0,
+                "message": "Fail to stimulate (No history for the requested assets)"
+            }), 400
+
+        return jsonify({
+            "data": _format_simulation(result, options),
+            "code": 1,
+            "message": "successfully stimulate"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": [], "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/portfolio/whatif/recommendation', methods=['POST'])
+@admission_limited('recommendation')
+def whatIfRecommendation():
+    """
+    What-if: 針對請求中的持股提供個股買賣建議
+    ---
+    tags:
+      - What-if
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - assets
+          properties:
+            assets:
+              type: object
+              description: "持股 { 'TICKER': quantity } (也接受 [ {ticker, quantity} ] 格式)"
+              example: {"AAPL": 10, "NVDA": 5}
+    responses:
+      200:
+        description: 成功回傳建議
+      400:
+        description: 參數錯誤或資料不足
+    """
+    try:
+        holdings = _parse_holdings()
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": f"Invalid parameter: {e}"}), 400
+
+    try:
+        recommendation = services.generate_holdings_recommendation(holdings)
+        if recommendation is None:
+            return jsonify({
+                "data": {},
+                "code": 0,
+                "message": "Insufficient data to generate recommendation (Need at least 30 days of history)"
+            }), 400
+
+        return jsonify({
+            "data": recommendation,
+            "code": 1,
+            "message": "Recommendation generated successfully"
+        }), 200
+
+    except Exception as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
 # -------------------------------------------------------------------
 # API: Watchlist
 # -------------------------------------------------------------------
@@ -791,4 +1675,220 @@ def deleteWatchListItem(user_id, ticker):
             
     except Exception as e:
         get_db().rollback()
-        return jsonify({"code": 0, "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"code": 0, "message": str(e)}), 500
+
+MAX_BULK_TICKERS = 1000
+
+def _parse_ticker_list(data, key):
+    """
+    解析批次 API 的股票代號列表 (去除空白、轉成大寫並去除重複，保留順序)
+    格式錯誤時拋出 ValueError。
+    """
+    raw = data.get(key) or []
+    if not isinstance(raw, list) or not all(isinstance(t, str) for t in raw):
+        raise ValueError(f"{key} must be a list of tickers")
+    tickers = list(dict.fromkeys(t.strip().upper() for t in raw if t.strip()))
+    if len(tickers) > MAX_BULK_TICKERS:
+        raise ValueError(f"at most {MAX_BULK_TICKERS} tickers per request")
+    if any(len(t) > 20 for t in tickers):
+        raise ValueError("ticker must be at most 20 characters")
+    return tickers
+
+def _bulk_watchlist_response(user_id, **changes):
+    try:
+        result = services.bulk_update_watchlist(user_id, **changes)
+        if result is None:
+            get_db().rollback()
+            return jsonify({"data": {}, "code": 0, "message": "User not found"}), 404
+
+        # 提交交易 (新增與移除一起生效)
+        get_db().commit()
+        return jsonify({
+            "data": result,
+            "code": 1,
+            "message": "watchlist successfully updated"
+        }), 200
+
+    except Exception as e:
+        get_db().rollback()
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 500
+
+@api_v1.route('/watchlists/<int:user_id>/bulk', methods=['POST'])
+def bulkUpdateWatchList(user_id):
+    """
+    批次新增 / 移除關注股票 (同一個 transaction)
+    ---
+    tags:
+      - Watchlist
+    parameters:
+      - name: user_id
+        in: path
+        type: integer
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            add:
+              type: array
+              items:
+                type: string
+              example: ["AAPL", "2330.TW"]
+            remove:
+              type: array
+              items:
+                type: string
+              example: ["TSLA"]
+    responses:
+      200:
+        description: 更新成功，回傳 add 中每檔股票的行情與實際新增 / 移除的代號
+      400:
+        description: 參數格式錯誤
+      404:
+        description: 找不到使用者
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"data": {}, "code": 0, "message": "Invalid JSON body"}), 400
+    try:
+        add = _parse_ticker_list(data, 'add')
+        remove = _parse_ticker_list(data, 'remove')
+        if not add and not remove:
+            raise ValueError("add or remove must not be empty")
+        if set(add) & set(remove):
+            raise ValueError("a ticker cannot be both added and removed")
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 400
+
+    return _bulk_watchlist_response(user_id, add=add, remove=remove)
+
+@api_v1.route('/watchlists/<int:user_id>', methods=['PUT'])
+def replaceWatchList(user_id):
+    """
+    以新的列表取代整份關注清單 (例如匯入清單；同一個 transaction)
+    ---
+    tags:
+      - Watchlist
+    parameters:
+      - name: user_id
+        in: path
+        type: integer
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - tickers
+          properties:
+            tickers:
+              type: array
+              items:
+                type: string
+              example: ["AAPL", "MSFT", "2330.TW"]
+    responses:
+      200:
+        description: 取代成功，回傳新清單每檔股票的行情與實際新增 / 移除的代號
+      400:
+        description: 參數格式錯誤
+      404:
+        description: 找不到使用者
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'tickers' not in data:
+        return jsonify({"data": {}, "code": 0, "message": "Missing tickers"}), 400
+    try:
+        tickers = _parse_ticker_list(data, 'tickers')
+    except ValueError as e:
+        return jsonify({"data": {}, "code": 0, "message": str(e)}), 400
+
+    return _bulk_watchlist_response(user_id, replace=tickers)
+
+@api_v1.route('/quotes/stream', methods=['GET'])
+def streamQuotes():
+    """
+    即時報價串流 (Server-Sent Events)
+    先送出 event: snapshot (所有股票的目前報價)，之後每個 tick 只送出有變動的股票 (event: quotes)。
+    兩種事件的 data 都是 {ticker: {ticker, price, change}}。
+    ---
+    tags:
+      - Watchlist
+    produces:
+      - text/event-stream
+    parameters:
+      - name: tickers
+        in: query
+        type: string
+        required: true
+        description: 以逗號分隔的股票代號 (最多 200 檔)
+        example: "AAPL,MSFT,2330.TW"
+    responses:
+      200:
+        description: text/event-stream
+      400:
+        description: 參數格式錯誤
+      503:
+        description: 此 worker 的串流連線已滿 (見 Retry-After)
+    """
+    raw = request.args.get('tickers', '')
+    tickers = list(dict.fromkeys(t.strip() for t in raw.split(',') if t.strip()))
+    if not tickers or len(tickers) > quote_stream.MAX_STREAM_TICKERS:
+        return jsonify({
+            "data": {},
+            "code": 0,
+            "message": f"tickers must contain 1 to {quote_stream.MAX_STREAM_TICKERS} symbols"
+        }), 400
+
+    if not quote_stream.try_acquire_client():
+        response = jsonify({"data": {}, "code": 0, "message": "Too many quote streams, please retry later"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    try:
+        # 只有還沒被任何連線關注的股票需要查詢資料庫 (一次批次查詢)
+        hub = quote_stream.get_hub()
+        untracked = hub.untracked(tickers)
+        quotes = {q['ticker']: q for q in services.get_stock_market_data_batch(untracked)}
+        subscriber, snapshot = hub.subscribe(tickers, quotes)
+    except Exception as e:
+        quote_stream.release_client()
+        return jsonify({"data": {}, "code": 0, "message": f"An unexpected error occurred: {e}"}), 500
+
+    # 不使用 stream_with_context: 串流期間不保留請求的資料庫連線
+    response = Response(
+        quote_stream.stream_events(subscriber, snapshot),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(lambda: quote_stream.close_stream(subscriber))
+    return response
+
+# ------------------------------------------------------------------
+# API: System (此 worker 行程的負載統計)
+# ------------------------------------------------------------------
+@api_v1.route('/system/stats', methods=['GET'])
+def getSystemStats():
+    """
+    取得准入控制與回應快取的統計 (僅限處理此請求的 worker 行程)
+    ---
+    tags:
+      - System
+    responses:
+      200:
+        description: admission 為每組分析 API 的執行中 / 排隊 / 拒絕次數與等待時間；admissionWorker 為所有分析 API 共用的「執行中 + 排隊中」總上限；responseCache 為快取命中統計；coalesce 為合併的請求數；warmup 為最近一次預先計算的進度；quoteStream 為即時報價串流的連線數與分送統計
+    """
+    return jsonify({
+        "data": {
+            "admission": admission.stats(),
+            "admissionWorker": admission.worker_stats(),
+            "responseCache": get_cache().stats(),
+            "coalesce": coalesce.stats(),
+            "warmup": warmup.read_status(),
+            "quoteStream": quote_stream.stats()
+        },
+        "code": 1,
+        "message": "stats successfully retrieved"
+    }), 200
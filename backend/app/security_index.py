@@ -0,0 +1,296 @@
+import base64
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from flask import after_this_request, has_request_context
+
+# ---------------------------------------------------------
+# 股票搜尋索引 (Securities 的行程內索引)
+# ---------------------------------------------------------
+# 前端原本一次下載整張 Securities 再自行過濾；股票數量到數萬檔時每次載入頁面都很浪費。
+# 每個 worker 在記憶體中保留一份排序後的索引:
+#   - 股票代號 (小寫) 的排序列表: 前綴搜尋以二分搜尋找到起點，/assets 的分頁也直接走這個列表
+#   - 名稱中每個單字 (小寫) 的排序列表: 名稱單字前綴搜尋
+#   - 所有「代號\t名稱」串成一個字串: 子字串搜尋以 str.find (C 迴圈) 逐一找出位置
+# 排名 (數字越小越前面)，同一級再依代號長度、代號排序:
+#   0 代號完全相同  1 代號前綴  2 名稱單字前綴  3 代號子字串  4 名稱子字串
+#
+# 更新: 每隔 CHECK_INTERVAL 秒查一次 Securities 的 (COUNT(*), MAX(updated_at))，
+# 有變化時只讀取 updated_at 之後新增 / 修改的列 (idx_updated_at)；
+# 筆數對不上 (有列被刪除) 時才整份重新載入。
+#
+# 同一份索引也是寫入路徑的「已知股票集合」(services._ensure_securities):
+# 持股 / 關注清單的代號都已知時不必查詢 Securities。本行程自動新增的股票在交易提交後
+# 立即加入 (remember_after_commit)；其他 worker 新增的股票由上面的版本檢查讀到。
+
+# worker 檢查 Securities 是否改變的最短間隔 (秒)
+CHECK_INTERVAL = 5.0
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# 一次變動超過此筆數時整份重新排序
+BULK_THRESHOLD = 256
+
+TIER_EXACT, TIER_TICKER_PREFIX, TIER_NAME_PREFIX, TIER_TICKER_SUBSTRING, TIER_NAME_SUBSTRING = range(5)
+
+
+def _normalize(text):
+    """小寫並把連續空白 (含 tab / 換行) 合併成一個空白"""
+    return ' '.join((text or '').lower().split())
+
+
+def encode_cursor(key):
+    """分頁游標: 最後一筆的排序 key，以 base64 包裝 (對前端而言是不透明字串)"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分頁游標，格式錯誤時拋出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+class SecurityIndex:
+    """Securities 的搜尋索引 (thread-safe)"""
+
+    def __init__(self, rows=()):
+        self._lock = threading.RLock()
+        self._entries = {}   # ticker -> (name, exchange)
+        self._folded = set() # 小寫代號 (資料庫的代號比對不分大小寫，已知集合也一樣)
+        self._tickers = []   # 排序後的 (小寫代號, 代號)
+        self._words = []     # 排序後的 (名稱單字, 代號)
+        self._blob = None    # 子字串搜尋用的「代號\t名稱\n...」，有變動時重建
+        self._starts = []    # _blob 中每一列的起始位置
+        self._blob_tickers = []
+        self.upsert(rows)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ticker):
+        return ticker.lower() in self._folded
+
+    def upsert(self, rows):
+        """新增或更新股票 rows: [(ticker, name, exchange), ...]"""
+        rows = list(rows)
+        with self._lock:
+            if len(rows) > BULK_THRESHOLD:
+                # 大量變動 (例如第一次載入) 直接重新排序，避免逐筆 insort 的 O(n^2)
+                self._entries.update((ticker, (name, exchange)) for ticker, name, exchange in rows)
+                self._folded.update(ticker.lower() for ticker, _, _ in rows)
+                self._tickers = sorted((ticker.lower(), ticker) for ticker in self._entries)
+                self._words = sorted(
+                    (word, ticker)
+                    for ticker, (name, _) in self._entries.items()
+                    for word in set(_normalize(name).split())
+                )
+                self._blob = None
+                return
+
+            for ticker, name, exchange in rows:
+                old = self._entries.get(ticker)
+                if old is not None:
+                    if old == (name, exchange):
+                        continue
+                    for word in set(_normalize(old[0]).split()):
+                        i = bisect_left(self._words, (word, ticker))
+                        if i < len(self._words) and self._words[i] == (word, ticker):
+                            del self._words[i]
+                else:
+                    insort(self._tickers, (ticker.lower(), ticker))
+                    self._folded.add(ticker.lower())
+                self._entries[ticker] = (name, exchange)
+                for word in set(_normalize(name).split()):
+                    insort(self._words, (word, ticker))
+                self._blob = None
+
+    def _item(self, ticker):
+        name, exchange = self._entries[ticker]
+        return {"ticker": ticker, "name": name, "exchange": exchange}
+
+    def _build_blob(self):
+        parts, starts, tickers = [], [], []
+        offset = 0
+        for key, ticker in self._tickers:
+            line = f"{key}\t{_normalize(self._entries[ticker][0])}"
+            parts.append(line)
+            starts.append(offset)
+            tickers.append(ticker)
+            offset += len(line) + 1
+        self._blob = '\n'.join(parts)
+        self._starts = starts
+        self._blob_tickers = tickers
+
+    def page(self, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        依代號排序的分頁列表，回傳 (代號列表, 下一頁游標或 None)。
+        cursor: 上一頁回傳的游標 (上一頁最後一檔的代號)
+        """
+        with self._lock:
+            start = 0
+            if cursor is not None:
+                after = decode_cursor(cursor)
+                if not isinstance(after, str):
+                    raise ValueError("Invalid cursor")
+                start = bisect_right(self._tickers, (after.lower(), after))
+            items = [ticker for _, ticker in self._tickers[start:start + limit]]
+            has_more = start + limit < len(self._tickers)
+        return items, (encode_cursor(items[-1]) if has_more and items else None)
+
+    def _ranked(self, q):
+        """回傳 {ticker: 排名}，同一檔股票取最好的排名"""
+        ranks = {}
+
+        def rank(ticker, tier):
+            if tier < ranks.get(ticker, TIER_NAME_SUBSTRING + 1):
+                ranks[ticker] = tier
+
+        # 代號前綴 (含完全相同)
+        i = bisect_left(self._tickers, (q,))
+        while i < len(self._tickers) and self._tickers[i][0].startswith(q):
+            key, ticker = self._tickers[i]
+            rank(ticker, TIER_EXACT if key == q else TIER_TICKER_PREFIX)
+            i += 1
+
+        # 名稱單字前綴 (查詢字串有空白時以第一個單字定位，再比對完整名稱)
+        first_word = q.split(' ', 1)[0]
+        i = bisect_left(self._words, (first_word,))
+        while i < len(self._words) and self._words[i][0].startswith(first_word):
+            ticker = self._words[i][1]
+            if first_word == q or (' ' + _normalize(self._entries[ticker][0])).find(' ' + q) >= 0:
+                rank(ticker, TIER_NAME_PREFIX)
+            i += 1
+
+        # 子字串
+        if self._blob is None:
+            self._build_blob()
+        pos = self._blob.find(q)
+        while pos >= 0:
+            line = bisect_right(self._starts, pos) - 1
+            ticker = self._blob_tickers[line]
+            in_ticker = pos - self._starts[line] < len(ticker)
+            rank(ticker, TIER_TICKER_SUBSTRING if in_ticker else TIER_NAME_SUBSTRING)
+            pos = self._blob.find(q, pos + 1)
+        return ranks
+
+    def search(self, query, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        不分大小寫的前綴 / 子字串搜尋 (代號與名稱)，依排名排序。
+        回傳 ([{ticker, name, exchange}, ...], 下一頁游標或 None)
+        """
+        q = _normalize(query)
+        if not q:
+            return [], None
+
+        with self._lock:
+            ranks = self._ranked(q)
+            keys = sorted((tier, len(ticker), ticker) for ticker, tier in ranks.items())
+            start = 0
+            if cursor is not None:
+                after = decode_cursor(cursor)
+                if not (isinstance(after, list) and len(after) == 3):
+                    raise ValueError("Invalid cursor")
+                start = bisect_right(keys, tuple(after))
+            selected = keys[start:start + limit]
+            items = [self._item(ticker) for _, _, ticker in selected]
+            has_more = start + limit < len(keys)
+        return items, (encode_cursor(list(selected[-1])) if has_more and selected else None)
+
+
+_index = None
+_version = None      # (COUNT(*), MAX(updated_at))
+_last_check = 0.0
+_refresh_lock = threading.Lock()
+
+
+def _load_version(cursor):
+    cursor.execute("SELECT COUNT(*) AS n, MAX(updated_at) AS updated FROM Securities")
+    row = cursor.fetchone()
+    return row['n'], row['updated']
+
+
+def _full_load(connection):
+    with connection.cursor() as cursor:
+        version = _load_version(cursor)
+        cursor.execute("SELECT ticker_symbol, name, exchange FROM Securities")
+        rows = [(r['ticker_symbol'], r['name'], r['exchange']) for r in cursor.fetchall()]
+    return SecurityIndex(rows), version
+
+
+def _refresh(connection):
+    """檢查 Securities 是否改變，只讀取 updated_at 之後變動的列"""
+    global _index, _version
+    with connection.cursor() as cursor:
+        version = _load_version(cursor)
+        if version == _version:
+            return
+        changed_since = _version[1]
+        if changed_since is not None and version[0] >= _version[0]:
+            # 同一秒內的修改也要讀到，因此用 >= (重複套用同一列沒有影響)
+            cursor.execute(
+                "SELECT ticker_symbol, name, exchange FROM Securities WHERE updated_at >= %s",
+                (changed_since,)
+            )
+            _index.upsert((r['ticker_symbol'], r['name'], r['exchange']) for r in cursor.fetchall())
+            if len(_index) == version[0]:
+                _version = version
+                return
+
+    # 有列被刪除 (或第一次有資料): 整份重新載入
+    _index, _version = _full_load(connection)
+
+
+def load(config):
+    """
+    啟動時預先載入索引 (gunicorn master 在 fork worker 之前呼叫，worker 直接繼承)
+    config: app.config (或任何同名 key 的 dict)
+    """
+    global _index, _version, _last_check
+    from app.db import connect
+
+    connection = connect(config)
+    try:
+        _index, _version = _full_load(connection)
+        _last_check = time.monotonic()
+    finally:
+        connection.close()
+    return _index
+
+
+def get_index(connection):
+    """
+    回傳目前的搜尋索引 (第一次呼叫時載入；之後最多每 CHECK_INTERVAL 秒檢查一次是否有變動)。
+    connection: 資料庫連線 (請求中傳入 get_db())
+    """
+    global _index, _version, _last_check
+    now = time.monotonic()
+    if _index is not None and now - _last_check < CHECK_INTERVAL:
+        return _index
+
+    with _refresh_lock:
+        if _index is None:
+            _index, _version = _full_load(connection)
+        elif now - _last_check >= CHECK_INTERVAL:
+            _refresh(connection)
+        _last_check = now
+    return _index
+
+
+def remember_after_commit(rows):
+    """
+    本次請求實際新增到 Securities 的股票 rows: [(ticker, name, exchange), ...]，
+    在請求成功結束 (已 commit) 後加入索引；請求失敗 (rollback) 時不加入，
+    避免已知集合中出現資料庫裡不存在的代號。不在請求中時不處理 (交給版本檢查)。
+    """
+    index = _index
+    if not rows or index is None or not has_request_context():
+        return
+
+    @after_this_request
+    def _remember(response):
+        if response.status_code < 400:
+            index.upsert(rows)
+        return response
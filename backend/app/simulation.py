@@ -0,0 +1,360 @@
+import warnings
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+from app.analytics import TRADING_DAYS, RISK_FREE_RATE
+
+# ---------------------------------------------------------
+# 蒙地卡羅路徑產生引擎 (純 NumPy，不碰資料庫)
+# ---------------------------------------------------------
+# 所有模式都先產生「累積對數報酬」矩陣 (n_paths x n_steps)，最後才乘上起始價值，
+# 每一步長 step_days 個交易日 (252 = 每年一步)。
+#   gbm       -> 以常態分佈擬合的 mu / sigma (Geometric Brownian Motion)
+#   bootstrap -> 從歷史日報酬中以區塊 (block) 重抽樣，保留厚尾與短期自相關
+# 亂數來源 (sampler) 可選擇變異數縮減技巧，用較少的路徑達到相同的百分位精度:
+#   pseudo     -> 一般偽亂數
+#   antithetic -> 對偶變數 (Z 與 -Z 成對出現，只適用 gbm)
+#   sobol      -> 加擾 (scrambled) Sobol 低差異序列 (quasi-Monte Carlo)
+# 路徑分成 replicates 組互相獨立的重複樣本 (每組各自加擾 / 各自成對)，
+# 以組間百分位的離散程度估計每條百分位帶的標準誤。
+
+SIMULATION_MODES = ('gbm', 'bootstrap')
+SAMPLERS = ('pseudo', 'antithetic', 'sobol')
+DEFAULT_BLOCK_DAYS = 21
+DEFAULT_REPLICATES = 8
+
+
+def replicate_size(n_paths, sampler='pseudo', replicates=1):
+    """
+    每組重複樣本的路徑數: 對偶變數需要偶數，Sobol 需要 2 的次方 (維持序列的均勻性)，
+    因此實際路徑數 replicates x size 可能略多於 n_paths。
+    """
+    size = max(1, -(-n_paths // replicates))
+    if sampler == 'antithetic':
+        size += size % 2
+    elif sampler == 'sobol':
+        size = 1 << (size - 1).bit_length()
+    return size
+
+
+def uniform_draws(n_paths, n_dims, sampler='pseudo', replicates=1, rng=None):
+    """
+    (replicates x size, n_dims) 的 [0, 1) 均勻亂數，依重複樣本分組排列。
+    sobol 模式每組使用獨立加擾的 Sobol 序列 (randomized QMC)。
+    """
+    rng = rng or np.random.default_rng()
+    size = replicate_size(n_paths, sampler, replicates)
+    if sampler == 'sobol':
+        m = size.bit_length() - 1
+        return np.vstack([
+            qmc.Sobol(n_dims, scramble=True, seed=rng).random_base2(m) for _ in range(replicates)
+        ])
+    if sampler == 'antithetic':
+        half = rng.random((replicates, size // 2, n_dims))
+        return np.concatenate([half, 1 - half], axis=1).reshape(-1, n_dims)
+    return rng.random((replicates * size, n_dims))
+
+
+def normal_draws(n_paths, n_dims, sampler='pseudo', replicates=1, rng=None):
+    """(replicates x size, n_dims) 的標準常態亂數，依重複樣本分組排列"""
+    rng = rng or np.random.default_rng()
+    if sampler == 'sobol':
+        u = uniform_draws(n_paths, n_dims, sampler, replicates, rng)
+        # 加擾後的 Sobol 點極少數會剛好落在 0，避免 ndtri 回傳 -inf
+        return ndtri(np.clip(u, np.finfo(float).tiny, 1 - np.finfo(float).epsneg))
+
+    size = replicate_size(n_paths, sampler, replicates)
+    if sampler == 'antithetic':
+        half = rng.standard_normal((replicates, size // 2, n_dims))
+        return np.concatenate([half, -half], axis=1).reshape(-1, n_dims)
+    return rng.standard_normal((replicates * size, n_dims))
+
+
+def brownian_bridge(z):
+    """
+    把標準常態亂數 (路徑數 x n) 以 Brownian bridge 順序轉成 n 個獨立的標準常態增量:
+    z 的第 0 維決定終點 W(n)，之後依序決定各區間的中點。
+    搭配 Sobol 時，決定路徑大方向的維度落在低差異性最好的前幾維，QMC 效果明顯較佳。
+    """
+    n_paths, n = z.shape
+    w = np.zeros((n_paths, n + 1))
+    w[:, n] = np.sqrt(n) * z[:, 0]
+    k = 1
+    intervals = [(0, n)]
+    while intervals:
+        next_intervals = []
+        for left, right in intervals:
+            if right - left < 2:
+                continue
+            mid = (left + right) // 2
+            span = right - left
+            w[:, mid] = ((right - mid) * w[:, left] + (mid - left) * w[:, right]) / span \
+                + np.sqrt((mid - left) * (right - mid) / span) * z[:, k]
+            k += 1
+            next_intervals += [(left, mid), (mid, right)]
+        intervals = next_intervals
+    return np.diff(w, axis=1)
+
+
+def gbm_log_paths(mu, sigma, n_steps, n_paths, step_days=TRADING_DAYS, rng=None,
+                  sampler='pseudo', replicates=1):
+    """
+    GBM 累積對數報酬: 每一步 (mu - sigma²/2)·dt + sigma·√dt·Z
+    mu, sigma: 日報酬的平均 / 標準差；一次抽出 (路徑數, n_steps) 個常態亂數後 cumsum。
+    """
+    z = normal_draws(n_paths, n_steps, sampler, replicates, rng)
+    if sampler == 'sobol':
+        z = brownian_bridge(z)
+    increments = (mu - 0.5 * sigma ** 2) * step_days + sigma * np.sqrt(step_days) * z
+    return np.cumsum(increments, axis=1)
+
+
+def bootstrap_log_paths(daily_returns, n_steps, n_paths, step_days=TRADING_DAYS,
+                        block_days=DEFAULT_BLOCK_DAYS, weights=None, rng=None,
+                        sampler='pseudo', replicates=1):
+    """
+    區塊重抽樣 (circular block bootstrap) 累積對數報酬。
+    daily_returns: (T,) 組合日報酬，或 (T x N) 各資產日報酬 (搭配 weights 以目前權重組合)。
+                   同一天的資產報酬向量一起被抽出，因此保留了資產間的當日相關性。
+    每條路徑由 ceil(總天數 / block_days) 個區塊接成，區塊起點以 rng.integers 分批抽出。
+    任一天的累積報酬 = 前面完整區塊的總和 + 目前區塊的部分和，兩者都由前綴和 (cumsum)
+    以 fancy indexing 查表取得，不需要展開成 (n_paths x 總天數) 的日報酬矩陣。
+    sampler 只支援 pseudo 與 sobol (Sobol 點以 floor(u x T) 對應到區塊起點，做分層抽樣)。
+    """
+    if sampler == 'antithetic':
+        raise ValueError("antithetic sampling is only supported in gbm mode")
+    rng = rng or np.random.default_rng()
+    returns = np.asarray(daily_returns, dtype=float)
+    if returns.ndim == 2:
+        returns = returns @ np.asarray(weights, dtype=float)
+    log_returns = np.log1p(returns)
+
+    n_days = len(log_returns)
+    block = max(1, min(block_days, n_days))
+    total_days = n_steps * step_days
+
+    # 環狀延伸，讓靠近尾端的起點也能取滿一個區塊
+    extended = np.concatenate([log_returns, log_returns[:block]])
+    prefix = np.concatenate([[0.0], np.cumsum(extended)])
+    block_sums = prefix[block:block + n_days] - prefix[:n_days]
+
+    n_blocks = -(-total_days // block)
+    # 區塊起點矩陣是 (路徑數 x 區塊數)，block_days 很小時 (例如 1 天 -> 7,560 個區塊) 遠大於輸出的
+    # (路徑數 x 步數)，因此分批抽出起點、逐批轉成累積報酬，每批最多 STREAM_CHUNK_ELEMENTS 個區塊
+    rows = max(1, STREAM_CHUNK_ELEMENTS // n_blocks)
+    if sampler == 'sobol':
+        batches = _sobol_block_starts(n_paths, n_blocks, n_days, replicates, rng, rows)
+    else:
+        size = replicate_size(n_paths, sampler, replicates)
+        total = replicates * size
+        batches = (
+            rng.integers(0, n_days, size=(min(rows, total - offset), n_blocks), dtype=np.int32)
+            for offset in range(0, total, rows)
+        )
+    return np.concatenate([
+        _block_log_paths(starts, block_sums, prefix, block, n_steps, step_days) for starts in batches
+    ])
+
+
+def _sobol_block_starts(n_paths, n_blocks, n_days, replicates, rng, rows):
+    """
+    Sobol 版本的區塊起點，分批產生: 每組重複樣本是一條獨立加擾的序列，依序取出 2 的次方個點，
+    串起來與一次 random_base2 取出的點完全相同 (每組總點數仍是 2 的次方，均勻性不變)。
+    """
+    size = replicate_size(n_paths, 'sobol', replicates)
+    rows = min(size, 1 << (rows.bit_length() - 1))
+    for _ in range(replicates):
+        engine = qmc.Sobol(n_blocks, scramble=True, seed=rng)
+        for _ in range(size // rows):
+            with warnings.catch_warnings():
+                # 中途的累計點數不是 2 的次方時 scipy 會警告；整組取完後才構成完整的平衡序列
+                warnings.simplefilter('ignore', UserWarning)
+                u = engine.random(rows)
+            yield np.minimum((u * n_days).astype(np.int32), n_days - 1)
+
+
+def _block_log_paths(starts, block_sums, prefix, block, n_steps, step_days):
+    """由一批區塊起點 (rows x n_blocks) 計算累積對數報酬 (rows x n_steps)"""
+    n_paths, n_blocks = starts.shape
+
+    # 每一步剛好是整數個區塊 (例如 252 = 12 x 21): 直接把區塊和依步分組加總即可
+    if step_days % block == 0:
+        per_step = block_sums[starts].reshape(n_paths, n_steps, step_days // block).sum(axis=2)
+        return np.cumsum(per_step, axis=1)
+
+    # completed[:, j] = 前 j 個完整區塊的累積對數報酬
+    completed = np.zeros((n_paths, n_blocks + 1))
+    np.cumsum(block_sums[starts], axis=1, out=completed[:, 1:])
+
+    # 每一步結束時落在第 j 個區塊的第 m 天
+    boundaries = np.arange(1, n_steps + 1) * step_days
+    j, m = np.divmod(boundaries, block)
+    current = starts[:, np.minimum(j, n_blocks - 1)]
+    return completed[:, j] + (prefix[current + m] - prefix[current])
+
+
+def simulate_values(initial_value, log_paths):
+    """把累積對數報酬轉成價值路徑 (n_paths x (n_steps + 1))，第 0 欄為起始價值"""
+    values = np.empty((log_paths.shape[0], log_paths.shape[1] + 1))
+    values[:, 0] = initial_value
+    np.exp(log_paths, out=values[:, 1:])
+    values[:, 1:] *= initial_value
+    return values
+
+
+def percentile_bands(values, percentiles, replicates=1):
+    """
+    一次計算所有百分位 (len(percentiles) x n_steps)，並以重複樣本估計標準誤:
+    每組重複樣本各自計算百分位，標準誤 = 組間標準差 / √replicates。
+    np.percentile 傳入整組百分位時只做一次多點 partition (不會完整排序，也不會重複掃描)。
+    replicates < 2 時無法估計，標準誤為 None。
+    """
+    bands = np.percentile(values, percentiles, axis=0)
+    if replicates < 2:
+        return bands, None
+    groups = values.reshape(replicates, -1, values.shape[1])
+    per_group = np.percentile(groups, percentiles, axis=1)
+    return bands, per_group.std(axis=1, ddof=1) / np.sqrt(replicates)
+
+
+def path_statistics(log_paths, step_days=TRADING_DAYS, target_log=None, risk_free_rate=RISK_FREE_RATE):
+    """
+    在產生路徑時一次算出每條路徑的統計量 (全部向量化，不需要逐條路徑迴圈):
+        terminal      -> 期末累積對數報酬
+        max_drawdown  -> 最大回撤 (含起點，以比例表示)
+        annual_return -> 年化複合報酬 (CAGR)
+        volatility    -> 每步對數報酬的年化波動率
+        sharpe_ratio  -> (annual_return - 無風險利率) / volatility
+        reached       -> 是否在任一步觸及目標 (target_log 為目標價值 / 起始價值的對數)
+    回傳 dict，每個值都是 (路徑數,) 陣列；串流模式可逐批計算後 concatenate_statistics 合併。
+    """
+    n_paths, n_steps = log_paths.shape
+    years = n_steps * step_days / TRADING_DAYS
+
+    # 回撤以對數計算: 目前值 - 歷史最高 (起點 0 也算在內)
+    peaks = np.maximum.accumulate(log_paths, axis=1)
+    np.maximum(peaks, 0.0, out=peaks)
+    drawdown_log = (log_paths - peaks).min(axis=1)
+
+    steps = np.diff(log_paths, axis=1, prepend=0.0)
+    volatility = steps.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS / step_days) if n_steps > 1 \
+        else np.zeros(n_paths)
+
+    annual_return = np.expm1(log_paths[:, -1] / years)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0, (annual_return - risk_free_rate) / volatility, 0.0)
+
+    stats = {
+        "terminal": log_paths[:, -1].copy(),
+        "max_drawdown": -np.expm1(drawdown_log),
+        "annual_return": annual_return,
+        "volatility": volatility,
+        "sharpe_ratio": sharpe,
+    }
+    if target_log is not None:
+        stats["reached"] = log_paths.max(axis=1) >= target_log
+    return stats
+
+
+def concatenate_statistics(batches):
+    """合併多批 path_statistics 的結果"""
+    return {key: np.concatenate([batch[key] for batch in batches]) for key in batches[0]}
+
+
+# ---------------------------------------------------------
+# 串流模式: 分批產生路徑 + 可合併的分位數草圖 (quantile sketch)
+# ---------------------------------------------------------
+# 百萬條路徑或每日步長 (30 年 = 7,560 步) 時，完整的 (路徑 x 步數) 矩陣放不進記憶體。
+# 串流模式每次只產生一批路徑，把每一步的數值累加進固定大小的直方圖後就丟掉，
+# 記憶體只和「步數 x 桶數」有關，與路徑數無關。
+
+DEFAULT_RELATIVE_ACCURACY = 0.005
+STREAM_CHUNK_ELEMENTS = 4000000
+
+
+class QuantileSketch:
+    """
+    每一步各一個對數分桶直方圖 (DDSketch 的做法)，保證分位數的相對誤差 <= relative_accuracy。
+    直接對「累積對數報酬」等寬分桶 (寬度 log γ，γ = (1 + a) / (1 - a))，等同於對價值做相對誤差分桶。
+    兩個草圖的計數相加即為合併 (merge)，因此可以分批、跨行程計算後再彙總。
+    """
+
+    def __init__(self, n_steps, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.n_steps = n_steps
+        self.relative_accuracy = relative_accuracy
+        self.bucket_width = np.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.offset = 0
+        self.counts = np.zeros((n_steps, 0), dtype=np.int64)
+        self.count = 0
+
+    def _ensure_range(self, low, high):
+        """擴充桶的範圍，使其涵蓋 [low, high] (絕對桶編號)"""
+        if self.counts.shape[1] == 0:
+            self.offset = low
+            self.counts = np.zeros((self.n_steps, high - low + 1), dtype=np.int64)
+            return
+        left = max(0, self.offset - low)
+        right = max(0, high - (self.offset + self.counts.shape[1] - 1))
+        if left or right:
+            self.counts = np.pad(self.counts, ((0, 0), (left, right)))
+            self.offset -= left
+
+    def add(self, log_paths):
+        """加入一批路徑的累積對數報酬 (路徑數 x n_steps)"""
+        buckets = np.ceil(log_paths / self.bucket_width).astype(np.int64)
+        self._ensure_range(int(buckets.min()), int(buckets.max()))
+        width = self.counts.shape[1]
+        flat = (buckets - self.offset) + np.arange(self.n_steps)[None, :] * width
+        self.counts += np.bincount(flat.ravel(), minlength=self.n_steps * width).reshape(self.n_steps, width)
+        self.count += len(log_paths)
+
+    def merge(self, other):
+        """合併另一個相同步數 / 精度的草圖"""
+        if other.count == 0:
+            return self
+        self._ensure_range(other.offset, other.offset + other.counts.shape[1] - 1)
+        start = other.offset - self.offset
+        self.counts[:, start:start + other.counts.shape[1]] += other.counts
+        self.count += other.count
+        return self
+
+    def log_quantiles(self, percentiles):
+        """回傳每一步的累積對數報酬分位數 (len(percentiles) x n_steps)"""
+        cumulative = np.cumsum(self.counts, axis=1)
+        # 第一個累積計數超過 rank 的桶；以桶的中點作為代表值
+        idx = np.array([
+            (cumulative <= q / 100 * (self.count - 1)).sum(axis=1) for q in percentiles
+        ])
+        return (idx + self.offset - 0.5) * self.bucket_width
+
+
+def stream_percentile_bands(generate, n_paths, initial_value, percentiles,
+                            relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    串流版的 percentile_bands: 反覆呼叫 generate() 取得一批累積對數報酬，直到湊滿 n_paths 條。
+    每一批都是獨立的重複樣本，順便累加每批的百分位 (和 / 平方和) 以估計標準誤，
+    記憶體只需要 O(步數 x 百分位數)。
+    回傳 (bands, errors, total_paths)，bands / errors 皆含第 0 步 (起始價值)。
+    """
+    sketch = None
+    total = 0
+    n_chunks = 0
+    chunk_sum = chunk_sq = 0.0
+    while total < n_paths:
+        log_paths = generate()
+        if sketch is None:
+            sketch = QuantileSketch(log_paths.shape[1], relative_accuracy)
+        sketch.add(log_paths)
+        chunk_bands = np.exp(np.percentile(log_paths, percentiles, axis=0))
+        chunk_sum = chunk_sum + chunk_bands
+        chunk_sq = chunk_sq + chunk_bands ** 2
+        total += len(log_paths)
+        n_chunks += 1
+
+    start = np.full((len(percentiles), 1), float(initial_value))
+    bands = np.hstack([start, initial_value * np.exp(sketch.log_quantiles(percentiles))])
+    if n_chunks < 2:
+        return bands, None, total
+    variance = np.maximum(chunk_sq - chunk_sum ** 2 / n_chunks, 0.0) / (n_chunks - 1)
+    errors = np.hstack([np.zeros_like(start), initial_value * np.sqrt(variance / n_chunks)])
+    return bands, errors, total
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from app.db import connect
+from app import price_store
+from app.response_cache import get_store
+
+# ---------------------------------------------------------
+# 價格寫入後的預先計算 (cache warming)
+# ---------------------------------------------------------
+# seed.py 寫入新價格、發布新的價格矩陣版本之後，所有回應快取的 key 都會改變，
+# 早上第一批使用者會全部遇到冷快取。這裡在價格寫入完成後 (或由 cron 定時執行
+# `flask --app run warm-cache`)，依照優先順序走過所有投資組合，
+# 以執行緒池呼叫績效 / 建議 / 模擬 API，結果寫入跨 worker 的結果目錄 (RESPONSE_STORE_DIR)。
+# 伺服器的 worker 之後第一次遇到相同請求時直接讀取磁碟上的結果。
+#
+# 優先順序: 最近有活動的使用者優先 (以使用者最近一次更新投資組合的時間近似)，
+# 同一個使用者的組合再依各自的更新時間排序。
+# 進度與耗時寫在 <RESPONSE_STORE_DIR>/warmup.json，/api/v1/system/stats 會一併回傳。
+
+# 預先計算的 API (只計算預設參數，也就是前端載入頁面時送出的請求)
+WARMUP_ENDPOINTS = {
+    'performance': '/api/v1/portfolio/performance/{portfolio_id}',
+    'recommendation': '/api/v1/portfolio/recommendation/{portfolio_id}',
+    'simulation': '/api/v1/portfolio/simulation/{portfolio_id}',
+}
+DEFAULT_WORKERS = 4
+STATUS_FILE = 'warmup.json'
+# 進度檔最短的寫入間隔 (秒)
+STATUS_INTERVAL = 1.0
+
+
+def prioritized_portfolios(connection, limit=None):
+    """依照預先計算的優先順序回傳所有投資組合的 portfolio_id"""
+    sql = """
+        SELECT portfolio_id
+        FROM Portfolios
+        ORDER BY MAX(updated_at) OVER (PARTITION BY user_id) DESC, updated_at DESC, portfolio_id
+    """
+    if limit:
+        sql += " LIMIT %s"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (limit,) if limit else None)
+        return [row['portfolio_id'] for row in cursor.fetchall()]
+
+
+class WarmupProgress:
+    """預先計算的進度與耗時統計 (thread-safe)，定期寫到進度檔"""
+
+    def __init__(self, total, endpoints, status_path=None):
+        self._lock = threading.Lock()
+        self.status_path = status_path
+        self.version = price_store.data_version()
+        self.started_at = time.time()
+        self.finished_at = None
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.seconds = {name: 0.0 for name in endpoints}
+        self.counts = {name: 0 for name in endpoints}
+        self._last_write = 0.0
+
+    def record(self, endpoint, status_code, cache_status, elapsed):
+        with self._lock:
+            self.done += 1
+            if status_code != 200:
+                self.failed += 1
+            elif cache_status in ('HIT', 'STORE', 'COALESCED'):
+                # 已經有結果 (例如同一版本重複執行)
+                self.skipped += 1
+            self.seconds[endpoint] += elapsed
+            self.counts[endpoint] += 1
+            if time.monotonic() - self._last_write >= STATUS_INTERVAL:
+                self._last_write = time.monotonic()
+                self._write()
+
+    def finish(self):
+        with self._lock:
+            self.finished_at = time.time()
+            self._write()
+        return self.to_dict()
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "version": self.version,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "durationSeconds": round(end - self.started_at, 3),
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "avgSeconds": {
+                name: round(self.seconds[name] / self.counts[name], 4) if self.counts[name] else None
+                for name in self.seconds
+            }
+        }
+
+    def _write(self):
+        if not self.status_path:
+            return
+        tmp_path = f"{self.status_path}.{os.getpid()}"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, self.status_path)
+        except OSError:
+            pass
+
+
+def read_status():
+    """最近一次預先計算的進度 (沒有結果目錄或尚未執行過時回傳 None)"""
+    store = get_store()
+    if store is None:
+        return None
+    try:
+        with open(os.path.join(store.directory, STATUS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def warm_caches(app, portfolio_ids=None, endpoints=None, workers=DEFAULT_WORKERS, limit=None):
+    """
+    預先計算投資組合的分析結果並寫入結果目錄，回傳進度統計 (dict)。
+    portfolio_ids: 指定要計算的組合 (預設為所有組合，依優先順序)
+    endpoints:     WARMUP_ENDPOINTS 的名稱 (預設全部)
+    沒有設定 RESPONSE_STORE_DIR 或價格資料不是已發布版本時不執行 (結果目錄不會被讀取)，回傳 None。
+    """
+    store = get_store()
+    if store is None or price_store.published_version() is None:
+        return None
+
+    endpoints = list(endpoints or WARMUP_ENDPOINTS)
+    if portfolio_ids is None:
+        connection = connect(app.config)
+        try:
+            portfolio_ids = prioritized_portfolios(connection, limit)
+        finally:
+            connection.close()
+
+    # 舊版本的結果不會再被讀到，趁這時清掉
+    store.prune()
+
+    # 依組合優先順序排列，同一個組合的各 API 相鄰
+    tasks = [(pid, name) for pid in portfolio_ids for name in endpoints]
+    progress = WarmupProgress(len(tasks), endpoints, os.path.join(store.directory, STATUS_FILE))
+
+    def run(task):
+        portfolio_id, name = task
+        start = time.monotonic()
+        try:
+            response = app.test_client().get(WARMUP_ENDPOINTS[name].format(portfolio_id=portfolio_id))
+            status_code, cache_status = response.status_code, response.headers.get('X-Cache')
+        except Exception:
+            status_code, cache_status = 500, None
+        progress.record(name, status_code, cache_status, time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # executor.map 依序送出，優先順序高的組合先計算
+        list(pool.map(run, tasks))
+    return progress.finish()
+
+
+def warmup_config(config_class):
+    """
+    預先計算用的設定: 由呼叫端的執行緒池控制並行數，不經過准入控制；
+    也不需要行程內的回應快取 (結果直接寫到結果目錄)。
+    """
+    class WarmupConfig(config_class):
+        ADMISSION_ENABLED = False
+        RESPONSE_CACHE_MAX_BYTES = 0
+    return WarmupConfig
+
+
+def run_warmup(config_class, workers=None, limit=None, endpoints=None):
+    """
+    建立預先計算用的 app 並執行 (seed.py 在新價格發布後呼叫，或由 `flask warm-cache` 指令呼叫)。
+    回傳進度統計；沒有執行時回傳 None。
+    """
+    from app import create_app
+
+    app = create_app(warmup_config(config_class))
+    return warm_caches(
+        app, endpoints=endpoints, limit=limit,
+        workers=workers or app.config.get('WARMUP_WORKERS', DEFAULT_WORKERS)
+    )
+
+
+def init_app(app):
+    """註冊 `flask warm-cache` 指令 (可以放進 cron 定時執行)"""
+
+    @app.cli.command('warm-cache')
+    @click.option('--workers', type=int, default=None, help='並行的執行緒數')
+    @click.option('--limit', type=int, default=None, help='只計算優先順序最高的 N 個組合')
+    @click.option('--endpoint', 'endpoints', multiple=True, type=click.Choice(list(WARMUP_ENDPOINTS)))
+    def warm_cache_command(workers, limit, endpoints):
+        """預先計算所有投資組合的績效 / 建議 / 模擬結果"""
+        from config import Config
+
+        result = run_warmup(Config, workers=workers, limit=limit, endpoints=endpoints or None)
+        if result is None:
+            click.echo('RESPONSE_STORE_DIR or the price store is not configured, nothing to warm')
+        else:
+            click.echo(json.dumps(result))
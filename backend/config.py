@@ -7,4 +7,68 @@ class Config:
     MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
     MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', 'password')
     MYSQL_DB = os.environ.get('MYSQL_DB', 'investment_platform')
-    MYSQL_CURSORCLASS = 'DictCursor'
\ No newline at end of file
+    MYSQL_CURSORCLASS = 'DictCursor'
+
+    # 價格矩陣的二進位快取目錄 (由 seed.py / gunicorn master 發布，所有 worker 以 mmap 共用)
+    # 也可以指向 /dev/shm 底下的目錄；設為空字串則只保留在單一行程的記憶體中
+    PRICE_STORE_DIR = os.environ.get(
+        'PRICE_STORE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'price_cache')
+    )
+
+    # 回應壓縮: 小於 COMPRESS_MIN_SIZE (bytes) 的回應不壓縮；有安裝 brotli 時優先使用 br
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_LEVEL = int(os.environ.get('COMPRESS_BROTLI_LEVEL', 5))
+
+    # 回應快取 (每個 worker 的上限，bytes；0 代表關閉)
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    # 跨 worker 共用的分析結果目錄 (價格寫入後的預先計算也寫在這裡)；設為空字串則不使用
+    RESPONSE_STORE_DIR = os.environ.get(
+        'RESPONSE_STORE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_store')
+    )
+    # 超過此秒數沒有更新的結果 (舊的價格版本) 在啟動、寫入結果與預先計算時刪除
+    RESPONSE_STORE_MAX_AGE = int(os.environ.get('RESPONSE_STORE_MAX_AGE', 3 * 24 * 3600))
+    # 預先計算的執行緒數
+    WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', 4))
+
+    # 相同分析請求合併 (single-flight)：同一 worker 內一定啟用；
+    # 設定 COALESCE_DIR (例如 /dev/shm/investment_coalesce) 時也跨 worker 合併
+    COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    COALESCE_DIR = os.environ.get('COALESCE_DIR', '')
+    COALESCE_RESULT_TTL = float(os.environ.get('COALESCE_RESULT_TTL', 30))
+    COALESCE_LOCK_TIMEOUT = float(os.environ.get('COALESCE_LOCK_TIMEOUT', 60))
+
+    # 准入控制 (每個 worker 行程、每組分析 API 各自計算)：滿載時回傳 503 + Retry-After
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 2))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 4))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+    # 同一來源 IP 同時進行中的分析請求上限 (0 代表不限制)，超過時回傳 429
+    ADMISSION_PER_USER = int(os.environ.get('ADMISSION_PER_USER', 2))
+    # 前面受信任的反向代理層數: 大於 0 時由 X-Forwarded-For 取得代理加上的來源 IP
+    ADMISSION_PROXY_HOPS = int(os.environ.get('ADMISSION_PROXY_HOPS', 0))
+    # 個別 API 組的覆寫值: 模擬最耗 CPU，預設每個 worker 同時只跑一個
+    ADMISSION_LIMITS = {
+        'simulation': {'max_concurrent': int(os.environ.get('ADMISSION_SIMULATION_CONCURRENT', 1))},
+    }
+    # 每個 worker 的執行緒數 (與 gunicorn.conf.py 的 threads 相同) 與保留給其他 API 的執行緒數:
+    # 所有分析 API「執行中 + 排隊中」的總數不超過 執行緒數 - 串流連線上限 - 保留數，超過時直接回傳 503
+    ADMISSION_WORKER_THREADS = int(os.environ.get(
+        'GUNICORN_THREADS', 4 + int(os.environ.get('QUOTE_STREAM_MAX_CLIENTS', 32))
+    ))
+    ADMISSION_RESERVED_THREADS = int(os.environ.get('ADMISSION_RESERVED_THREADS', 2))
+
+    # 即時報價串流 (SSE)：報價來源 ('simulated' 或 'package.module:ClassName')、合併分送的間隔 (秒)
+    QUOTE_SOURCE = os.environ.get('QUOTE_SOURCE', 'simulated')
+    QUOTE_STREAM_TICK = float(os.environ.get('QUOTE_STREAM_TICK', 1.0))
+    QUOTE_STREAM_HEARTBEAT = float(os.environ.get('QUOTE_STREAM_HEARTBEAT', 15))
+    # 每個 worker 同時的串流連線上限 (每個連線佔用一個 gunicorn 執行緒，見 gunicorn.conf.py)
+    QUOTE_STREAM_MAX_CLIENTS = int(os.environ.get('QUOTE_STREAM_MAX_CLIENTS', 32))
+    # 單一連線的最長秒數，之後由 EventSource 自動重新連線
+    QUOTE_STREAM_MAX_SECONDS = float(os.environ.get('QUOTE_STREAM_MAX_SECONDS', 300))
+    # 模擬報價的更新間隔 (秒) 與每步的波動 (對數報酬標準差)
+    QUOTE_SIM_INTERVAL = float(os.environ.get('QUOTE_SIM_INTERVAL', 0.5))
+    QUOTE_SIM_VOLATILITY = float(os.environ.get('QUOTE_SIM_VOLATILITY', 0.001))
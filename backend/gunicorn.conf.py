@@ -0,0 +1,75 @@
+import gc
+import multiprocessing
+import os
+
+# ---------------------------------------------------------
+# 正式環境 (Production) 用的 gunicorn 設定
+# 啟動方式: gunicorn -c gunicorn.conf.py run:app
+# ---------------------------------------------------------
+# 1. master 先載入 Flask app、整張 HistoricalPrices 與 Securities 索引 (preload_app)
+# 2. 再 fork 出 N 個 worker，透過 copy-on-write 共用同一份價格資料
+# 3. 價格矩陣是 PRICE_STORE_DIR 中的二進位快取，每個 worker 以 mmap 掛載，
+#    記憶體用量不隨 worker 數量增加；快取仍有效時啟動只需數毫秒
+# 4. 新價格寫入後 (seed.py 會同時重建快取) 對 master 送 SIGHUP：master 重新掛載價格，
+#    再 fork 新 worker 並優雅地 (graceful) 關閉舊 worker
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# worker 數量預設等於 CPU 核心數 (分析 API 是 CPU-bound)
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# 每個 worker 多個執行緒 (gthread)：分析 API 由准入控制限制同時執行數 (見 app/admission.py)，
+# 其餘執行緒保留給 CRUD API，分析 API 滿載時登入、自選股等請求仍能即時處理。
+# 即時報價串流 (SSE) 的每個連線各佔用一個執行緒 (大多時間在等待)，另外加上串流連線上限
+# 分析 API 排隊時也佔用執行緒，准入控制以同一個數字 (ADMISSION_WORKER_THREADS) 計算總上限，
+# 至少保留 ADMISSION_RESERVED_THREADS 個執行緒給 CRUD API
+threads = int(os.environ.get(
+    'GUNICORN_THREADS', 4 + int(os.environ.get('QUOTE_STREAM_MAX_CLIENTS', 32))
+))
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# seed.py 透過 pidfile 找到 master 並送出 SIGHUP
+pidfile = os.environ.get('GUNICORN_PID_FILE', '/tmp/investment_backend.pid')
+
+accesslog = '-'
+
+
+def _load_prices(server):
+    from app import price_store
+    from run import app
+
+    try:
+        matrix = price_store.load(app.config)
+        server.log.info(
+            "Preloaded HistoricalPrices: %d dates x %d tickers (version %s)",
+            len(matrix.dates), len(matrix.tickers), matrix.version
+        )
+    except Exception as e:
+        # 預載失敗時不阻擋啟動，services 會退回查詢 MySQL
+        price_store.clear()
+        server.log.warning("Failed to preload HistoricalPrices, falling back to MySQL: %s", e)
+
+    # 已知股票集合 / 搜尋索引 (寫入持股、關注清單時不必再查 Securities)
+    from app import security_index
+    try:
+        index = security_index.load(app.config)
+        server.log.info("Preloaded Securities index: %d tickers", len(index))
+    except Exception as e:
+        # 載入失敗時由 worker 在第一次使用時載入
+        server.log.warning("Failed to preload Securities index: %s", e)
+
+    # 將目前所有物件移出 GC 追蹤，避免 worker 跑 GC 時觸碰 (寫入) 共用的記憶體頁
+    gc.freeze()
+
+
+def when_ready(server):
+    """master 準備就緒、第一次 fork worker 之前"""
+    _load_prices(server)
+
+
+def on_reload(server):
+    """收到 SIGHUP：重新載入價格，接著 gunicorn 會 fork 新 worker 取代舊的"""
+    gc.unfreeze()
+    _load_prices(server)
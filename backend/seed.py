@@ -4,6 +4,9 @@ import datetime
 from tqdm import tqdm
 import pandas as pd
 import os
+import signal
+from app import price_store, aggregates, incremental, warmup
+from config import Config
 
 DB_CONFIG = {
     'host': os.environ.get('MYSQL_HOST', '127.0.0.1'),
@@ -22,6 +25,24 @@ START_DATE = (datetime.date.today() - datetime.timedelta(days=5*365)).strftime('
 END_DATE = datetime.date.today().strftime('%Y-%m-%d') # 今天
 
 
+def notify_server_reload():
+    """
+    通知正在運行的 gunicorn master (若有) 重新載入價格資料。
+    master 收到 SIGHUP 後會重新預載 HistoricalPrices 並優雅地替換所有 worker。
+    """
+    pid_file = os.environ.get('GUNICORN_PID_FILE', '/tmp/investment_backend.pid')
+    if not os.path.exists(pid_file):
+        return
+
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, signal.SIGHUP)
+        print(f'🔄 已通知後端伺服器 (PID {pid}) 重新載入價格資料')
+    except (ValueError, ProcessLookupError, PermissionError) as e:
+        print(f'⚠️ 無法通知後端伺服器重新載入: {e}')
+
+
 def seed_database():
     """
     主執行函數：抓取資料並寫入資料庫
@@ -65,6 +86,7 @@ def seed_database():
 
             # -- 步驟 B: 填充 `HistoricalPrices` (歷史價格) --
             print(f'\n⏳ 正在抓取 5 年份的歷史價格 (這可能需要一點時間)...')
+            ingested_tickers = []
 
             for ticker_symbol in tqdm(TICKERS_TO_SEED, desc="處理 HistoricalPrices"):
                 try:
@@ -130,6 +152,7 @@ def seed_database():
                     """
                     
                     cursor.executemany(sql, values_to_insert)
+                    ingested_tickers.append(ticker_symbol)
 
                 except KeyError as e:
                     print(f'\n  ❌ 抓取 {ticker_symbol} 時發生欄位錯誤 (KeyError): {e} - 欄位未找到')
@@ -138,9 +161,48 @@ def seed_database():
 
             print('✅ `HistoricalPrices` 資料表填充完畢！')
 
+            # 遞增價格寫入版本 (與價格同一個 transaction)，後端據此判斷價格快取是否過期
+            if ingested_tickers:
+                price_store.bump_ingest_version(cursor)
+
+            # -- 步驟 C: 增量更新週 / 月彙總 (只重算本次寫入的股票與期間) --
+            if ingested_tickers:
+                aggregates.refresh_aggregates(connection, ingested_tickers, since=START_DATE)
+                print('✅ `PriceAggregates` 週 / 月彙總更新完畢！')
+
+                # -- 步驟 C-1: 增量更新持有這些股票的投資組合統計 (只套用新的交易日) --
+                result = incremental.refresh_running_stats(connection, ingested_tickers)
+                print(
+                    f'✅ `PortfolioRunningStats` 更新完畢！'
+                    f'(增量 {result["incremental"]} 個組合 / {result["days"]} 天，重建 {result["rebuilt"]} 個組合)'
+                )
+
         connection.commit()
         print('\n🎉 資料庫事務已提交，所有資料寫入成功！')
 
+        # -- 步驟 D: 重建二進位價格快取 (後端以 mmap 直接讀取，不必再掃整張表) --
+        if Config.PRICE_STORE_DIR:
+            try:
+                matrix = price_store.rebuild(connection, Config.PRICE_STORE_DIR)
+                print(f'💾 價格快取已更新: {matrix.version} ({len(matrix.dates)} 天 x {len(matrix.tickers)} 檔)')
+            except Exception as e:
+                # 快取失敗不影響資料庫內容，後端會在啟動時偵測過期並自行重建
+                print(f'⚠️ 價格快取更新失敗: {e}')
+
+        notify_server_reload()
+
+        # -- 步驟 E: 預先計算所有投資組合的分析結果 (結果寫入 RESPONSE_STORE_DIR，所有 worker 共用) --
+        try:
+            result = warmup.run_warmup(Config)
+            if result is not None:
+                print(
+                    f'🔥 預先計算完成: {result["done"]} 個請求 '
+                    f'(失敗 {result["failed"]})，耗時 {result["durationSeconds"]} 秒'
+                )
+        except Exception as e:
+            # 預先計算失敗不影響資料，使用者的請求仍會即時計算
+            print(f'⚠️ 預先計算失敗: {e}')
+
     except pymysql.Error as e:
         print(f'❌ 資料庫連線或操作失敗: {e}')
         if connection:
@@ -13,17 +13,24 @@ CREATE TABLE Users (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- ----------------------------
--- 表 2: Securities (不變)
+-- 表 2: Securities (更新: updated_at 供搜尋索引增量更新)
 -- ----------------------------
+-- 既有資料庫請執行 db/migrations/005_securities_updated_at.sql
 CREATE TABLE Securities (
     `ticker_symbol` VARCHAR(20) NOT NULL PRIMARY KEY,
     `name` VARCHAR(255) NOT NULL,
-    `exchange` VARCHAR(50)
+    `exchange` VARCHAR(50),
+    `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- 搜尋索引只讀取某個時間之後新增 / 修改的列 (app/security_index.py)
+    INDEX `idx_updated_at` (`updated_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- ----------------------------
--- 表 3: HistoricalPrices (不變)
+-- 表 3: HistoricalPrices (更新: 依年份分區 + 索引調整)
 -- ----------------------------
+-- (註：InnoDB 的分區表不支援 FOREIGN KEY，因此移除對 Securities 的外鍵；
+--  寫入流程 (seed.py) 一定先寫入 Securities，再寫入價格。)
+-- 既有資料庫請執行 db/migrations/001_partition_historical_prices.sql
 CREATE TABLE HistoricalPrices (
     `ticker_symbol` VARCHAR(20) NOT NULL,
     `date` DATE NOT NULL,
@@ -31,9 +38,144 @@ CREATE TABLE HistoricalPrices (
     `adjusted_close` DECIMAL(10, 4) NOT NULL,
     `volume` BIGINT NOT NULL,
     PRIMARY KEY (`ticker_symbol`, `date`),
-    FOREIGN KEY (`ticker_symbol`) REFERENCES Securities(`ticker_symbol`)
+    -- 以日期開頭：「某日期之後的所有股票」(例如載入最近 N 天的價格矩陣)
+    INDEX `idx_date_ticker` (`date`, `ticker_symbol`)
+    -- 「每檔股票的最新價格」直接反向掃描主鍵 (ticker_symbol, date)，不需要另外的 DESC 索引
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (YEAR(`date`)) (
+    PARTITION p_old VALUES LESS THAN (2016),
+    PARTITION p2016 VALUES LESS THAN (2017),
+    PARTITION p2017 VALUES LESS THAN (2018),
+    PARTITION p2018 VALUES LESS THAN (2019),
+    PARTITION p2019 VALUES LESS THAN (2020),
+    PARTITION p2020 VALUES LESS THAN (2021),
+    PARTITION p2021 VALUES LESS THAN (2022),
+    PARTITION p2022 VALUES LESS THAN (2023),
+    PARTITION p2023 VALUES LESS THAN (2024),
+    PARTITION p2024 VALUES LESS THAN (2025),
+    PARTITION p2025 VALUES LESS THAN (2026),
+    PARTITION p2026 VALUES LESS THAN (2027),
+    PARTITION p2027 VALUES LESS THAN (2028),
+    PARTITION p2028 VALUES LESS THAN (2029),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- ----------------------------
+-- 表 3-1: HistoricalPricesArchive (新增: 冷資料歸檔)
+-- ----------------------------
+-- 超過保留年限的舊價格由 archive_historical_prices() 搬到這裡 (壓縮儲存)，
+-- 讓 HistoricalPrices 只保留常用的近年資料。
+CREATE TABLE HistoricalPricesArchive (
+    `ticker_symbol` VARCHAR(20) NOT NULL,
+    `date` DATE NOT NULL,
+    `close` DECIMAL(10, 4) NOT NULL,
+    `adjusted_close` DECIMAL(10, 4) NOT NULL,
+    `volume` BIGINT NOT NULL,
+    PRIMARY KEY (`ticker_symbol`, `date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED;
+
+-- 完整歷史 (熱資料 + 歸檔) 的唯讀視圖，給需要「全部歷史」的查詢使用
+-- (WHERE 條件下推到 UNION ALL 的每個分支需要 MySQL 8.0.29 以上，見 docker-compose.yml)
+CREATE VIEW AllHistoricalPrices AS
+    SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume` FROM HistoricalPrices
+    UNION ALL
+    SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume` FROM HistoricalPricesArchive;
+
+-- 把 p_future 切出新的年份分區，直到 (今年 + years_ahead) 年 (已存在的年份不重複建立)
+-- 例: CALL extend_historical_price_partitions(2);
+-- (ALTER TABLE 會隱含 COMMIT；p_future 通常是空的，重組只搬移很少的資料)
+DELIMITER $$
+CREATE PROCEDURE extend_historical_price_partitions(IN years_ahead INT)
+BEGIN
+    DECLARE next_year INT;
+    DECLARE last_year INT DEFAULT YEAR(CURDATE()) + years_ahead;
+    DECLARE parts TEXT DEFAULT '';
+
+    -- 最後一個年份分區的上界 (VALUES LESS THAN 的值) 就是下一個要建立的年份
+    SELECT MAX(CAST(PARTITION_DESCRIPTION AS UNSIGNED)) INTO next_year
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = 'HistoricalPrices'
+      AND PARTITION_DESCRIPTION <> 'MAXVALUE';
+
+    WHILE next_year <= last_year DO
+        SET parts = CONCAT(parts, 'PARTITION p', next_year, ' VALUES LESS THAN (', next_year + 1, '), ');
+        SET next_year = next_year + 1;
+    END WHILE;
+
+    IF parts <> '' THEN
+        SET @sql = CONCAT(
+            'ALTER TABLE HistoricalPrices REORGANIZE PARTITION p_future INTO (',
+            parts, 'PARTITION p_future VALUES LESS THAN MAXVALUE)'
+        );
+        PREPARE stmt FROM @sql;
+        EXECUTE stmt;
+        DEALLOCATE PREPARE stmt;
+    END IF;
+END$$
+DELIMITER ;
+
+-- 將 keep_years 年以前的價格搬到歸檔表，並延伸未來的年份分區
+-- (每年執行一次即可；分區定義只寫到 p2028，之後的年份由 extend_historical_price_partitions 建立)
+-- 例: CALL archive_historical_prices(10);  -- 只保留最近 10 年在 HistoricalPrices
+DELIMITER $$
+CREATE PROCEDURE archive_historical_prices(IN keep_years INT)
+BEGIN
+    DECLARE cutoff DATE DEFAULT MAKEDATE(YEAR(CURDATE()) - keep_years, 1);
+
+    START TRANSACTION;
+    INSERT INTO HistoricalPricesArchive (`ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`)
+        SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`
+        FROM HistoricalPrices
+        WHERE `date` < cutoff
+    ON DUPLICATE KEY UPDATE
+        `close` = VALUES(`close`),
+        `adjusted_close` = VALUES(`adjusted_close`),
+        `volume` = VALUES(`volume`);
+    -- 依年份分區，只會掃描到舊的分區
+    DELETE FROM HistoricalPrices WHERE `date` < cutoff;
+    COMMIT;
+
+    -- 順便確保未來兩年的分區已經存在 (新年份的價格不會全部落在 p_future)
+    CALL extend_historical_price_partitions(2);
+END$$
+DELIMITER ;
+
+-- 建立資料庫時就補上到 (今年 + 2) 年的分區
+CALL extend_historical_price_partitions(2);
+
+-- ----------------------------
+-- 表 3-2: PriceAggregates (新增: 週 / 月彙總)
+-- ----------------------------
+-- 由 HistoricalPrices 彙總的每週 ('W') / 每月 ('M') OHLCV，資料寫入時增量更新 (app/aggregates.py)。
+-- 長區間走勢圖改讀這張表 (10 年約 520 筆週資料，而不是約 2,500 筆日資料)。
+CREATE TABLE PriceAggregates (
+    `ticker_symbol` VARCHAR(20) NOT NULL,
+    `resolution` CHAR(1) NOT NULL,           -- 'W' 週 / 'M' 月
+    `period_start` DATE NOT NULL,            -- 期間第一天 (週一 / 1 號)
+    `period_end` DATE NOT NULL,              -- 期間內最後一個交易日
+    `open` DECIMAL(10, 4) NOT NULL,
+    `high` DECIMAL(10, 4) NOT NULL,
+    `low` DECIMAL(10, 4) NOT NULL,
+    `close` DECIMAL(10, 4) NOT NULL,
+    `adjusted_close` DECIMAL(10, 4) NOT NULL,
+    `volume` BIGINT NOT NULL,
+    PRIMARY KEY (`resolution`, `ticker_symbol`, `period_start`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- ----------------------------
+-- 表 3-3: PriceIngestVersion (新增: 價格寫入版本)
+-- ----------------------------
+-- seed.py 寫入價格時在同一個 transaction 中遞增；後端啟動 / 重新載入時只讀這一列
+-- 就能判斷二進位價格快取是否過期 (app/price_store.py)，不必 COUNT 整段歷史。
+-- 歸檔 (archive_historical_prices) 只是搬移資料，AllHistoricalPrices 的內容不變，不需要遞增。
+CREATE TABLE PriceIngestVersion (
+    `id` TINYINT NOT NULL PRIMARY KEY,       -- 只有一列 (id = 1)
+    `version` BIGINT NOT NULL,               -- 每次寫入價格 (同一個 transaction) 加 1
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT INTO PriceIngestVersion (`id`, `version`) VALUES (1, 0);
+
 -- ----------------------------
 -- 表 4: Portfolios (更新)
 -- ----------------------------
@@ -61,6 +203,42 @@ CREATE TABLE PortfolioItems (
     UNIQUE KEY `uk_portfolio_security` (`portfolio_id`, `ticker_symbol`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- ----------------------------
+-- 表 5-1: PortfolioRunningStats (新增: 增量統計狀態)
+-- ----------------------------
+-- 每個投資組合的最新價值、歷史最高價值 / 最大回撤、滾動一年的日報酬累加值。
+-- 由 seed.py 在寫入新價格時增量更新 (app/incremental.py)，不必每次從頭重算整段歷史。
+CREATE TABLE PortfolioRunningStats (
+    `portfolio_id` INT NOT NULL PRIMARY KEY,
+    `fingerprint` VARCHAR(32) NOT NULL,      -- 持股指紋 (持股改變時從完整歷史重建)
+    `as_of` DATE NOT NULL,                   -- 已計算到的最後一個交易日
+    `latest_value` DOUBLE NOT NULL,
+    `running_max` DOUBLE NOT NULL,           -- 歷史最高總價值
+    `max_drawdown` DOUBLE NOT NULL,          -- 歷史最大回撤
+    `window_values` BLOB NOT NULL,           -- 最近 253 個交易日的總價值 (float64, little-endian)
+    `return_sum` DOUBLE NOT NULL,            -- 視窗內日報酬的總和
+    `return_sum_sq` DOUBLE NOT NULL,         -- 視窗內日報酬的平方和
+    `pushes_since_resum` SMALLINT NOT NULL DEFAULT 0,
+    `last_prices` JSON NOT NULL,             -- 各持股的最新價格 (forward fill 用)
+    `snapshot_start` DATE NULL,              -- 每日價值快照的第一個交易日 (NULL: 快照不完整)
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (`portfolio_id`) REFERENCES Portfolios(`portfolio_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- ----------------------------
+-- 表 5-2: PortfolioDailyValues (新增: 每日價值快照)
+-- ----------------------------
+-- 每個投資組合每個交易日的總價值與各持股價值。持股改變時重建該組合，
+-- 新價格寫入時新增新的交易日；績效走勢只需要一次主鍵範圍掃描 (app/daily_values.py)。
+CREATE TABLE PortfolioDailyValues (
+    `portfolio_id` INT NOT NULL,
+    `date` DATE NOT NULL,
+    `total_value` DECIMAL(20, 4) NOT NULL,
+    `holding_values` JSON NOT NULL,          -- {ticker: 數量 x 調整收盤價}
+    PRIMARY KEY (`portfolio_id`, `date`),
+    FOREIGN KEY (`portfolio_id`) REFERENCES Portfolios(`portfolio_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- ----------------------------
 -- 表 6: WatchListItems (新增)
 -- ----------------------------
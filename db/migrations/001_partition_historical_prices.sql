@@ -0,0 +1,90 @@
+-- ----------------------------------------------------------------
+-- Migration 001: HistoricalPrices 分區 + 索引調整 + 歸檔表
+-- ----------------------------------------------------------------
+-- 適用於以舊版 init.sql 建立的資料庫 (新建立的資料庫已包含以下內容)。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/001_partition_historical_prices.sql
+-- (注意：重新分區會重建整張 HistoricalPrices，資料量大時請在離峰時段執行)
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+-- 1. 移除 HistoricalPrices -> Securities 的外鍵 (InnoDB 分區表不支援外鍵)
+--    外鍵名稱是自動產生的，因此從 information_schema 查出來再刪除
+SET @fk_name = (
+    SELECT CONSTRAINT_NAME
+    FROM information_schema.TABLE_CONSTRAINTS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = 'HistoricalPrices'
+      AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+    LIMIT 1
+);
+SET @sql = IF(
+    @fk_name IS NULL,
+    'SELECT 1',
+    CONCAT('ALTER TABLE HistoricalPrices DROP FOREIGN KEY `', @fk_name, '`')
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 2. 新增「日期優先」的索引 (「每檔最新價格」直接反向掃描主鍵)
+ALTER TABLE HistoricalPrices
+    ADD INDEX `idx_date_ticker` (`date`, `ticker_symbol`);
+
+-- 3. 依年份做 RANGE 分區 (會重建整張表)
+ALTER TABLE HistoricalPrices
+PARTITION BY RANGE (YEAR(`date`)) (
+    PARTITION p_old VALUES LESS THAN (2016),
+    PARTITION p2016 VALUES LESS THAN (2017),
+    PARTITION p2017 VALUES LESS THAN (2018),
+    PARTITION p2018 VALUES LESS THAN (2019),
+    PARTITION p2019 VALUES LESS THAN (2020),
+    PARTITION p2020 VALUES LESS THAN (2021),
+    PARTITION p2021 VALUES LESS THAN (2022),
+    PARTITION p2022 VALUES LESS THAN (2023),
+    PARTITION p2023 VALUES LESS THAN (2024),
+    PARTITION p2024 VALUES LESS THAN (2025),
+    PARTITION p2025 VALUES LESS THAN (2026),
+    PARTITION p2026 VALUES LESS THAN (2027),
+    PARTITION p2027 VALUES LESS THAN (2028),
+    PARTITION p2028 VALUES LESS THAN (2029),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- 4. 歸檔表、完整歷史視圖、歸檔程序 (與 init.sql 相同)
+CREATE TABLE IF NOT EXISTS HistoricalPricesArchive (
+    `ticker_symbol` VARCHAR(20) NOT NULL,
+    `date` DATE NOT NULL,
+    `close` DECIMAL(10, 4) NOT NULL,
+    `adjusted_close` DECIMAL(10, 4) NOT NULL,
+    `volume` BIGINT NOT NULL,
+    PRIMARY KEY (`ticker_symbol`, `date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED;
+
+CREATE OR REPLACE VIEW AllHistoricalPrices AS
+    SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume` FROM HistoricalPrices
+    UNION ALL
+    SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume` FROM HistoricalPricesArchive;
+
+DROP PROCEDURE IF EXISTS archive_historical_prices;
+DELIMITER $$
+CREATE PROCEDURE archive_historical_prices(IN keep_years INT)
+BEGIN
+    DECLARE cutoff DATE DEFAULT MAKEDATE(YEAR(CURDATE()) - keep_years, 1);
+
+    START TRANSACTION;
+    INSERT INTO HistoricalPricesArchive (`ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`)
+        SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`
+        FROM HistoricalPrices
+        WHERE `date` < cutoff
+    ON DUPLICATE KEY UPDATE
+        `close` = VALUES(`close`),
+        `adjusted_close` = VALUES(`adjusted_close`),
+        `volume` = VALUES(`volume`);
+    -- 依年份分區，只會掃描到舊的分區
+    DELETE FROM HistoricalPrices WHERE `date` < cutoff;
+    COMMIT;
+END$$
+DELIMITER ;
+
+-- 5. 之後每年新增分區: migration 008 的 extend_historical_price_partitions (歸檔時也會自動呼叫)
@@ -0,0 +1,62 @@
+-- ----------------------------------------------------------------
+-- Migration 002: 週 / 月價格彙總表 (PriceAggregates)
+-- ----------------------------------------------------------------
+-- 建立彙總表並從既有的價格資料回填。之後由 seed.py 在每次寫入價格時增量更新。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/002_price_aggregates.sql
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+CREATE TABLE IF NOT EXISTS PriceAggregates (
+    `ticker_symbol` VARCHAR(20) NOT NULL,
+    `resolution` CHAR(1) NOT NULL,           -- 'W' 週 / 'M' 月
+    `period_start` DATE NOT NULL,            -- 期間第一天 (週一 / 1 號)
+    `period_end` DATE NOT NULL,              -- 期間內最後一個交易日
+    `open` DECIMAL(10, 4) NOT NULL,
+    `high` DECIMAL(10, 4) NOT NULL,
+    `low` DECIMAL(10, 4) NOT NULL,
+    `close` DECIMAL(10, 4) NOT NULL,
+    `adjusted_close` DECIMAL(10, 4) NOT NULL,
+    `volume` BIGINT NOT NULL,
+    PRIMARY KEY (`resolution`, `ticker_symbol`, `period_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 回填週資料
+INSERT INTO PriceAggregates
+    (ticker_symbol, resolution, period_start, period_end, `open`, high, low, `close`, adjusted_close, volume)
+SELECT
+    ticker_symbol, 'W', period_start, MAX(date),
+    SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date ASC), ',', 1),
+    MAX(`close`), MIN(`close`),
+    SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date DESC), ',', 1),
+    SUBSTRING_INDEX(GROUP_CONCAT(adjusted_close ORDER BY date DESC), ',', 1),
+    SUM(volume)
+FROM (
+    SELECT ticker_symbol, date, `close`, adjusted_close, volume,
+           DATE_SUB(date, INTERVAL WEEKDAY(date) DAY) AS period_start
+    FROM AllHistoricalPrices
+) t
+GROUP BY ticker_symbol, period_start
+ON DUPLICATE KEY UPDATE
+    period_end = VALUES(period_end), `open` = VALUES(`open`), high = VALUES(high), low = VALUES(low),
+    `close` = VALUES(`close`), adjusted_close = VALUES(adjusted_close), volume = VALUES(volume);
+
+-- 回填月資料
+INSERT INTO PriceAggregates
+    (ticker_symbol, resolution, period_start, period_end, `open`, high, low, `close`, adjusted_close, volume)
+SELECT
+    ticker_symbol, 'M', period_start, MAX(date),
+    SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date ASC), ',', 1),
+    MAX(`close`), MIN(`close`),
+    SUBSTRING_INDEX(GROUP_CONCAT(`close` ORDER BY date DESC), ',', 1),
+    SUBSTRING_INDEX(GROUP_CONCAT(adjusted_close ORDER BY date DESC), ',', 1),
+    SUM(volume)
+FROM (
+    SELECT ticker_symbol, date, `close`, adjusted_close, volume,
+           DATE_SUB(date, INTERVAL DAYOFMONTH(date) - 1 DAY) AS period_start
+    FROM AllHistoricalPrices
+) t
+GROUP BY ticker_symbol, period_start
+ON DUPLICATE KEY UPDATE
+    period_end = VALUES(period_end), `open` = VALUES(`open`), high = VALUES(high), low = VALUES(low),
+    `close` = VALUES(`close`), adjusted_close = VALUES(adjusted_close), volume = VALUES(volume);
@@ -0,0 +1,25 @@
+-- ----------------------------------------------------------------
+-- Migration 003: 投資組合增量統計狀態 (PortfolioRunningStats)
+-- ----------------------------------------------------------------
+-- 每個投資組合的最新價值、歷史最高價值 / 最大回撤、滾動一年的日報酬累加值。
+-- 由 seed.py 在寫入新價格時增量更新 (app/incremental.py)；表格為空時第一次執行會從完整歷史建立。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/003_portfolio_running_stats.sql
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+CREATE TABLE IF NOT EXISTS PortfolioRunningStats (
+    `portfolio_id` INT NOT NULL PRIMARY KEY,
+    `fingerprint` VARCHAR(32) NOT NULL,      -- 持股指紋 (持股改變時從完整歷史重建)
+    `as_of` DATE NOT NULL,                   -- 已計算到的最後一個交易日
+    `latest_value` DOUBLE NOT NULL,
+    `running_max` DOUBLE NOT NULL,           -- 歷史最高總價值
+    `max_drawdown` DOUBLE NOT NULL,          -- 歷史最大回撤
+    `window_values` BLOB NOT NULL,           -- 最近 253 個交易日的總價值 (float64, little-endian)
+    `return_sum` DOUBLE NOT NULL,            -- 視窗內日報酬的總和
+    `return_sum_sq` DOUBLE NOT NULL,         -- 視窗內日報酬的平方和
+    `pushes_since_resum` SMALLINT NOT NULL DEFAULT 0,
+    `last_prices` JSON NOT NULL,             -- 各持股的最新價格 (forward fill 用)
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (`portfolio_id`) REFERENCES Portfolios(`portfolio_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
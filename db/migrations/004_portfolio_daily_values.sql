@@ -0,0 +1,21 @@
+-- ----------------------------------------------------------------
+-- Migration 004: 投資組合每日價值快照 (PortfolioDailyValues)
+-- ----------------------------------------------------------------
+-- 每個投資組合每個交易日的總價值與各持股價值。持股改變時重建該組合，
+-- 新價格寫入時由 seed.py 新增新的交易日 (app/daily_values.py、app/incremental.py)。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/004_portfolio_daily_values.sql
+-- 建立後回填既有組合 (需要 migration 003):
+--   docker compose exec backend flask --app run refresh-portfolio-stats --full
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+CREATE TABLE IF NOT EXISTS PortfolioDailyValues (
+    `portfolio_id` INT NOT NULL,
+    `date` DATE NOT NULL,
+    `total_value` DECIMAL(20, 4) NOT NULL,
+    `holding_values` JSON NOT NULL,          -- {ticker: 數量 x 調整收盤價}
+    -- 績效走勢 / 最近 N 天: 以 (portfolio_id, date) 範圍掃描
+    PRIMARY KEY (`portfolio_id`, `date`),
+    FOREIGN KEY (`portfolio_id`) REFERENCES Portfolios(`portfolio_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
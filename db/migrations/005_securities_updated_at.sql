@@ -0,0 +1,14 @@
+-- ----------------------------------------------------------------
+-- Migration 005: Securities 加上 updated_at (股票搜尋索引的增量更新)
+-- ----------------------------------------------------------------
+-- 每個 worker 在記憶體中保留 Securities 的搜尋索引 (app/security_index.py)，
+-- 定期以 (COUNT(*), MAX(updated_at)) 檢查是否有變動，只重新讀取 updated_at 之後的列。
+-- 既有的列會以執行 migration 的時間填入 updated_at。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/005_securities_updated_at.sql
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+ALTER TABLE Securities
+    ADD COLUMN `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX `idx_updated_at` (`updated_at`);
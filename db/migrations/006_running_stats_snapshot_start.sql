@@ -0,0 +1,15 @@
+-- ----------------------------------------------------------------
+-- Migration 006: PortfolioRunningStats 記錄每日價值快照的起始日 (snapshot_start)
+-- ----------------------------------------------------------------
+-- 在 004 回填之前就已經有狀態的組合，增量更新只會新增新的交易日，
+-- PortfolioDailyValues 中只有部分日期。snapshot_start 是快照的第一個交易日 (重建整段序列時寫入)，
+-- NULL 代表快照不完整: 讀取時改為由價格即時計算，下一次增量更新時重建該組合 (app/incremental.py)。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/006_running_stats_snapshot_start.sql
+-- 之後可立即重建快照不完整的組合 (不必等到下一次寫入價格):
+--   docker compose exec backend flask --app run refresh-portfolio-stats
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+ALTER TABLE PortfolioRunningStats
+    ADD COLUMN `snapshot_start` DATE NULL AFTER `last_prices`;
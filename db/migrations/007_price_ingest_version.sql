@@ -0,0 +1,17 @@
+-- ----------------------------------------------------------------
+-- Migration 007: 價格寫入版本 (PriceIngestVersion)
+-- ----------------------------------------------------------------
+-- seed.py 寫入價格時在同一個 transaction 中遞增 version；後端啟動 / 重新載入時只讀這一列
+-- 判斷二進位價格快取 (PRICE_STORE_DIR) 是否過期，不必對 AllHistoricalPrices 做 COUNT(*) / MAX(date)。
+-- 既有的快取標頭沒有 ingest_version，升級後第一次啟動會重建一次快取。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/007_price_ingest_version.sql
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+CREATE TABLE IF NOT EXISTS PriceIngestVersion (
+    `id` TINYINT NOT NULL PRIMARY KEY,       -- 只有一列 (id = 1)
+    `version` BIGINT NOT NULL,               -- 每次寫入價格 (同一個 transaction) 加 1
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+INSERT IGNORE INTO PriceIngestVersion (`id`, `version`) VALUES (1, 0);
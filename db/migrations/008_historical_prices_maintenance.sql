@@ -0,0 +1,86 @@
+-- ----------------------------------------------------------------
+-- Migration 008: 移除重複的 idx_ticker_date_desc + 年份分區的維護程序
+-- ----------------------------------------------------------------
+-- idx_ticker_date_desc (ticker_symbol, date DESC) 與主鍵 (ticker_symbol, date) 重複:
+-- InnoDB 可以反向掃描主鍵取得「每檔最新價格」，多一個索引只增加寫入成本與空間。
+-- 分區原本只定義到 p2028 + p_future；extend_historical_price_partitions 從 p_future 切出新的年份，
+-- archive_historical_prices 結束時會自動呼叫 (也可以單獨每年執行一次)。
+-- 執行方式:
+--   docker compose exec -T db mysql -uroot -ppassword < db/migrations/008_historical_prices_maintenance.sql
+USE `investment_platform`;
+SET NAMES utf8mb4;
+
+-- 1. 移除重複的索引 (以舊版 migration 001 建立的資料庫才有)
+SET @sql = IF(
+    EXISTS (
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'HistoricalPrices'
+          AND INDEX_NAME = 'idx_ticker_date_desc'
+    ),
+    'ALTER TABLE HistoricalPrices DROP INDEX `idx_ticker_date_desc`',
+    'SELECT 1'
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 2. 年份分區的維護程序與歸檔程序 (與 init.sql 相同)
+DROP PROCEDURE IF EXISTS extend_historical_price_partitions;
+DELIMITER $$
+CREATE PROCEDURE extend_historical_price_partitions(IN years_ahead INT)
+BEGIN
+    DECLARE next_year INT;
+    DECLARE last_year INT DEFAULT YEAR(CURDATE()) + years_ahead;
+    DECLARE parts TEXT DEFAULT '';
+
+    -- 最後一個年份分區的上界 (VALUES LESS THAN 的值) 就是下一個要建立的年份
+    SELECT MAX(CAST(PARTITION_DESCRIPTION AS UNSIGNED)) INTO next_year
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = 'HistoricalPrices'
+      AND PARTITION_DESCRIPTION <> 'MAXVALUE';
+
+    WHILE next_year <= last_year DO
+        SET parts = CONCAT(parts, 'PARTITION p', next_year, ' VALUES LESS THAN (', next_year + 1, '), ');
+        SET next_year = next_year + 1;
+    END WHILE;
+
+    IF parts <> '' THEN
+        SET @sql = CONCAT(
+            'ALTER TABLE HistoricalPrices REORGANIZE PARTITION p_future INTO (',
+            parts, 'PARTITION p_future VALUES LESS THAN MAXVALUE)'
+        );
+        PREPARE stmt FROM @sql;
+        EXECUTE stmt;
+        DEALLOCATE PREPARE stmt;
+    END IF;
+END$$
+DELIMITER ;
+
+DROP PROCEDURE IF EXISTS archive_historical_prices;
+DELIMITER $$
+CREATE PROCEDURE archive_historical_prices(IN keep_years INT)
+BEGIN
+    DECLARE cutoff DATE DEFAULT MAKEDATE(YEAR(CURDATE()) - keep_years, 1);
+
+    START TRANSACTION;
+    INSERT INTO HistoricalPricesArchive (`ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`)
+        SELECT `ticker_symbol`, `date`, `close`, `adjusted_close`, `volume`
+        FROM HistoricalPrices
+        WHERE `date` < cutoff
+    ON DUPLICATE KEY UPDATE
+        `close` = VALUES(`close`),
+        `adjusted_close` = VALUES(`adjusted_close`),
+        `volume` = VALUES(`volume`);
+    -- 依年份分區，只會掃描到舊的分區
+    DELETE FROM HistoricalPrices WHERE `date` < cutoff;
+    COMMIT;
+
+    -- 順便確保未來兩年的分區已經存在 (新年份的價格不會全部落在 p_future)
+    CALL extend_historical_price_partitions(2);
+END$$
+DELIMITER ;
+
+-- 3. 立即建立到 (今年 + 2) 年的分區
+CALL extend_historical_price_partitions(2);
@@ -1,4 +1,4 @@
-import { useState, useEffect, useContext } from "react";
+import { useState, useEffect, useContext, useRef } from "react";
 import "./index.css";
 import { Trash2, Activity, Plus, X, Search } from "lucide-react";
 import { StoreContext } from "../../Utils/Context";
@@ -23,8 +23,14 @@ export default function Watchlist() {
   const [loading, setLoading] = useState(false);
   const [refresh, setRefresh] = useState(0);
   const [watchlist, setWatchlist] = useState([]);
-  const [allTickers, setAllTickers] = useState([]);
+  const [query, setQuery] = useState("");
   const [filterTickers, setFilterTickers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [streamRetry, setStreamRetry] = useState(0);
+  // AbortController of the current search query; aborted when the query changes
+  // so late responses (first page or "load more") from an older query are dropped
+  const searchRef = useRef(null);
   const fetchWatchlistData = async () => {
     try {
       const response = await api.get(`/watchlists/${userInfo.userId}`);
@@ -61,11 +67,37 @@ export default function Watchlist() {
     }
   };
 
-  const filterTickersFunc = (query) => {
-    const filtered = allTickers.filter((ticker) =>
-      ticker.toLowerCase().includes(query.toLowerCase())
+  // Search is served by the backend index (paginated) instead of downloading every ticker
+  const fetchTickers = async (keyword, cursor, signal) => {
+    const params = { limit: 50 };
+    if (cursor) params.cursor = cursor;
+    const response = keyword
+      ? await api.get("/assets/search", { params: { ...params, q: keyword }, signal })
+      : await api.get("/assets", { params, signal });
+    if (signal.aborted) return;
+    const items = (response.data.data || []).map((item) =>
+      typeof item === "string" ? { ticker: item } : item
     );
-    setFilterTickers(filtered);
+    setFilterTickers((prev) => (cursor ? [...prev, ...items] : items));
+    setNextCursor(response.data.nextCursor || null);
+  };
+
+  const loadMoreTickers = async (e) => {
+    const { scrollTop, scrollHeight, clientHeight } = e.currentTarget;
+    const controller = searchRef.current;
+    if (!controller || !nextCursor || loadingMore || scrollTop + clientHeight < scrollHeight - 20) {
+      return;
+    }
+    try {
+      setLoadingMore(true);
+      await fetchTickers(query.trim(), nextCursor, controller.signal);
+    } catch (error) {
+      if (!controller.signal.aborted) {
+        console.error("Failed to fetch tickers", error);
+      }
+    } finally {
+      setLoadingMore(false);
+    }
   };
 
   useEffect(() => {
@@ -75,41 +107,60 @@ export default function Watchlist() {
   }, [userInfo.userId, refresh]);
 
   useEffect(() => {
-    const fetchTickers = async () => {
-      try {
-        setLoading(true);
-        const response = await api.get("/assets");
-        setAllTickers(response.data.data || []);
-        setFilterTickers(response.data.data || []);
-      } catch (error) {
+    const controller = new AbortController();
+    searchRef.current = controller;
+    // the cursor belongs to the previous query: no "load more" until the new first page arrives
+    setNextCursor(null);
+    // Debounce: search once typing pauses for 250ms
+    const timeoutId = setTimeout(() => {
+      fetchTickers(query.trim(), null, controller.signal).catch((error) => {
+        if (controller.signal.aborted) return;
         console.error("Failed to fetch tickers", error);
-        setAllTickers([]);
-      } finally {
-        setLoading(false);
-      }
+        setFilterTickers([]);
+        setNextCursor(null);
+      });
+    }, 250);
+
+    return () => {
+      clearTimeout(timeoutId);
+      controller.abort();
     };
-    fetchTickers();
-  }, []);
+  }, [query]);
 
+  // Live quotes: one SSE stream for the tickers in the watchlist.
+  // The server sends a full snapshot first, then only the quotes that changed.
+  const watchTickers = watchlist.map((item) => item.ticker).join(",");
   useEffect(() => {
-    const intervalId = setInterval(() => {
-      setWatchlist((watchlist) =>
-        watchlist.map((item) => {
-          const randomChange = (Math.random() - 0.5) * 2;
-          const newPrice = Math.max(0.01, item.price + randomChange);
-          const change = newPrice - item.price;
-          const pct = (change / item.price) * 100;
-          return {
-            ...item,
-            price: newPrice,
-            change: pct,
-          };
-        })
+    if (!watchTickers) return;
+
+    const source = new EventSource(
+      `${api.defaults.baseURL}/quotes/stream?tickers=${encodeURIComponent(watchTickers)}`
+    );
+    const applyQuotes = (event) => {
+      const quotes = JSON.parse(event.data);
+      setWatchlist((prev) =>
+        prev.map((item) =>
+          quotes[item.ticker] ? { ...item, ...quotes[item.ticker] } : item
+        )
       );
-    }, 1500);
+    };
+    source.addEventListener("snapshot", applyQuotes);
+    source.addEventListener("quotes", applyQuotes);
 
-    return () => clearInterval(intervalId);
-  }, []);
+    // EventSource reconnects by itself after a dropped connection, but gives up
+    // when the server rejects the stream (e.g. 503 when full), so retry later
+    let retryId;
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        retryId = setTimeout(() => setStreamRetry((prev) => prev + 1), 5000);
+      }
+    };
+
+    return () => {
+      clearTimeout(retryId);
+      source.close();
+    };
+  }, [watchTickers, streamRetry]);
 
  const getLogoUrl = (ticker) => {
   return ticker 
@@ -224,18 +275,20 @@ export default function Watchlist() {
                 <input
                   style={{ color: "black", paddingLeft: "6px" }}
                   type="text"
-                  onChange={(e) => filterTickersFunc(e.target.value)}
+                  value={query}
+                  onChange={(e) => setQuery(e.target.value)}
                 />
               </div>
             </header>
-            <div className="add-grid">
-              {filterTickers.map((ticker) => (
+            <div className="add-grid" onScroll={loadMoreTickers}>
+              {filterTickers.map((item) => (
                 <div
                   className="add-item"
-                  key={ticker.ticker}
-                  onClick={() => addWatchListItem(ticker)}
+                  key={item.ticker}
+                  title={item.name}
+                  onClick={() => addWatchListItem(item.ticker)}
                 >
-                  <span className="add-symbol">{ticker}</span>
+                  <span className="add-symbol">{item.ticker}</span>
                   <Plus size={14} className="add-icon" />
                 </div>
               ))}
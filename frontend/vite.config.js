@@ -17,7 +17,10 @@ export default defineConfig({
       interval: 100,
     },
     proxy: {
-      "/api": "http://backend:5000", //since we are in docker network, use service name 'backend' and port 5000
+      "/api": {
+        target: "http://backend:5000", //since we are in docker network, use service name 'backend' and port 5000
+        xfwd: true, // pass the client IP (X-Forwarded-For) for the backend's per-client request limit
+      },
     },
   },
 });